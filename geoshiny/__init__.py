@@ -1,31 +1,142 @@
-import asyncio
-from typing import Callable, List, Optional
+"""Render OpenStreetMap data from PostGIS.
 
-from shapely.geometry.base import BaseGeometry
+Importing geoshiny is cheap: the names below are imported from their
+modules on first access, so a process loads matplotlib, asyncpg or
+Shapely only when it uses them. geoshiny.extract and geoshiny.render
+import only the extraction or the rendering side.
+"""
+import importlib
+from typing import TYPE_CHECKING, Callable, List, Optional, Sequence
 
 from geoshiny.types import (
     ExtentDegrees,
     Geometry2DStyle,
 )
-from geoshiny.database_extract import representation_from_extent
-from geoshiny.draw_helpers import (
-    data_to_representation,
-    representation_to_figure,
-)
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+
+    from shapely.geometry.base import BaseGeometry
+
+    from geoshiny.database_extract import ExtractionBudget
+
+# public names, and the module they come from
+_LAZY_ATTRIBUTES = {
+    "ExtractionBudget": "geoshiny.database_extract",
+    "ExtractionTooLarge": "geoshiny.database_extract",
+    "batches_from_extent": "geoshiny.database_extract",
+    "representation_from_extent": "geoshiny.database_extract",
+    "data_to_representation": "geoshiny.representation_files",
+    "representation_to_figure": "geoshiny.draw_helpers",
+    "FeatureStore": "geoshiny.feature_store",
+    "tag_representer": "geoshiny.memoize",
+    "batches_to_file": "geoshiny.pipeline",
+}
+
+
+def __getattr__(name: str):
+    module = _LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_ATTRIBUTES))
 
 
 def generate_chart(
     filename: str,
     extent: ExtentDegrees,
-    representer: Callable[[int, BaseGeometry, dict], Optional[dict]],
-    renderer: Callable[[int, BaseGeometry, dict], Optional[Geometry2DStyle]],
+    representer: Callable[[int, "BaseGeometry", dict], Optional[dict]],
+    renderer: Callable[[int, "BaseGeometry", dict], Optional[Geometry2DStyle]],
     dsn=None,
     figsize=2000,
     tables: Optional[List[str]] = None,
+    memory_budget: Optional[int] = None,
+    aggregate_points: Optional[float] = None,
+    aggregate_keys: Sequence[str] = (),
+    budget: Optional["ExtractionBudget"] = None,
 ):
+    """Extract, represent and render an extent to a file in one go.
+
+    If memory_budget is given (in bytes) the features are drawn in batches
+    to keep the memory usage bounded, see render_shapes_to_numpy.
+
+    If aggregate_points is given, the points are grouped by the database
+    in cells of that many pixels, see geoshiny.aggregation.
+
+    With a budget the extraction is estimated before running it, and
+    ExtractionTooLarge is raised if it exceeds it. If aggregate_points is
+    not given the budget can fall back to aggregating the points, see
+    ExtractionBudget.
+
+    This cannot be called from a running event loop, use
+    generate_chart_async in that case.
+    """
+    import asyncio
+
     loop = asyncio.get_event_loop()
-    reprs = loop.run_until_complete(
-        representation_from_extent(extent, representer, dsn=dsn)
+    loop.run_until_complete(
+        generate_chart_async(
+            filename,
+            extent,
+            representer,
+            renderer,
+            dsn=dsn,
+            figsize=figsize,
+            tables=tables,
+            memory_budget=memory_budget,
+            aggregate_points=aggregate_points,
+            aggregate_keys=aggregate_keys,
+            budget=budget,
+        )
+    )
+
+
+async def generate_chart_async(
+    filename: str,
+    extent: ExtentDegrees,
+    representer: Callable[[int, "BaseGeometry", dict], Optional[dict]],
+    renderer: Callable[[int, "BaseGeometry", dict], Optional[Geometry2DStyle]],
+    dsn=None,
+    figsize=2000,
+    tables: Optional[List[str]] = None,
+    memory_budget: Optional[int] = None,
+    executor: Optional["Executor"] = None,
+    aggregate_points: Optional[float] = None,
+    aggregate_keys: Sequence[str] = (),
+    budget: Optional["ExtractionBudget"] = None,
+):
+    """Async version of generate_chart.
+
+    The rows are represented while being fetched and the figure is built
+    in the executor (a thread executor, the default one if not given) at
+    the same time, see geoshiny.pipeline.
+    """
+    from geoshiny.aggregation import cell_size_for_pixels
+    from geoshiny.database_extract import batches_from_extent
+    from geoshiny.pipeline import batches_to_file
+
+    point_cell_size = None
+    if aggregate_points is not None:
+        point_cell_size = cell_size_for_pixels(extent, figsize, aggregate_points)
+    await batches_to_file(
+        batches_from_extent(
+            extent,
+            dsn=dsn,
+            tables=tables,
+            point_cell_size=point_cell_size,
+            aggregate_keys=aggregate_keys,
+            budget=budget,
+        ),
+        filename,
+        extent,
+        representer,
+        renderer,
+        figsize=figsize,
+        memory_budget=memory_budget,
+        executor=executor,
     )
-    db_img = representation_to_figure(reprs, extent, renderer, figsize=figsize)
-    db_img.savefig(filename)
@@ -1,7 +1,6 @@
+import argparse
 import logging
-from typing import Optional
-
-from shapely.geometry.base import BaseGeometry
+from typing import TYPE_CHECKING, Optional
 
 from geoshiny.types import (
     ExtentDegrees,
@@ -9,6 +8,9 @@ from geoshiny.types import (
 )
 from geoshiny import generate_chart
 
+if TYPE_CHECKING:
+    from shapely.geometry.base import BaseGeometry
+
 logging.basicConfig(
     level=logging.DEBUG,
     format="%(asctime)s %(levelname)s: %(message)s",
@@ -43,7 +45,7 @@ def nice_representation(osm_id: int, geom, tags: dict) -> Optional[dict]:
     return None
 
 
-def nice_renderer(osm_id: int, shape: BaseGeometry, d: dict):
+def nice_renderer(osm_id: int, shape: "BaseGeometry", d: dict):
     water_style = Geometry2DStyle(facecolor="blue", edgecolor="darkblue", linewidth=0.1)
     wild_grass_style = Geometry2DStyle(
         facecolor="green",
@@ -92,7 +94,7 @@ def nice_renderer(osm_id: int, shape: BaseGeometry, d: dict):
         return water_style
 
 
-if __name__ == "__main__":
+def demo():
     # # Most of Berlin
     # e = ExtentDegrees(
     #     latmin=52.4650,
@@ -148,3 +150,88 @@ if __name__ == "__main__":
     # with plt.xkcd():
     generate_chart("generated.png", extent, nice_representation, nice_renderer)
     logger.info("done!")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m geoshiny",
+        description="Without a command, render the demo chart to generated.png",
+    )
+    commands = parser.add_subparsers(dest="command")
+    serve_parser = commands.add_parser(
+        "serve", help="Serve /{z}/{x}/{y}.png tiles rendered on demand"
+    )
+    serve_parser.add_argument(
+        "module", help="Python module with the representer and the renderer"
+    )
+    serve_parser.add_argument("--representer", default="representation")
+    serve_parser.add_argument("--renderer", default="renderer")
+    serve_parser.add_argument(
+        "--representation-file",
+        help="JSONL representation file to use instead of PostGIS",
+    )
+    serve_parser.add_argument(
+        "--dsn", help="PostGIS connection string, by default PGIS_CONN_STR"
+    )
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--tile-size", type=int, help="Side of the tiles in pixels")
+    serve_parser.add_argument(
+        "--cache-mb",
+        type=int,
+        help="Size of the in-memory tile cache",
+    )
+    serve_parser.add_argument(
+        "--tile-store", help="SQLite file where to persist the rendered tiles"
+    )
+    serve_parser.add_argument(
+        "--tile-store-mb", type=int, help="Maximum size of the tile store"
+    )
+    serve_parser.add_argument(
+        "--tile-store-max-age",
+        type=float,
+        help="Hours after which stored tiles are rendered again",
+    )
+    serve_parser.add_argument("--workers", type=int, help="Number of render workers")
+    serve_parser.add_argument(
+        "--threads",
+        action="store_true",
+        help="Render in threads instead of processes",
+    )
+    args = parser.parse_args()
+
+    if args.command is None:
+        demo()
+        return
+    # imported here to not slow down the demo and --help
+    from geoshiny.tile_server import serve
+    from geoshiny.tiles import DEFAULT_CACHE_BYTES, TILE_SIZE
+
+    serve(
+        args.module,
+        representer_name=args.representer,
+        renderer_name=args.renderer,
+        representation_file=args.representation_file,
+        dsn=args.dsn,
+        host=args.host,
+        port=args.port,
+        tile_size=args.tile_size if args.tile_size is not None else TILE_SIZE,
+        cache_bytes=(
+            args.cache_mb * 1024 ** 2 if args.cache_mb is not None else DEFAULT_CACHE_BYTES
+        ),
+        workers=args.workers,
+        processes=not args.threads,
+        tile_store=args.tile_store,
+        tile_store_bytes=(
+            args.tile_store_mb * 1024 ** 2 if args.tile_store_mb is not None else None
+        ),
+        tile_store_max_age=(
+            args.tile_store_max_age * 3600
+            if args.tile_store_max_age is not None
+            else None
+        ),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Points aggregated on a grid by the database.
+
+With a cell size, points are grouped by PostGIS on a grid instead of being
+fetched one by one, see geom_batches_in_extent. Every cell comes as a
+single row, with the centroid of its points as the geometry and the tags
+of one of them plus AGGREGATE_COUNT_TAG, the number of points. The
+helpers here turn a cell in a shape to draw, with Geometry2DStyle.shape.
+"""
+import math
+
+from shapely.geometry import Point, box
+from shapely.geometry.base import BaseGeometry
+
+from geoshiny.types import ExtentDegrees
+
+# tag added to aggregated rows, with the number of points in the cell
+AGGREGATE_COUNT_TAG = "geoshiny:count"
+# default size of a cell, in output pixels
+DEFAULT_CELL_PIXELS = 4
+# number of points for which a marker fills its cell
+DEFAULT_SATURATION_COUNT = 100
+
+
+def cell_size_for_pixels(
+    extent: ExtentDegrees,
+    figsize: int,
+    cell_pixels: float = DEFAULT_CELL_PIXELS,
+) -> float:
+    """Size in EPSG:3857 units of a cell of cell_pixels output pixels.
+
+    figsize is the width of the output in pixels, as in generate_chart.
+    """
+    lonmin, _, lonmax, _ = extent.as_epsg3857()
+    return (lonmax - lonmin) / figsize * cell_pixels
+
+
+def aggregated_count(tags: dict) -> int:
+    """Number of points in an aggregated row, 1 for not aggregated ones."""
+    return tags.get(AGGREGATE_COUNT_TAG, 1)
+
+
+def cell_shape(geom: BaseGeometry, cell_size: float) -> BaseGeometry:
+    """The square of the grid containing an aggregated row.
+
+    The centroid of the points of a cell is inside the cell, so the cell
+    is found again by snapping it to the grid, like ST_SnapToGrid does.
+    """
+    x = round(geom.x / cell_size) * cell_size
+    y = round(geom.y / cell_size) * cell_size
+    half = cell_size / 2
+    return box(x - half, y - half, x + half, y + half)
+
+
+def marker_shape(
+    geom: BaseGeometry,
+    count: int,
+    cell_size: float,
+    saturation_count: int = DEFAULT_SATURATION_COUNT,
+) -> BaseGeometry:
+    """A circle at the centroid with area proportional to the count.
+
+    The circle fills the cell for saturation_count points or more.
+    """
+    radius = cell_size / 2 * math.sqrt(min(count, saturation_count) / saturation_count)
+    return Point(geom.x, geom.y).buffer(radius)
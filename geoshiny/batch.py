@@ -0,0 +1,151 @@
+"""Render many charts sharing a single extraction.
+
+The union of the extents of all the jobs is extracted from the database
+and represented once, then every job renders its own subset in a process
+pool.
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from shapely.geometry.base import BaseGeometry
+
+from geoshiny.draw_helpers import representation_to_figure
+from geoshiny.feature_store import FeatureStore
+from geoshiny.types import ExtentDegrees, Geometry2DStyle
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ChartJob:
+    """A single chart to produce, see generate_chart for the meaning."""
+
+    extent: ExtentDegrees
+    renderer: Callable[[int, BaseGeometry, dict], Optional[Geometry2DStyle]]
+    filename: str
+    figsize: int = 2000
+
+
+@dataclass
+class BatchTimings:
+    """Time spent, in seconds, by the phases of a batch."""
+
+    extraction: float = 0.0
+    # wall time of the rendering phase, jobs are rendered in parallel
+    rendering: float = 0.0
+    # time spent by each job, by filename
+    jobs: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def total(self) -> float:
+        return self.extraction + self.rendering
+
+
+def union_extent(jobs: Sequence[ChartJob]) -> ExtentDegrees:
+    """The smallest extent containing all the jobs."""
+    if len(jobs) == 0:
+        raise ValueError("No jobs, there is no extent to contain")
+    extent = jobs[0].extent
+    for job in jobs[1:]:
+        extent = extent.union(job.extent)
+    return extent
+
+
+def _render_job(
+    job: ChartJob,
+    representations: FeatureStore,
+) -> float:
+    start = time.perf_counter()
+    fig = representation_to_figure(
+        representations, job.extent, job.renderer, figsize=job.figsize
+    )
+    fig.savefig(job.filename)
+    return time.perf_counter() - start
+
+
+def render_jobs(
+    representations: Iterable[Tuple[int, BaseGeometry, dict]],
+    jobs: Sequence[ChartJob],
+    processes: Optional[int] = None,
+    timings: Optional[BatchTimings] = None,
+) -> BatchTimings:
+    """Render the jobs from already extracted representations.
+
+    Every job receives only the representations overlapping its extent.
+    The renderers are sent to other processes, so they have to be
+    picklable, e.g. functions defined at module level.
+    """
+    if timings is None:
+        timings = BatchTimings()
+    start = time.perf_counter()
+    if not isinstance(representations, FeatureStore):
+        representations = FeatureStore.from_representations(representations)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {}
+        for job in jobs:
+            # only the features of the subset are pickled
+            subset = representations.query(job.extent)
+            logger.debug(f"Job {job.filename} has {len(subset)} representations")
+            futures[job.filename] = executor.submit(_render_job, job, subset)
+        for filename, future in futures.items():
+            timings.jobs[filename] = future.result()
+    timings.rendering = time.perf_counter() - start
+    return timings
+
+
+async def generate_charts_async(
+    jobs: Sequence[ChartJob],
+    representer: Callable[[int, BaseGeometry, dict], Optional[dict]],
+    dsn=None,
+    schema: str = "osm",
+    tables: Optional[List[str]] = None,
+    processes: Optional[int] = None,
+) -> BatchTimings:
+    """Async version of generate_charts."""
+    # imported here so that the rendering processes do not load asyncpg
+    from geoshiny.database_extract import representation_from_extent
+
+    timings = BatchTimings()
+    if len(jobs) == 0:
+        return timings
+    start = time.perf_counter()
+    reprs = await representation_from_extent(
+        union_extent(jobs), representer, schema=schema, dsn=dsn, tables=tables
+    )
+    timings.extraction = time.perf_counter() - start
+    logger.info(f"Extracted {len(reprs)} representations in {timings.extraction:.2f}s")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, render_jobs, reprs, jobs, processes, timings
+    )
+
+
+def generate_charts(
+    jobs: Sequence[ChartJob],
+    representer: Callable[[int, BaseGeometry, dict], Optional[dict]],
+    dsn=None,
+    schema: str = "osm",
+    tables: Optional[List[str]] = None,
+    processes: Optional[int] = None,
+) -> BatchTimings:
+    """Generate many charts with a single extraction and representation.
+
+    The charts can have different extents, renderers and sizes, the
+    representer is the same for all of them. Returns the time spent in
+    each phase, without jobs nothing is extracted.
+    """
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(
+        generate_charts_async(
+            jobs,
+            representer,
+            dsn=dsn,
+            schema=schema,
+            tables=tables,
+            processes=processes,
+        )
+    )
@@ -1,20 +1,41 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from os import environ
 from functools import lru_cache
 import json
 import logging
-from typing import AsyncGenerator, Callable, List, Optional, Tuple
+import time
+from typing import AsyncGenerator, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
 
 import asyncpg
+import numpy as np
+import shapely
 import shapely.geometry
 import shapely.wkb
 from shapely.geometry.base import BaseGeometry
 
+from geoshiny.aggregation import AGGREGATE_COUNT_TAG
+from geoshiny.memoize import TagRepresenter
 from geoshiny.types import ExtentDegrees
 
 logger = logging.getLogger(__name__)
 
 
+# maximum number of rows fetched at once
 QUERY_CHUNK_SIZE = 500_000
+# rows fetched by the first batch, before knowing how big they are
+INITIAL_BATCH_ROWS = 1_000
+# default memory a batch of rows should take, used to size the fetches
+DEFAULT_BATCH_BYTES = 32 * 1024 * 1024
+# estimated memory used by a row, besides the geometry and the tags
+ROW_OVERHEAD_BYTES = 200
+# rows used to estimate the size of the tags of a batch
+TAGS_SAMPLE_ROWS = 64
+# how long to reuse the list of tables and their statistics, in seconds
+CATALOG_CACHE_SECONDS = 600
+# relative margin added to the estimated extent of the tables when pruning
+ESTIMATED_EXTENT_MARGIN = 0.25
 
 
 @lru_cache()
@@ -41,7 +62,49 @@ def build_tags_join_query(schema: str, tables: Tuple[str]) -> str:
     return "\n UNION ALL \n ".join(subs)
 
 
-async def get_connection(dsn: str) -> asyncpg.Connection:
+@lru_cache()
+def build_aggregated_points_query(schema: str, tables: Tuple[str]) -> str:
+    """Generate a query grouping the points of multiple tables on a grid.
+
+    Like build_tags_join_query, but $5 is the size of the grid cells and
+    $6 an array of tag keys: points are grouped by cell and by the values
+    of these tags. Every group gives the centroid of its points, their
+    number and the osm_id and tags of the one with the lowest osm_id.
+    """
+    subs = [
+        f"""
+        SELECT
+            {schema}.{t}.osm_id,
+            geom,
+            array(SELECT tags ->> k FROM unnest($6::text[]) AS k) AS tag_values
+        FROM {schema}.{t} JOIN {schema}.tags
+            ON abs({schema}.{t}.osm_id) = {schema}.tags.osm_id
+        WHERE
+        geom && st_makeenvelope($1, $2, $3, $4, 3857)
+        """
+        for t in tables
+    ]
+    points = "\n UNION ALL \n ".join(subs)
+    return f"""
+    SELECT cells.osm_id, cells.geom, tags, cells.count
+    FROM (
+        SELECT
+            min(osm_id) AS osm_id,
+            count(*) AS count,
+            st_centroid(st_collect(geom)) AS geom
+        FROM ({points}) AS points
+        GROUP BY st_snaptogrid(geom, $5), tag_values
+    ) AS cells JOIN {schema}.tags
+        ON abs(cells.osm_id) = {schema}.tags.osm_id
+    """
+
+
+async def get_connection(dsn: str, decode_geometries: bool = True) -> asyncpg.Connection:
+    """Connect to PostGIS, with codecs for the geometry and jsonb types.
+
+    With decode_geometries=False the geometries are returned as WKB bytes,
+    to decode many of them at once with shapely.from_wkb.
+    """
     conn = await asyncpg.connect(dsn=dsn)
 
     def encode_geometry(geometry):
@@ -58,7 +121,7 @@ async def get_connection(dsn: str) -> asyncpg.Connection:
     await conn.set_type_codec(
         "geometry",  # also works for 'geography'
         encoder=encode_geometry,
-        decoder=decode_geometry,
+        decoder=decode_geometry if decode_geometries else bytes,
         format="binary",
     )
     await conn.set_type_codec(
@@ -67,24 +130,141 @@ async def get_connection(dsn: str) -> asyncpg.Connection:
     return conn
 
 
+@dataclass
+class TableStats:
+    """Planner statistics about a table with a geom column."""
+
+    name: str
+    # from pg_class.reltuples, negative if never analyzed
+    estimated_rows: float
+    # whether the table was ever analyzed, otherwise the statistics are meaningless
+    analyzed: bool
+    # from ST_EstimatedExtent, in the same order of ExtentDegrees.as_epsg3857,
+    # None if not available
+    bounds: Optional[Tuple[float, float, float, float]]
+
+    def overlaps(self, bounds: Tuple[float, float, float, float]) -> bool:
+        """Whether the table can have geometries in the bounds.
+
+        ST_EstimatedExtent is computed from a sample and ignores outliers,
+        so the estimated extent is enlarged by ESTIMATED_EXTENT_MARGIN. The
+        row count alone is not trusted, a table may have been loaded after
+        the last analysis.
+        """
+        if not self.analyzed or self.bounds is None:
+            return True
+        xmin, ymin, xmax, ymax = self.bounds
+        margin_x = (xmax - xmin) * ESTIMATED_EXTENT_MARGIN
+        margin_y = (ymax - ymin) * ESTIMATED_EXTENT_MARGIN
+        return not (
+            xmax + margin_x < bounds[0]
+            or xmin - margin_x > bounds[2]
+            or ymax + margin_y < bounds[1]
+            or ymin - margin_y > bounds[3]
+        )
+
+
+# catalog lookups, by connection string and schema
+_catalog_cache: Dict[Tuple[str, str], Tuple[float, Dict[str, TableStats]]] = {}
+
+
+def clear_catalog_cache():
+    """Forget the cached tables and statistics, e.g. after an import."""
+    _catalog_cache.clear()
+
+
+async def table_statistics(
+    conn,
+    schema: str = "osm",
+    cache_key: Optional[str] = None,
+) -> Dict[str, TableStats]:
+    """Get the tables with a geom column and their statistics.
+
+    When a cache_key (usually the connection string) is given the result
+    is cached for CATALOG_CACHE_SECONDS.
+    """
+    if cache_key is not None:
+        cached = _catalog_cache.get((cache_key, schema))
+        if cached is not None and cached[0] > time.monotonic() - CATALOG_CACHE_SECONDS:
+            return cached[1]
+    records = await conn.fetch(
+        """
+    SELECT
+        c.table_name,
+        cl.reltuples,
+        coalesce(s.last_analyze, s.last_autoanalyze) IS NOT NULL AS analyzed,
+        st_xmin(e.extent) AS xmin,
+        st_ymin(e.extent) AS ymin,
+        st_xmax(e.extent) AS xmax,
+        st_ymax(e.extent) AS ymax
+    FROM information_schema.columns c
+    JOIN pg_namespace n ON n.nspname = c.table_schema
+    JOIN pg_class cl ON cl.relnamespace = n.oid AND cl.relname = c.table_name
+    LEFT JOIN pg_stat_user_tables s ON s.relid = cl.oid
+    LEFT JOIN LATERAL (
+        SELECT st_estimatedextent(c.table_schema, c.table_name, 'geom') AS extent
+    ) e ON true
+    WHERE
+        c.table_schema = $1
+    AND c.column_name = 'geom';
+    """,
+        schema,
+    )
+    stats = {
+        r["table_name"]: TableStats(
+            name=r["table_name"],
+            estimated_rows=r["reltuples"],
+            analyzed=r["analyzed"],
+            bounds=None
+            if r["xmin"] is None
+            else (r["xmin"], r["ymin"], r["xmax"], r["ymax"]),
+        )
+        for r in records
+    }
+    if cache_key is not None:
+        _catalog_cache[(cache_key, schema)] = (time.monotonic(), stats)
+    return stats
+
+
+def prune_tables(
+    tables: List[str],
+    stats: Dict[str, TableStats],
+    bounds: Tuple[float, float, float, float],
+) -> List[str]:
+    """Remove the tables that cannot overlap the bounds.
+
+    The order of the tables is kept, as it decides which geometries are
+    drawn on top. Tables without statistics are kept.
+    """
+    kept = []
+    for t in tables:
+        table_stats = stats.get(t)
+        if table_stats is None or table_stats.overlaps(bounds):
+            kept.append(t)
+        else:
+            logger.debug(f"Skipping table {t}, it does not overlap the extent")
+    return kept
+
+
 async def geometry_tables(
     conn,
     tables: Optional[List[str]] = None,
     schema: str = "osm",
+    extent: Optional[ExtentDegrees] = None,
+    cache_key: Optional[str] = None,
 ) -> List[str]:
+    """Find the tables to extract data from.
+
+    If tables is not given all the tables with a geom column are used.
+    If an extent is given, the tables that according to the planner
+    statistics cannot overlap it are skipped. See table_statistics for
+    cache_key.
+    """
+    stats: Dict[str, TableStats] = {}
+    if tables is None or extent is not None:
+        stats = await table_statistics(conn, schema, cache_key)
     if tables is None:
-        records = await conn.fetch(
-            """
-        SELECT
-            table_name
-        FROM information_schema.columns
-        WHERE
-            table_schema = $1
-        AND column_name = 'geom';
-        """,
-            schema,
-        )
-        tables = [r["table_name"] for r in records]
+        tables = list(stats)
 
     geom_tables: List[str] = []
 
@@ -98,9 +278,284 @@ async def geometry_tables(
             geom_tables.append(t)
         else:
             logger.warn(f"Table {full_name} has no known geometry type")
+    if extent is not None:
+        geom_tables = prune_tables(geom_tables, stats, extent.as_epsg3857())
     return geom_tables
 
 
+@dataclass
+class RecordBatch:
+    """A batch of rows, stored by column.
+
+    Iterating over it gives the (osm_id, geom, tags) rows.
+    """
+
+    osm_ids: np.ndarray
+    # Shapely geometries, usable with the vectorized Shapely 2 functions
+    geometries: np.ndarray
+    tags: List[dict]
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+    def __iter__(self) -> Iterator[Tuple[int, BaseGeometry, dict]]:
+        return zip(self.osm_ids.tolist(), self.geometries, self.tags)
+
+
+def _decode_batch(
+    records: List[asyncpg.Record],
+    columnar: bool,
+    aggregated: bool = False,
+) -> Tuple[Union[List[Tuple[int, BaseGeometry, dict]], RecordBatch], int]:
+    """Decode the geometries of a batch and estimate its size in bytes.
+
+    Rows of build_aggregated_points_query have their count added to the
+    tags, as AGGREGATE_COUNT_TAG.
+    """
+    geoms = [r["geom"] for r in records]
+    if any(isinstance(g, bytes) for g in geoms):
+        nbytes = sum(len(g) for g in geoms if g is not None)
+        geometries = shapely.from_wkb(geoms)
+    else:
+        geometries = np.array(geoms, dtype=object)
+        nbytes = 16 * int(shapely.get_num_coordinates(geometries).sum())
+
+    if aggregated:
+        tags = [{**(r["tags"] or {}), AGGREGATE_COUNT_TAG: r["count"]} for r in records]
+    else:
+        tags = [r["tags"] for r in records]
+    sample = tags[:TAGS_SAMPLE_ROWS]
+    sample_bytes = sum(
+        sum(len(k) + len(str(v)) for k, v in t.items()) for t in sample if t
+    )
+    nbytes += sample_bytes * len(tags) // max(len(sample), 1)
+    nbytes += ROW_OVERHEAD_BYTES * len(records)
+
+    if columnar:
+        osm_ids = np.fromiter((r["osm_id"] for r in records), dtype=np.int64, count=len(records))
+        return RecordBatch(osm_ids, geometries, tags), nbytes
+    return [(r["osm_id"], g, t) for r, g, t in zip(records, geometries, tags)], nbytes
+
+
+def next_batch_size(batch_rows: int, batch_bytes: int, target_bytes: int) -> int:
+    """How many rows to fetch next to get close to target_bytes."""
+    if batch_bytes <= 0:
+        return QUERY_CHUNK_SIZE
+    rows = int(target_bytes * batch_rows / batch_bytes)
+    return max(1, min(rows, QUERY_CHUNK_SIZE))
+
+
+async def _fetch_batches(
+    conn: asyncpg.Connection,
+    query: str,
+    args: tuple,
+    target_bytes: int,
+    columnar: bool,
+    aggregated: bool = False,
+) -> AsyncGenerator[Union[List[Tuple[int, BaseGeometry, dict]], RecordBatch], None]:
+    loop = asyncio.get_running_loop()
+    batch_rows = INITIAL_BATCH_ROWS
+    # decoding a large batch would block the event loop, it does not use the
+    # default executor where a consumer of the batches can be waiting
+    decoder = ThreadPoolExecutor(1, thread_name_prefix="geoshiny-decode")
+    try:
+        async with conn.transaction():
+            cursor = await conn.cursor(query, *args)
+            while True:
+                records = await cursor.fetch(batch_rows)
+                if len(records) == 0:
+                    return
+                batch, batch_bytes = await loop.run_in_executor(
+                    decoder, _decode_batch, records, columnar, aggregated
+                )
+                yield batch
+                if len(records) < batch_rows:
+                    return
+                batch_rows = next_batch_size(len(records), batch_bytes, target_bytes)
+                logger.debug(f"Fetched {len(records)} rows, {batch_bytes} bytes, next fetch {batch_rows} rows")
+    finally:
+        decoder.shutdown(wait=False)
+
+
+async def geom_batches_in_extent(
+    conn: asyncpg.Connection,
+    schema: str,
+    extent: ExtentDegrees,
+    tables: List[str],
+    target_bytes: int = DEFAULT_BATCH_BYTES,
+    columnar: bool = False,
+    point_cell_size: Optional[float] = None,
+    aggregate_keys: Sequence[str] = (),
+) -> AsyncGenerator[Union[List[Tuple[int, BaseGeometry, dict]], RecordBatch], None]:
+    """Like geoms_in_extent, but yields batches of rows.
+
+    The number of rows fetched at once adapts to the measured size of the
+    rows, so that every batch takes about target_bytes of memory.
+    The batches are lists of (osm_id, geom, tags) tuples, or RecordBatch
+    objects if columnar is True.
+
+    If the connection was created with decode_geometries=False the
+    geometries are decoded a whole batch at once.
+
+    If point_cell_size is given, the points of the point tables are
+    grouped on a grid with cells of that size, in EPSG:3857 units, and
+    each cell is a single row with the number of points in the tags, see
+    geoshiny.aggregation. Points with different values for the
+    aggregate_keys tags are in different rows. The other tables come
+    first, as usual.
+    """
+    for query, args, aggregated in _extraction_queries(
+        schema, extent, tables, point_cell_size, aggregate_keys
+    ):
+        async for batch in _fetch_batches(conn, query, args, target_bytes, columnar, aggregated):
+            yield batch
+
+
+def _extraction_queries(
+    schema: str,
+    extent: ExtentDegrees,
+    tables: List[str],
+    point_cell_size: Optional[float],
+    aggregate_keys: Sequence[str],
+) -> List[Tuple[str, tuple, bool]]:
+    """The queries to run, with their arguments and whether they aggregate."""
+    bounds = extent.as_epsg3857()
+    point_tables: List[str] = []
+    if point_cell_size is not None:
+        point_tables = [t for t in tables if t.endswith("point")]
+        tables = [t for t in tables if not t.endswith("point")]
+    queries = []
+    if len(tables) > 0:
+        queries.append((build_tags_join_query(schema, tuple(tables)), bounds, False))
+    if len(point_tables) > 0:
+        queries.append(
+            (
+                build_aggregated_points_query(schema, tuple(point_tables)),
+                (*bounds, point_cell_size, list(aggregate_keys)),
+                True,
+            )
+        )
+    return queries
+
+
+class ExtractionTooLarge(Exception):
+    """Raised when the estimate of an extraction exceeds its budget."""
+
+    def __init__(self, estimate: "ExtractionEstimate", budget: "ExtractionBudget"):
+        super().__init__(
+            f"Estimated {estimate.rows:.0f} rows and {estimate.bytes:.0f} bytes, "
+            f"the budget is {budget.max_rows} rows and {budget.max_bytes} bytes"
+        )
+        self.estimate = estimate
+        self.budget = budget
+
+
+@dataclass
+class ExtractionEstimate:
+    """Rows and bytes an extraction is expected to return, from EXPLAIN."""
+
+    rows: float
+    # rows times the average width of a row according to the planner
+    bytes: float
+
+
+@dataclass
+class ExtractionBudget:
+    """Limits to the estimated size of an extraction.
+
+    When the estimate exceeds them and fallback_cell_size is given (in
+    EPSG:3857 units, see geoshiny.aggregation.cell_size_for_pixels) the
+    points are aggregated on a grid of that size, if the extraction is
+    still too large ExtractionTooLarge is raised.
+    """
+
+    max_rows: Optional[float] = None
+    max_bytes: Optional[float] = None
+    fallback_cell_size: Optional[float] = None
+
+    def allows(self, estimate: ExtractionEstimate) -> bool:
+        return (self.max_rows is None or estimate.rows <= self.max_rows) and (
+            self.max_bytes is None or estimate.bytes <= self.max_bytes
+        )
+
+
+async def estimate_extraction(
+    conn: asyncpg.Connection,
+    schema: str,
+    extent: ExtentDegrees,
+    tables: List[str],
+    point_cell_size: Optional[float] = None,
+    aggregate_keys: Sequence[str] = (),
+) -> ExtractionEstimate:
+    """Estimate the size of geom_batches_in_extent with the same arguments.
+
+    The queries are not executed, only planned with EXPLAIN, so this is
+    as accurate as the table statistics.
+    """
+    rows = 0.0
+    nbytes = 0.0
+    for query, args, _ in _extraction_queries(
+        schema, extent, tables, point_cell_size, aggregate_keys
+    ):
+        plan = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *args)
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        top = plan[0]["Plan"]
+        rows += top["Plan Rows"]
+        nbytes += top["Plan Rows"] * top["Plan Width"]
+    return ExtractionEstimate(rows=rows, bytes=nbytes)
+
+
+async def budgeted_cell_size(
+    conn: asyncpg.Connection,
+    schema: str,
+    extent: ExtentDegrees,
+    tables: List[str],
+    budget: ExtractionBudget,
+    point_cell_size: Optional[float] = None,
+    aggregate_keys: Sequence[str] = (),
+) -> Optional[float]:
+    """Check an extraction against the budget before running it.
+
+    Returns the cell size to aggregate the points with, point_cell_size
+    or the fallback of the budget, or raises ExtractionTooLarge.
+    """
+    estimate = await estimate_extraction(conn, schema, extent, tables, point_cell_size, aggregate_keys)
+    logger.debug(f"Estimated extraction: {estimate}")
+    if budget.allows(estimate):
+        return point_cell_size
+    if point_cell_size is None and budget.fallback_cell_size is not None:
+        cell_size = budget.fallback_cell_size
+        estimate = await estimate_extraction(conn, schema, extent, tables, cell_size, aggregate_keys)
+        logger.info(f"Extraction over budget, aggregating points: {estimate}")
+        if budget.allows(estimate):
+            return cell_size
+    raise ExtractionTooLarge(estimate, budget)
+
+
+async def estimate_from_extent(
+    extent: ExtentDegrees,
+    schema: str = "osm",
+    dsn=None,
+    tables: Optional[List[str]] = None,
+    point_cell_size: Optional[float] = None,
+    aggregate_keys: Sequence[str] = (),
+) -> ExtractionEstimate:
+    """Estimate the size of batches_from_extent, see estimate_extraction."""
+    if dsn is None:
+        dsn = environ["PGIS_CONN_STR"]
+    conn = await get_connection(dsn, decode_geometries=False)
+    try:
+        geom_tables = await geometry_tables(
+            conn, tables, schema, extent=extent, cache_key=dsn
+        )
+        return await estimate_extraction(
+            conn, schema, extent, geom_tables, point_cell_size, aggregate_keys
+        )
+    finally:
+        await conn.close()
+
+
 async def raw_data_from_extent(
     extent: ExtentDegrees,
     schema: str = "osm",
@@ -110,7 +565,9 @@ async def raw_data_from_extent(
     if dsn is None:
         dsn = environ["PGIS_CONN_STR"]
     conn = await get_connection(dsn)
-    geom_tables = await geometry_tables(conn, tables, schema)
+    geom_tables = await geometry_tables(
+        conn, tables, schema, extent=extent, cache_key=dsn
+    )
 
     # TODO return async generators instead?
     # would force the user to use async
@@ -126,29 +583,105 @@ async def representation_from_extent(
     schema: str = "osm",
     dsn=None,
     tables: Optional[List[str]] = None,
+    point_cell_size: Optional[float] = None,
+    aggregate_keys: Sequence[str] = (),
+    budget: Optional[ExtractionBudget] = None,
 ) -> List[Tuple[int, BaseGeometry, dict]]:
-    if dsn is None:
-        dsn = environ["PGIS_CONN_STR"]
-    conn = await get_connection(dsn)
-    geom_tables = await geometry_tables(conn, tables, schema)
-
     # TODO return async generators instead?
     # would force the user to use async
     ret = []
-    async for (osm_id, geom, tags) in geoms_in_extent(
-        conn, schema, extent, geom_tables
+    async for batch in batches_from_extent(
+        extent,
+        schema,
+        dsn=dsn,
+        tables=tables,
+        point_cell_size=point_cell_size,
+        aggregate_keys=aggregate_keys,
+        budget=budget,
     ):
-        representation = representer(osm_id, geom, tags)
-        if representation is not None:
-            ret.append((osm_id, geom, representation))
+        for (osm_id, geom, tags) in batch:
+            representation = representer(osm_id, geom, tags)
+            if representation is not None:
+                ret.append((osm_id, geom, representation))
+    if isinstance(representer, TagRepresenter):
+        stats = representer.stats
+        logger.debug(f"Representer cache: {stats}, hit rate {stats.hit_rate:.1%}")
     return ret
 
 
+async def batches_from_extent(
+    extent: ExtentDegrees,
+    schema: str = "osm",
+    dsn=None,
+    tables: Optional[List[str]] = None,
+    target_bytes: int = DEFAULT_BATCH_BYTES,
+    columnar: bool = False,
+    point_cell_size: Optional[float] = None,
+    aggregate_keys: Sequence[str] = (),
+    budget: Optional[ExtractionBudget] = None,
+) -> AsyncGenerator[Union[List[Tuple[int, BaseGeometry, dict]], RecordBatch], None]:
+    """Like stream_from_extent, but yields batches of rows.
+
+    See geom_batches_in_extent for the details, also about aggregating
+    the points, the geometries are decoded a batch at a time. The
+    connection is closed once the generator is exhausted or closed.
+
+    With a budget the extraction is estimated first, and the points are
+    aggregated or ExtractionTooLarge raised before fetching anything if
+    it is too large, see budgeted_cell_size.
+    """
+    if dsn is None:
+        dsn = environ["PGIS_CONN_STR"]
+    conn = await get_connection(dsn, decode_geometries=False)
+    try:
+        geom_tables = await geometry_tables(
+            conn, tables, schema, extent=extent, cache_key=dsn
+        )
+        if budget is not None:
+            point_cell_size = await budgeted_cell_size(
+                conn, schema, extent, geom_tables, budget, point_cell_size, aggregate_keys
+            )
+        async for batch in geom_batches_in_extent(
+            conn,
+            schema,
+            extent,
+            geom_tables,
+            target_bytes=target_bytes,
+            columnar=columnar,
+            point_cell_size=point_cell_size,
+            aggregate_keys=aggregate_keys,
+        ):
+            yield batch
+    finally:
+        await conn.close()
+
+
+async def stream_from_extent(
+    extent: ExtentDegrees,
+    schema: str = "osm",
+    dsn=None,
+    tables: Optional[List[str]] = None,
+) -> AsyncGenerator[Tuple[int, BaseGeometry, dict], None]:
+    """Like raw_data_from_extent, but yields the rows while fetching them.
+
+    The rows are (osm_id, geometry, tags) tuples, with the geometry already
+    decoded, as in the batches of batches_from_extent.
+    The connection is closed once the generator is exhausted or closed.
+    """
+    if dsn is None:
+        dsn = environ["PGIS_CONN_STR"]
+    async for batch in batches_from_extent(extent, schema, dsn=dsn, tables=tables):
+        for r in batch:
+            yield r
+
+
 async def geoms_in_extent(
     conn: asyncpg.Connection, schema: str, extent: ExtentDegrees, tables: List[str]
 ) -> AsyncGenerator[asyncpg.Record, None]:
     # TODO what is the return type for this?
     # also, subclass the Record or lazily adapt it to something with proper types
+    if len(tables) == 0:
+        return
     query = build_tags_join_query(schema, tuple(tables))
     # use a cursor and build a list to not stress the DB memory too much
     # later this could be directly returned
@@ -1,22 +1,57 @@
-from contextlib import contextmanager
-import json
 import logging
-from io import TextIOWrapper
-from typing import Dict, Callable, Iterable, List, Optional, Tuple, Union
+import math
+from itertools import islice
+from typing import Dict, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
+from matplotlib.artist import Artist
+from matplotlib.axes import Axes
 from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.figure import Figure
+from matplotlib.image import imsave
 from matplotlib.patches import PathPatch
 from matplotlib.path import Path
 import numpy as np
 from numpy import asarray, concatenate, ones
+from shapely import (
+    GeometryType,
+    bounds,
+    get_coordinates,
+    get_num_coordinates,
+    get_parts,
+    get_rings,
+    get_type_id,
+    make_valid,
+    union_all,
+)
+from shapely.errors import GEOSException
 from shapely.geometry.base import BaseGeometry
-from shapely.geometry import mapping, shape
-
+from shapely.geometry import MultiPolygon
+
+from geoshiny.feature_store import FeatureStore
+# the representation files used to be handled here
+from geoshiny.representation_files import (  # noqa: F401
+    data_to_representation,
+    data_to_representation_file,
+    file_to_representation,
+)
 from geoshiny.types import ExtentDegrees, Geometry2DStyle
 
 logger = logging.getLogger(__name__)
 
+# default memory budget, in bytes, for the batched rendering
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+# rough memory cost of drawing a single vertex and a single artist
+VERTEX_BYTES = 64
+ARTIST_OVERHEAD_BYTES = 4096
+# the extent is split in this many cells per side when merging polygons
+MERGE_GRID_CELLS = 8
+# cells per side of the grid used to check that merging keeps what is on top
+MERGE_OVERLAP_CELLS = 64
+# shapes whose paths are computed at once while drawing
+PATH_CHUNK_SIZE = 1024
+# rows of the zorder layers composed at once
+COMPOSE_ROWS = 256
+
 # NOTE these three classes are from https://github.com/benjimin/descartes/blob/master/descartes/patch.py
 # it's basically the only code I could find that does this -_-
 
@@ -48,6 +83,8 @@ class Polygon:
 def to_polygon_path(polygon):
     """Constructs a compound matplotlib path from a Shapely or GeoJSON-like
     geometric object"""
+    if isinstance(polygon, BaseGeometry):
+        return polygons_to_paths([polygon])[0]
     this = Polygon(polygon)
     assert this.geom_type == "Polygon"
 
@@ -59,8 +96,12 @@ def to_polygon_path(polygon):
         vals[0] = Path.MOVETO
         return vals
 
+    def as_array(ob):
+        # Shapely 2 geometries do not expose the array interface anymore
+        return asarray(getattr(ob, "coords", ob))[:, :2]
+
     vertices = concatenate(
-        [asarray(this.exterior)[:, :2]] + [asarray(r)[:, :2] for r in this.interiors]
+        [as_array(this.exterior)] + [as_array(r) for r in this.interiors]
     )
     codes = concatenate([coding(this.exterior)] + [coding(r) for r in this.interiors])
     return Path(vertices, codes)
@@ -94,105 +135,186 @@ def coord_to_pixel(
     return x, y
 
 
-def _representation_iterator(
-    data,
-    entity_callback: Callable[[int, BaseGeometry, dict], Optional[dict]],
-):
-    for (osm_id, geom, tags) in data:
-        representation = entity_callback(osm_id, geom, tags)
-        if representation is not None:
-            yield (osm_id, geom, representation)
-
-
-@contextmanager
-def _read_file(target_file: Union[str, TextIOWrapper]):
-    if isinstance(target_file, str):
-        with open(target_file, "r") as fh:
-            yield fh
-    elif isinstance(target_file, TextIOWrapper):
-        yield target_file
-    else:
-        raise TypeError(f"Invalid type {type(target_file)}")
-
-
-@contextmanager
-def _write_file(target_file: Union[str, TextIOWrapper]):
-    if isinstance(target_file, str):
-        with open(target_file, "w") as fh:
-            yield fh
-    elif isinstance(target_file, TextIOWrapper):
-        yield target_file
-    else:
-        raise TypeError(f"Invalid type {type(target_file)}")
-
-
-def data_to_representation(
-    data,
-    entity_callback: Callable,
-) -> Iterable[Tuple[int, BaseGeometry, dict]]:
-    yield from _representation_iterator(data, entity_callback)
-
-
-def data_to_representation_file(
-    data,
-    target_file: Union[str, TextIOWrapper],
-    entity_callback: Callable,
-):
-    with _write_file(target_file) as fh:
-        for osm_id, geom, repr in _representation_iterator(data, entity_callback):
-            fh.write(
-                json.dumps(
-                    dict(
-                        osm_id=osm_id,
-                        geojson=mapping(geom),
-                        representation=repr,
-                    )
-                )
-            )
-            fh.write("\n")
-
-
-def file_to_representation(target_file: Union[str, TextIOWrapper]):
-    with _read_file(target_file) as fh:
-        for line in fh:
-            obj = json.loads(line)
-            yield (obj["osm_id"], shape(obj["geojson"]), obj["representation"])
-
-
-def representation_to_figure(
+def shapes_iterator(
     representations: Iterable[Tuple[int, BaseGeometry, dict]],
-    extent: ExtentDegrees,
     representer: Callable[[int, BaseGeometry, dict], Optional[Geometry2DStyle]],
-    figsize: int = 1500,
-) -> Figure:
-
-    to_draw = []
-
+) -> Iterator[Tuple[BaseGeometry, Geometry2DStyle]]:
+    """Apply the renderer to the representations, skipping the ignored ones."""
     for osm_id, geom, repr in representations:
         res = representer(osm_id, geom, repr)
         if res is None:
             continue
 
         new_shape = res.shape if res.shape is not None else geom
-        to_draw.append((new_shape, res))
-    return render_shapes_to_figure(extent, to_draw, figsize)
+        yield (new_shape, res)
 
 
-def render_shapes_to_figure(
+def representation_to_figure(
+    representations: Iterable[Tuple[int, BaseGeometry, dict]],
     extent: ExtentDegrees,
-    to_draw: List[Tuple[BaseGeometry, Geometry2DStyle]],
+    representer: Callable[[int, BaseGeometry, dict], Optional[Geometry2DStyle]],
     figsize: int = 1500,
+    merge_styles: bool = False,
 ) -> Figure:
-    """Renders arbitrary Shapely geometrical objects to a Figure.
+    """Render the representations to a Figure.
+
+    When representations is a FeatureStore, only the features overlapping
+    the extent are considered. With merge_styles, touching polygons with the
+    same fill-only style are merged before drawing, see merge_shapes.
+    """
+    if isinstance(representations, FeatureStore):
+        representations = representations.query(extent)
+    to_draw: Iterable[Tuple[BaseGeometry, Geometry2DStyle]] = shapes_iterator(
+        representations, representer
+    )
+    if merge_styles:
+        to_draw = merge_shapes(to_draw, extent)
+    return render_shapes_to_figure(extent, list(to_draw), figsize)
 
-    This is quite ambitious!
 
-    the to_draw argument is a list of Shapely geometrical objects and rules to
-    draw them (color, style, etc.)
+def _merge_key(style: Geometry2DStyle) -> Optional[tuple]:
+    """Key identifying the styles that can be merged, None if not mergeable.
+
+    Only styles drawing just a fill are mergeable, merging would change
+    edges, lines and labels.
+    """
+    if style.label is not None or style.edgecolor is not None or style.color is not None:
+        return None
+    if style.facecolor is None:
+        return None
+    key = tuple(sorted(style.get_drawing_options().items()))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+class _MergeGroup:
+    def __init__(self, style: Geometry2DStyle):
+        self.style = style
+        self.geoms: List[BaseGeometry] = []
+        # cells touched by shapes with other styles drawn after the group started
+        self.covered = np.zeros((MERGE_OVERLAP_CELLS, MERGE_OVERLAP_CELLS), dtype=bool)
+
+
+def _union(geoms: np.ndarray) -> BaseGeometry:
+    try:
+        union = union_all(geoms)
+    except GEOSException:
+        # OSM has quite some invalid polygons
+        union = union_all(make_valid(geoms))
+    if union.geom_type == "GeometryCollection":
+        # fixing invalid polygons can produce lines and points too
+        parts = get_parts(get_parts(union))
+        union = MultiPolygon([p for p in parts if p.geom_type == "Polygon"])
+    return union
+
+
+def merge_shapes(
+    to_draw: Iterable[Tuple[BaseGeometry, Geometry2DStyle]],
+    extent: ExtentDegrees,
+    grid_cells: int = MERGE_GRID_CELLS,
+) -> List[Tuple[BaseGeometry, Geometry2DStyle]]:
+    """Merge polygons with the same fill-only style, to draw fewer paths.
+
+    Polygons whose styles have the same drawing options and no edges,
+    color or label are merged with a union. To keep the unions small, the
+    extent is split in a grid of grid_cells x grid_cells and only the
+    polygons whose center is in the same cell are merged.
+
+    Every merged group is drawn at the position of its first polygon. A
+    polygon joins a group only if no shape with another style drawn after
+    the group started can overlap it, otherwise it starts a new group, so
+    what is on top of what does not change. The overlap is checked on the
+    bounding boxes, on a grid of MERGE_OVERLAP_CELLS x MERGE_OVERLAP_CELLS.
+    Overlapping polygons with alpha look different once merged, as the
+    overlap is not drawn twice.
     """
-    fig = Figure(figsize=(5, 5), dpi=figsize / 5, frameon=False)
-    ax = fig.add_subplot()
     lonmin, latmin, lonmax, latmax = extent.as_epsg3857()
+
+    def overlap_cells(geom: BaseGeometry) -> Tuple[slice, slice]:
+        xmin, ymin, xmax, ymax = geom.bounds
+        cols = np.clip(
+            np.array([xmin, xmax]) - lonmin, 0, None
+        ) * MERGE_OVERLAP_CELLS // (lonmax - lonmin)
+        rows = np.clip(
+            np.array([ymin, ymax]) - latmin, 0, None
+        ) * MERGE_OVERLAP_CELLS // (latmax - latmin)
+        cols = np.minimum(cols, MERGE_OVERLAP_CELLS - 1).astype(int)
+        rows = np.minimum(rows, MERGE_OVERLAP_CELLS - 1).astype(int)
+        return slice(rows[0], rows[1] + 1), slice(cols[0], cols[1] + 1)
+
+    ret: List[Union[Tuple[BaseGeometry, Geometry2DStyle], _MergeGroup]] = []
+    # the group new polygons with a given style can join
+    open_groups: Dict[tuple, _MergeGroup] = {}
+    for geom, style in to_draw:
+        key = _merge_key(style)
+        if geom.geom_type not in ("Polygon", "MultiPolygon"):
+            key = None
+        if geom.is_empty:
+            ret.append((geom, style))
+            continue
+        cells = overlap_cells(geom)
+        for group_key, open_group in open_groups.items():
+            if group_key != key:
+                open_group.covered[cells] = True
+        if key is None:
+            ret.append((geom, style))
+            continue
+        group = open_groups.get(key)
+        if group is None or group.covered[cells].any():
+            group = _MergeGroup(style)
+            open_groups[key] = group
+            ret.append(group)
+        group.geoms.append(geom)
+
+    merged: List[Tuple[BaseGeometry, Geometry2DStyle]] = []
+    groups = [item for item in ret if isinstance(item, _MergeGroup)]
+    for item in ret:
+        if not isinstance(item, _MergeGroup):
+            merged.append(item)
+            continue
+        geoms = np.array(item.geoms, dtype=object)
+        xmin, ymin, xmax, ymax = bounds(geoms).T
+        col = np.clip(
+            ((xmin + xmax) / 2 - lonmin) * grid_cells // (lonmax - lonmin), 0, grid_cells - 1
+        )
+        row = np.clip(
+            ((ymin + ymax) / 2 - latmin) * grid_cells // (latmax - latmin), 0, grid_cells - 1
+        )
+        cells = (row * grid_cells + col).astype(int)
+        for cell in np.unique(cells):
+            union = _union(geoms[cells == cell])
+            if not union.is_empty:
+                merged.append((union, item.style))
+    logger.debug(f"Merged {sum(len(g.geoms) for g in groups)} polygons in {len(groups)} groups")
+    return merged
+
+
+def _prepare_figure(
+    bounds: Tuple[float, float, float, float],
+    width: int,
+    height: int,
+    dpi: Optional[float] = None,
+) -> Tuple[Figure, Axes, float]:
+    """Create an empty Figure whose only Axes covers exactly the bounds.
+
+    The bounds are in EPSG:3857 in the order given by
+    ExtentDegrees.as_epsg3857, the figure is width x height pixels.
+    The DPI depends only on the width, so that a strip of a figure looks
+    exactly like the corresponding part of the whole figure. A block
+    narrower than the figure must be given the DPI of the whole figure.
+
+    Returns the figure, the axes and the total area of the bounds, used
+    to compare with geometries areas.
+    """
+    if dpi is None:
+        dpi = image_dpi(width)
+    fig = Figure(figsize=(5, 5), dpi=dpi, frameon=False)
+    fig.set_size_inches(_exact_inches(width, dpi), _exact_inches(height, dpi))
+    ax = fig.add_subplot()
+    lonmin, latmin, lonmax, latmax = bounds
     ax.set_ylim(latmin, latmax)
     ax.set_xlim(lonmin, lonmax)
     # the total area, used to compare with geometries areas
@@ -207,61 +329,370 @@ def render_shapes_to_figure(
     fig.subplots_adjust(top=1)
     fig.subplots_adjust(right=1)
     fig.subplots_adjust(left=0)
+    return fig, ax, total_area
 
-    for geom, style in to_draw:
-        draw_options = style.get_drawing_options()
-        label_options = style.get_label_options()
-        # the possible types are FeatureCollection, Feature, Point, LineString, MultiPoint,
-        # Polygon, MultiLineString, MultiPolygon, and GeometryCollection
-        # however I found only these three so far
-        if label_options is not None:
-            min_label_area_ratio = style.min_label_area_ratio
-            geom_size = geom.area
-            if (
-                min_label_area_ratio is None
-                or geom_size / total_area > min_label_area_ratio
-            ):
-                x, y = geom.centroid.xy
-                x = x[0]
-                y = y[0]
+
+def image_dpi(width: int) -> float:
+    """The DPI of the figures of an image width pixels wide."""
+    return width / 5
+
+
+def _exact_inches(pixels: int, dpi: float) -> float:
+    """Size in inches that Agg will turn back into exactly that many pixels.
+
+    Agg truncates the size in pixels, so a rounding error in the division
+    would lose a row or column.
+    """
+    inches = pixels / dpi
+    while int(inches * dpi) < pixels:
+        inches = math.nextafter(inches, math.inf)
+    return inches
+
+
+def polygons_to_paths(geoms: Sequence[BaseGeometry]) -> List[Optional[Path]]:
+    """Compound matplotlib paths for many polygonal geometries at once.
+
+    Returns a path for every Polygon and MultiPolygon, None for the other
+    geometries and for the empty ones. All the rings are processed together
+    with NumPy. Exteriors are made counterclockwise and holes clockwise,
+    since matplotlib fills with the nonzero rule.
+    """
+    geom_array = np.empty(len(geoms), dtype=object)
+    geom_array[:] = geoms
+    polygonal = np.flatnonzero(
+        np.isin(get_type_id(geom_array), (GeometryType.POLYGON, GeometryType.MULTIPOLYGON))
+    )
+    parts, part_geom = get_parts(geom_array[polygonal], return_index=True)
+    rings, ring_part = get_rings(parts, return_index=True)
+    ring_geom = polygonal[part_geom[ring_part]]
+    coords, coord_ring = get_coordinates(rings, return_index=True)
+
+    ring_counts = np.bincount(coord_ring, minlength=len(rings))
+    ring_starts = np.cumsum(ring_counts) - ring_counts
+    # twice the signed area of every ring, positive if counterclockwise
+    cross = np.zeros(len(coords))
+    cross[:-1] = coords[:-1, 0] * coords[1:, 1] - coords[1:, 0] * coords[:-1, 1]
+    cross[ring_starts + ring_counts - 1] = 0
+    areas = np.bincount(coord_ring, weights=cross, minlength=len(rings))
+    # the first ring of every polygon is the exterior
+    is_exterior = np.ones(len(rings), dtype=bool)
+    is_exterior[1:] = ring_part[1:] != ring_part[:-1]
+    flip = np.where(is_exterior, areas < 0, areas > 0)
+
+    positions = np.arange(len(coords))
+    first = ring_starts[coord_ring]
+    last = first + ring_counts[coord_ring] - 1
+    vertices = coords[np.where(flip[coord_ring], first + last - positions, positions)]
+    codes = np.full(len(coords), Path.LINETO, dtype=Path.code_type)
+    codes[ring_starts[ring_counts > 0]] = Path.MOVETO
+
+    geom_counts = np.bincount(ring_geom[coord_ring], minlength=len(geoms))
+    geom_ends = np.cumsum(geom_counts)
+    paths: List[Optional[Path]] = [None] * len(geoms)
+    for i in polygonal[geom_counts[polygonal] > 0]:
+        start = geom_ends[i] - geom_counts[i]
+        paths[i] = Path(vertices[start: geom_ends[i]], codes[start: geom_ends[i]])
+    return paths
+
+
+def _line_coordinates(geom: BaseGeometry) -> np.ndarray:
+    """Coordinates of the parts of a linear geometry, separated by NaN."""
+    coords, part = get_coordinates(get_parts(geom), return_index=True)
+    breaks = np.flatnonzero(part[1:] != part[:-1]) + 1
+    return np.insert(coords, breaks, np.nan, axis=0)
+
+
+def _draw_geometry(
+    ax: Axes,
+    geom: BaseGeometry,
+    draw_options: dict,
+    path: Optional[Path] = None,
+) -> List[Artist]:
+    """Add the artists of a geometry, path is its polygon path if known."""
+    if geom.is_empty:
+        return []
+    geom_type = geom.geom_type
+
+    if geom_type in ("Polygon", "MultiPolygon"):
+        if path is None:
+            path = polygons_to_paths([geom])[0]
+            if path is None:
+                return []
+        return [ax.add_patch(PathPatch(path, **draw_options))]
+
+    if geom_type in ("LineString", "LinearRing", "MultiLineString"):
+        coords = _line_coordinates(geom)
+        return list(ax.plot(coords[:, 0], coords[:, 1], **draw_options))
+
+    if geom_type in ("Point", "MultiPoint"):
+        coords = get_coordinates(geom)
+        return [ax.scatter(coords[:, 0], coords[:, 1], **draw_options)]
+
+    if geom_type == "GeometryCollection":
+        artists: List[Artist] = []
+        for sub_geom in geom.geoms:
+            artists.extend(_draw_geometry(ax, sub_geom, draw_options))
+        return artists
+
+    raise ValueError(f"Cannot draw type {geom_type}")
+
+
+def _draw_shape(
+    ax: Axes,
+    geom: BaseGeometry,
+    style: Geometry2DStyle,
+    total_area: float,
+    path: Optional[Path] = None,
+) -> List[Artist]:
+    """Add the artists representing a geometry to the axes.
+
+    The artists are returned so that the caller can get rid of them once
+    they are drawn. path is the one from polygons_to_paths, if already
+    computed.
+    """
+    artists: List[Artist] = []
+    draw_options = style.get_drawing_options()
+    label_options = style.get_label_options()
+    if label_options is not None:
+        min_label_area_ratio = style.min_label_area_ratio
+        geom_size = geom.area
+        if (
+            min_label_area_ratio is None
+            or geom_size / total_area > min_label_area_ratio
+        ):
+            x, y = geom.centroid.xy
+            x = x[0]
+            y = y[0]
+            artists.append(
                 ax.text(
                     x,
                     y,
                     label_options["text"],
                     **{k: v for k, v in label_options.items() if k != "text"},
                 )
-        try:
-            if geom.type == "LineString":
-                x, y = geom.xy
-                ax.plot(x, y, **draw_options)
-                continue
-
-            if geom.type == "Polygon":
-                patch = create_polygon_patch(geom, **draw_options)
-                ax.add_patch(patch)
-                continue
-
-            if geom.type == "MultiPolygon":
-                for sub_geom in geom.geoms:
-                    patch = create_polygon_patch(sub_geom, **draw_options)
-                    ax.add_patch(patch)
-                continue
-
-            if geom.type == "Point":
-                x, y = geom.xy
-                ax.scatter(x, y, **draw_options)
-                continue
-
-            raise ValueError(f"Cannot draw type {geom.type}")
-
-        except AttributeError:
-            logger.exception(
-                f"Error drawing, will skip {geom}, options: {draw_options}"
             )
+    try:
+        artists.extend(_draw_geometry(ax, geom, draw_options, path))
+    except AttributeError:
+        logger.exception(f"Error drawing, will skip {geom}, options: {draw_options}")
+    return artists
+
+
+def _with_paths(
+    to_draw: Iterable[Tuple[BaseGeometry, Geometry2DStyle]],
+) -> Iterator[Tuple[BaseGeometry, Geometry2DStyle, Optional[Path]]]:
+    """Add the polygon paths to the shapes, computing them in chunks."""
+    iterator = iter(to_draw)
+    while chunk := list(islice(iterator, PATH_CHUNK_SIZE)):
+        paths = polygons_to_paths([geom for geom, _ in chunk])
+        for (geom, style), path in zip(chunk, paths):
+            yield geom, style, path
+
+
+def render_shapes_to_figure(
+    extent: ExtentDegrees,
+    to_draw: Iterable[Tuple[BaseGeometry, Geometry2DStyle]],
+    figsize: int = 1500,
+) -> Figure:
+    """Renders arbitrary Shapely geometrical objects to a Figure.
+
+    This is quite ambitious!
+
+    the to_draw argument is an iterable of Shapely geometrical objects and
+    rules to draw them (color, style, etc.)
+    """
+    fig, ax, total_area = _prepare_figure(extent.as_epsg3857(), figsize, figsize)
+
+    for geom, style, path in _with_paths(to_draw):
+        _draw_shape(ax, geom, style, total_area, path)
 
     return fig
 
 
+def _estimate_draw_bytes(geom: BaseGeometry) -> int:
+    """Rough estimation of the memory needed to draw a geometry.
+
+    Counts the geometry itself, the matplotlib path built from it and the
+    transformed copy Agg creates while drawing, plus the artist object.
+    """
+    return ARTIST_OVERHEAD_BYTES + VERTEX_BYTES * get_num_coordinates(geom)
+
+
+def _draw_and_discard(ax: Axes, artists: List[Artist]):
+    """Draw the artists on the current Agg buffer and remove them.
+
+    Artists are sorted by zorder like matplotlib would do when drawing
+    the whole figure.
+    """
+    for artist in sorted(artists, key=lambda a: a.get_zorder()):
+        ax.draw_artist(artist)
+        artist.remove()
+
+
+def _draw_on_layers(
+    artists: List[Artist],
+    layers: Dict[float, FigureCanvasAgg],
+    new_layer: Callable[[], FigureCanvasAgg],
+):
+    """Draw every artist on the canvas of its zorder and remove it.
+
+    The canvases are composed at the end by _compose_layers, so that the
+    zorder is respected across batches too.
+    """
+    for artist in artists:
+        zorder = artist.get_zorder()
+        layer = layers.get(zorder)
+        if layer is None:
+            layer = layers[zorder] = new_layer()
+        artist.draw(layer.get_renderer())
+        artist.remove()
+
+
+def _compose_layers(target: FigureCanvasAgg, layers: Dict[float, FigureCanvasAgg]):
+    """Compose the layers, by zorder, with the "over" operator into target.
+
+    The buffers of Agg have straight, not premultiplied, alpha. target is
+    usually one of the layers.
+    """
+    target_buffer = np.asarray(target.buffer_rgba())
+    buffers = [np.asarray(layers[z].buffer_rgba()) for z in sorted(layers)]
+    for row in range(0, target_buffer.shape[0], COMPOSE_ROWS):
+        rows = slice(row, row + COMPOSE_ROWS)
+        color = buffers[0][rows, :, :3] / 255
+        alpha = buffers[0][rows, :, 3:] / 255
+        for buffer in buffers[1:]:
+            top_color = buffer[rows, :, :3] / 255
+            top_alpha = buffer[rows, :, 3:] / 255
+            below = alpha * (1 - top_alpha)
+            alpha = top_alpha + below
+            # fully transparent pixels keep the color of the background
+            color = np.divide(
+                top_color * top_alpha + color * below,
+                alpha,
+                out=color,
+                where=alpha > 0,
+            )
+        target_buffer[rows, :, :3] = np.rint(color * 255)
+        target_buffer[rows, :, 3:] = np.rint(alpha * 255)
+
+
+def render_shapes_to_canvas(
+    bounds: Tuple[float, float, float, float],
+    width: int,
+    height: int,
+    to_draw: Iterable[Tuple[BaseGeometry, Geometry2DStyle]],
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+    total_area: Optional[float] = None,
+    dpi: Optional[float] = None,
+) -> FigureCanvasAgg:
+    """Renders Shapely geometrical objects to an Agg canvas in batches.
+
+    Unlike render_shapes_to_figure, the artists are not accumulated in the
+    figure: every time the estimated memory used by the pending geometries
+    and artists reaches memory_budget (in bytes) they are drawn on the
+    Agg buffer and dropped. to_draw can then be a generator, so that
+    only a batch of geometries is in memory at any time.
+
+    When there is more than a batch, every zorder (polygons, lines,
+    labels...) is drawn on a canvas of its own and the canvases are
+    composed at the end, so that a line is above the polygons of the
+    following batches too, like when drawing the whole figure. Each of
+    these canvases takes width x height x 4 bytes.
+
+    The bounds are in EPSG:3857, as returned by ExtentDegrees.as_epsg3857.
+    The result is in the canvas buffer, do not draw the canvas again.
+
+    total_area is the area min_label_area_ratio is relative to, by default
+    the one of the bounds. When drawing a part of a larger image pass the
+    area of the whole image, so that the same labels are shown. In the
+    same way, dpi is by default the one of a figure as wide as the bounds,
+    pass the one of the whole image so that lines and markers keep their
+    size, see image_dpi.
+    """
+    fig, ax, bounds_area = _prepare_figure(bounds, width, height, dpi)
+    if total_area is None:
+        total_area = bounds_area
+    canvas = FigureCanvasAgg(fig)
+    # draws the (empty) background and initializes the renderer
+    canvas.draw()
+
+    def new_layer() -> FigureCanvasAgg:
+        if len(layers) == 0:
+            return canvas
+        layer = FigureCanvasAgg(_prepare_figure(bounds, width, height, dpi)[0])
+        layer.draw()
+        return layer
+
+    layers: Dict[float, FigureCanvasAgg] = {}
+    batch: List[Artist] = []
+    batch_bytes = 0
+    batches = 0
+    for geom, style, path in _with_paths(to_draw):
+        batch.extend(_draw_shape(ax, geom, style, total_area, path))
+        batch_bytes += _estimate_draw_bytes(geom)
+        if batch_bytes >= memory_budget:
+            _draw_on_layers(batch, layers, new_layer)
+            batch = []
+            batch_bytes = 0
+            batches += 1
+    if batches == 0:
+        # everything fits in a batch, draw it as matplotlib would
+        _draw_and_discard(ax, batch)
+    else:
+        _draw_on_layers(batch, layers, new_layer)
+        if len(layers) > 1:
+            _compose_layers(canvas, layers)
+    logger.debug(f"Rendered {batches + 1} batches on {max(len(layers), 1)} layers")
+    return canvas
+
+
+def render_shapes_to_numpy(
+    extent: ExtentDegrees,
+    to_draw: Iterable[Tuple[BaseGeometry, Geometry2DStyle]],
+    figsize: int = 1500,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+) -> np.ndarray:
+    """Renders Shapely geometrical objects to a Numpy array in batches.
+
+    See render_shapes_to_canvas for how the memory usage is bounded.
+    The array has the same layout as the one returned by figure_to_numpy.
+    """
+    canvas = render_shapes_to_canvas(
+        extent.as_epsg3857(), figsize, figsize, to_draw, memory_budget
+    )
+    buf = canvas.buffer_rgba()
+    # convert to a NumPy array, flip to deal with the y axis
+    return np.flipud(np.asarray(buf))
+
+
+def representation_to_numpy(
+    representations: Iterable[Tuple[int, BaseGeometry, dict]],
+    extent: ExtentDegrees,
+    representer: Callable[[int, BaseGeometry, dict], Optional[Geometry2DStyle]],
+    figsize: int = 1500,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+) -> np.ndarray:
+    """Like representation_to_figure, but with bounded memory usage.
+
+    The representations are consumed lazily and drawn in batches, see
+    render_shapes_to_numpy for the details.
+    """
+    return render_shapes_to_numpy(
+        extent,
+        shapes_iterator(representations, representer),
+        figsize=figsize,
+        memory_budget=memory_budget,
+    )
+
+
+def numpy_to_file(image: np.ndarray, filename: str):
+    """Save an array from figure_to_numpy or render_shapes_to_numpy to a file.
+
+    The format is deduced from the file extension.
+    """
+    imsave(filename, np.flipud(image))
+
+
 def figure_to_numpy(fig: Figure) -> np.ndarray:
     """Render a matplotlib Figure to a Numpy array."""
     canvas = FigureCanvasAgg(fig)
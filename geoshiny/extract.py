@@ -0,0 +1,48 @@
+"""Extraction from PostGIS and representation files, without rendering.
+
+Importing this module does not import matplotlib, use it in processes
+that only extract, represent or convert the data. See geoshiny.render for
+the other side.
+"""
+from geoshiny.aggregation import AGGREGATE_COUNT_TAG, cell_size_for_pixels
+from geoshiny.database_extract import (
+    ExtractionBudget,
+    ExtractionEstimate,
+    ExtractionTooLarge,
+    RecordBatch,
+    batches_from_extent,
+    estimate_from_extent,
+    get_connection,
+    representation_from_extent,
+    stream_from_extent,
+)
+from geoshiny.feature_store import FeatureStore
+from geoshiny.memoize import tag_representer
+from geoshiny.representation_files import (
+    data_to_representation,
+    data_to_representation_file,
+    file_to_representation,
+    file_to_representation_batches,
+)
+from geoshiny.types import ExtentDegrees
+
+__all__ = [
+    "AGGREGATE_COUNT_TAG",
+    "ExtentDegrees",
+    "ExtractionBudget",
+    "ExtractionEstimate",
+    "ExtractionTooLarge",
+    "FeatureStore",
+    "RecordBatch",
+    "batches_from_extent",
+    "cell_size_for_pixels",
+    "data_to_representation",
+    "data_to_representation_file",
+    "estimate_from_extent",
+    "file_to_representation",
+    "file_to_representation_batches",
+    "get_connection",
+    "representation_from_extent",
+    "stream_from_extent",
+    "tag_representer",
+]
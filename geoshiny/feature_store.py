@@ -0,0 +1,180 @@
+"""In-memory storage of representations, by column.
+
+A FeatureStore holds the ids in a NumPy array, the geometries in a
+Shapely geometry array and the representations as references to a list of
+unique dictionaries, with an STRtree built on first use for spatial
+queries. It can be used wherever an iterable of (osm_id, geom, representation)
+is accepted.
+"""
+import logging
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from shapely import STRtree, box
+from shapely.geometry.base import BaseGeometry
+
+from geoshiny.types import ExtentDegrees
+
+logger = logging.getLogger(__name__)
+
+
+class _Columns:
+    """The data of a store, shared by all its views."""
+
+    def __init__(
+        self,
+        osm_ids: np.ndarray,
+        geometries: np.ndarray,
+        representations: List[dict],
+        representation_index: np.ndarray,
+    ):
+        self.osm_ids = osm_ids
+        self.geometries = geometries
+        self.representations = representations
+        self.representation_index = representation_index
+        self._tree: Optional[STRtree] = None
+
+    @property
+    def tree(self) -> STRtree:
+        if self._tree is None:
+            self._tree = STRtree(self.geometries)
+        return self._tree
+
+
+def _freeze(value) -> Hashable:
+    if isinstance(value, dict):
+        return (dict, frozenset((_freeze(k), _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return (type(value), tuple(_freeze(v) for v in value))
+    # raises TypeError for other mutable values
+    hash(value)
+    # the type keeps apart values equal across types, like 1, 1.0 and True
+    return (type(value), value)
+
+
+def _intern_key(representation) -> Optional[Hashable]:
+    """A key equal only for equal representations, None if there is none."""
+    try:
+        return _freeze(representation)
+    except TypeError:
+        # e.g. containing sets, cannot tell if equal to others
+        return None
+
+
+class FeatureStore:
+    """Columnar storage of (osm_id, geom, representation) tuples.
+
+    Equal representations are stored once, so the same dictionary object is
+    returned for all the features sharing it: do not modify them.
+
+    query() returns views, which share the data and the spatial index with
+    the store they come from.
+    """
+
+    def __init__(self, columns: _Columns, indexes: Optional[np.ndarray] = None):
+        self._columns = columns
+        # positions of the features of this view, None means all of them
+        self._indexes = indexes
+
+    @classmethod
+    def from_representations(
+        cls,
+        representations: Iterable[Tuple[int, BaseGeometry, dict]],
+    ) -> "FeatureStore":
+        osm_ids: List[int] = []
+        geometries: List[BaseGeometry] = []
+        unique: List[dict] = []
+        representation_index: List[int] = []
+        known: Dict[Hashable, int] = {}
+        for osm_id, geom, representation in representations:
+            osm_ids.append(osm_id)
+            geometries.append(geom)
+            key = _intern_key(representation)
+            position = known.get(key) if key is not None else None
+            if position is None:
+                position = len(unique)
+                unique.append(representation)
+                if key is not None:
+                    known[key] = position
+            representation_index.append(position)
+
+        geometry_array = np.empty(len(geometries), dtype=object)
+        geometry_array[:] = geometries
+        logger.debug(f"Stored {len(osm_ids)} features, {len(unique)} unique representations")
+        return cls(
+            _Columns(
+                np.array(osm_ids, dtype=np.int64),
+                geometry_array,
+                unique,
+                np.array(representation_index, dtype=np.int64),
+            )
+        )
+
+    def _positions(self) -> np.ndarray:
+        if self._indexes is None:
+            return np.arange(len(self._columns.osm_ids))
+        return self._indexes
+
+    def __len__(self) -> int:
+        if self._indexes is None:
+            return len(self._columns.osm_ids)
+        return len(self._indexes)
+
+    def __iter__(self) -> Iterator[Tuple[int, BaseGeometry, dict]]:
+        columns = self._columns
+        positions = self._positions()
+        return zip(
+            columns.osm_ids[positions].tolist(),
+            columns.geometries[positions],
+            (columns.representations[i] for i in columns.representation_index[positions]),
+        )
+
+    @property
+    def osm_ids(self) -> np.ndarray:
+        return self._columns.osm_ids[self._positions()]
+
+    @property
+    def geometries(self) -> np.ndarray:
+        return self._columns.geometries[self._positions()]
+
+    def query(self, extent: ExtentDegrees) -> "FeatureStore":
+        """The features whose bounding box intersects the extent.
+
+        The features keep their original order.
+        """
+        found = self._columns.tree.query(box(*extent.as_epsg3857()))
+        found.sort()
+        if self._indexes is not None:
+            found = np.intersect1d(found, self._indexes, assume_unique=True)
+        return FeatureStore(self._columns, found)
+
+    def compact(self) -> "FeatureStore":
+        """A store with a copy of only the features of this view."""
+        if self._indexes is None:
+            return self
+        positions = self._indexes
+        used, representation_index = np.unique(
+            self._columns.representation_index[positions], return_inverse=True
+        )
+        return FeatureStore(
+            _Columns(
+                self._columns.osm_ids[positions],
+                self._columns.geometries[positions],
+                [self._columns.representations[i] for i in used],
+                representation_index,
+            )
+        )
+
+    def __getstate__(self):
+        # when sent to another process, a view must not bring the whole store
+        columns = self.compact()._columns
+        return (
+            columns.osm_ids,
+            columns.geometries,
+            columns.representations,
+            columns.representation_index,
+        )
+
+    def __setstate__(self, state):
+        self._columns = _Columns(*state)
+        self._indexes = None
@@ -0,0 +1,97 @@
+"""Memoization of representers depending only on the tags.
+
+In OSM data the same tag set appears many times, e.g. every building=yes
+without other tags, so a representer which looks only at the tags and has
+no side effects needs to run once per distinct tag set.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+import json
+import threading
+from typing import TYPE_CHECKING, Callable, Hashable, Optional
+
+if TYPE_CHECKING:
+    from shapely.geometry.base import BaseGeometry
+
+# distinct tag sets to remember by default
+DEFAULT_MAXSIZE = 4096
+
+
+@dataclass
+class MemoStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        calls = self.hits + self.misses
+        return self.hits / calls if calls else 0.0
+
+
+def tags_fingerprint(tags: dict) -> Hashable:
+    """A hashable key, equal for equal tags regardless of their order."""
+    try:
+        key = tuple(sorted(tags.items()))
+        hash(key)
+        return key
+    except TypeError:
+        # values not hashable or keys not comparable
+        return json.dumps(tags, sort_keys=True, default=str)
+
+
+class TagRepresenter:
+    """A representer calling a tag-only function once per distinct tag set.
+
+    The function receives only the tags and must return the same value for
+    the same tags. Results are shared between the features with the same
+    tags, so they must not be modified. The cache is a thread-safe LRU of
+    maxsize tag sets.
+    """
+
+    def __init__(self, function: Callable[[dict], Optional[dict]], maxsize: int = DEFAULT_MAXSIZE):
+        self.function = function
+        self.maxsize = maxsize
+        self.stats = MemoStats()
+        self._cache: "OrderedDict[Hashable, Optional[dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.__name__ = getattr(function, "__name__", type(self).__name__)
+        self.__doc__ = function.__doc__
+
+    def __call__(self, osm_id: int, geom: "BaseGeometry", tags: dict) -> Optional[dict]:
+        key = tags_fingerprint(tags)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats.hits += 1
+                return self._cache[key]
+            self.stats.misses += 1
+        representation = self.function(tags)
+        with self._lock:
+            self._cache[key] = representation
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+                self.stats.evictions += 1
+        return representation
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.stats = MemoStats()
+
+
+def tag_representer(maxsize: int = DEFAULT_MAXSIZE) -> Callable[[Callable[[dict], Optional[dict]]], TagRepresenter]:
+    """Decorate a function of the tags to use it as a memoized representer.
+
+    For example:
+
+        @tag_representer()
+        def representation(tags):
+            if tags.get("building") is not None:
+                return dict(building=True)
+    """
+
+    def decorator(function: Callable[[dict], Optional[dict]]) -> TagRepresenter:
+        return TagRepresenter(function, maxsize=maxsize)
+
+    return decorator
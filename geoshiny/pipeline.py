@@ -0,0 +1,187 @@
+"""Pipelined extraction, representation and rendering.
+
+The three stages run concurrently and are connected by bounded queues:
+rows are represented while the cursor is still fetching, and the figure is
+built in an executor while the following rows are represented. The latency
+is then closer to the slowest stage than to the sum of them.
+"""
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+import logging
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from shapely.geometry.base import BaseGeometry
+
+from geoshiny.draw_helpers import (
+    numpy_to_file,
+    render_shapes_to_figure,
+    render_shapes_to_numpy,
+    shapes_iterator,
+)
+from geoshiny.representation_files import data_to_representation
+from geoshiny.types import ExtentDegrees, Geometry2DStyle
+
+logger = logging.getLogger(__name__)
+
+# rows moved through the queues at once, when not already in batches
+PIPELINE_BATCH_SIZE = 2_000
+# batches each queue can hold before the previous stage waits
+PIPELINE_QUEUE_SIZE = 8
+
+
+class PipelineAborted(Exception):
+    """Raised in the rendering thread when another stage failed."""
+
+
+# put in a queue to stop the consumer because of an error
+_ABORT = object()
+
+
+def _iterate_queue(
+    queue: asyncio.Queue,
+    loop: asyncio.AbstractEventLoop,
+) -> Iterator[Tuple[BaseGeometry, Geometry2DStyle]]:
+    """Consume an asyncio queue of batches from another thread."""
+    while True:
+        batch = asyncio.run_coroutine_threadsafe(queue.get(), loop).result()
+        if batch is None:
+            return
+        if batch is _ABORT:
+            raise PipelineAborted()
+        yield from batch
+
+
+def _render_to_file(
+    to_draw: Iterator[Tuple[BaseGeometry, Geometry2DStyle]],
+    filename: str,
+    extent: ExtentDegrees,
+    figsize: int,
+    memory_budget: Optional[int],
+):
+    if memory_budget is None:
+        fig = render_shapes_to_figure(extent, to_draw, figsize)
+        fig.savefig(filename)
+    else:
+        img = render_shapes_to_numpy(
+            extent, to_draw, figsize=figsize, memory_budget=memory_budget
+        )
+        numpy_to_file(img, filename)
+
+
+def _represent_batch(
+    batch: Iterable[Tuple[int, BaseGeometry, dict]],
+    representer: Callable[[int, BaseGeometry, dict], Optional[dict]],
+    renderer: Callable[[int, BaseGeometry, dict], Optional[Geometry2DStyle]],
+) -> List[Tuple[BaseGeometry, Geometry2DStyle]]:
+    return list(shapes_iterator(data_to_representation(batch, representer), renderer))
+
+
+async def _batched(
+    records: AsyncIterator[Tuple[int, BaseGeometry, dict]],
+) -> AsyncIterator[List[Tuple[int, BaseGeometry, dict]]]:
+    batch: List[Tuple[int, BaseGeometry, dict]] = []
+    async for record in records:
+        batch.append(record)
+        if len(batch) >= PIPELINE_BATCH_SIZE:
+            yield batch
+            batch = []
+    yield batch
+
+
+async def records_to_file(
+    records: AsyncIterator[Tuple[int, BaseGeometry, dict]],
+    filename: str,
+    extent: ExtentDegrees,
+    representer: Callable[[int, BaseGeometry, dict], Optional[dict]],
+    renderer: Callable[[int, BaseGeometry, dict], Optional[Geometry2DStyle]],
+    figsize: int = 2000,
+    memory_budget: Optional[int] = None,
+    executor: Optional[Executor] = None,
+):
+    """Represent and render rows to a file while they are being fetched.
+
+    records is an async iterator of (osm_id, geometry, tags), like
+    geoms_in_extent, see batches_to_file for the details.
+    """
+    await batches_to_file(
+        _batched(records),
+        filename,
+        extent,
+        representer,
+        renderer,
+        figsize=figsize,
+        memory_budget=memory_budget,
+        executor=executor,
+    )
+
+
+async def batches_to_file(
+    batches: AsyncIterator[Iterable[Tuple[int, BaseGeometry, dict]]],
+    filename: str,
+    extent: ExtentDegrees,
+    representer: Callable[[int, BaseGeometry, dict], Optional[dict]],
+    renderer: Callable[[int, BaseGeometry, dict], Optional[Geometry2DStyle]],
+    figsize: int = 2000,
+    memory_budget: Optional[int] = None,
+    executor: Optional[Executor] = None,
+):
+    """Represent and render batches of rows to a file while fetching them.
+
+    batches is an async iterator of iterables of (osm_id, geometry, tags),
+    like batches_from_extent. The representer and renderer run in a thread
+    of their own, so that they do not block the loop, matplotlib runs in
+    the executor (a new thread if not given), which must be a thread
+    executor since the shapes are passed through a queue. The stages do
+    not use the default executor of the loop: the rendering waits for the
+    representation for all its duration, with a shared pool of a single
+    thread they would wait on each other forever.
+
+    See generate_chart for the other parameters.
+    """
+    loop = asyncio.get_running_loop()
+    raw_queue: asyncio.Queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    draw_queue: asyncio.Queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    represent_executor = ThreadPoolExecutor(1, thread_name_prefix="geoshiny-represent")
+    render_executor = executor
+    if render_executor is None:
+        render_executor = ThreadPoolExecutor(1, thread_name_prefix="geoshiny-render")
+
+    async def extract():
+        async for batch in batches:
+            await raw_queue.put(batch)
+        await raw_queue.put(None)
+
+    async def represent():
+        while (batch := await raw_queue.get()) is not None:
+            to_draw = await loop.run_in_executor(
+                represent_executor, _represent_batch, batch, representer, renderer
+            )
+            await draw_queue.put(to_draw)
+        await draw_queue.put(None)
+
+    render = loop.run_in_executor(
+        render_executor,
+        _render_to_file,
+        _iterate_queue(draw_queue, loop),
+        filename,
+        extent,
+        figsize,
+        memory_budget,
+    )
+    tasks = [asyncio.ensure_future(extract()), asyncio.ensure_future(represent())]
+    try:
+        await asyncio.gather(*tasks, render)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        # stop the rendering thread, if still waiting, without saving the file
+        while not draw_queue.empty():
+            draw_queue.get_nowait()
+        draw_queue.put_nowait(_ABORT)
+        await asyncio.wait([render])
+        raise
+    finally:
+        # a cancelled representation can still be running, do not wait for it
+        represent_executor.shutdown(wait=False)
+        if executor is None:
+            render_executor.shutdown(wait=False)
@@ -0,0 +1,539 @@
+"""Out-of-core rendering of very large rasters.
+
+The image is rendered in blocks into a memory-mapped NumPy array, and
+then encoded to PNG or GeoTIFF one strip of rows at a time, so that the
+memory usage of the rendering does not depend on the size of the output.
+"""
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+import logging
+import os
+import struct
+import tempfile
+import zlib
+from typing import BinaryIO, Callable, Deque, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from matplotlib.figure import Figure
+import numpy as np
+from shapely import STRtree, box
+from shapely.geometry.base import BaseGeometry
+
+from geoshiny.draw_helpers import (
+    DEFAULT_MEMORY_BUDGET,
+    figure_to_numpy,
+    image_dpi,
+    render_shapes_to_canvas,
+    shapes_iterator,
+)
+from geoshiny.types import ExtentDegrees, Geometry2DStyle
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STRIP_HEIGHT = 1024
+# width of the rendered blocks, with the default strip height a block
+# takes 16 MB
+DEFAULT_BLOCK_WIDTH = 4096
+# Agg cannot draw canvases of 2^16 pixels or more in either direction
+MAX_BLOCK_SIZE = 2 ** 16 - 1
+# how many pixels around a block to look for shapes, to catch labels and
+# markers of shapes just outside of it
+STRIP_MARGIN_PIXELS = 64
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# PNG color type for 8 bit RGBA
+PNG_RGBA = 6
+# PNG "Up" filter, subtract the row above
+PNG_FILTER_UP = 2
+
+# TIFF tags and types, see the TIFF 6.0 and GeoTIFF 1.1 specifications
+TIFF_SHORT = 3
+TIFF_LONG = 4
+TIFF_DOUBLE = 12
+TIFF_LONG8 = 16
+TIFF_TYPE_FORMATS = {TIFF_SHORT: "H", TIFF_LONG: "I", TIFF_DOUBLE: "d", TIFF_LONG8: "Q"}
+
+TAG_NEW_SUBFILE_TYPE = 254
+TAG_IMAGE_WIDTH = 256
+TAG_IMAGE_LENGTH = 257
+TAG_BITS_PER_SAMPLE = 258
+TAG_COMPRESSION = 259
+TAG_PHOTOMETRIC = 262
+TAG_STRIP_OFFSETS = 273
+TAG_SAMPLES_PER_PIXEL = 277
+TAG_ROWS_PER_STRIP = 278
+TAG_STRIP_BYTE_COUNTS = 279
+TAG_PLANAR_CONFIGURATION = 284
+TAG_PREDICTOR = 317
+TAG_TILE_WIDTH = 322
+TAG_TILE_LENGTH = 323
+TAG_TILE_OFFSETS = 324
+TAG_TILE_BYTE_COUNTS = 325
+TAG_EXTRA_SAMPLES = 338
+TAG_SAMPLE_FORMAT = 339
+TAG_MODEL_PIXEL_SCALE = 33550
+TAG_MODEL_TIEPOINT = 33922
+TAG_GEO_KEY_DIRECTORY = 34735
+
+TIFF_COMPRESSION_NONE = 1
+TIFF_COMPRESSION_DEFLATE = 8
+TIFF_PHOTOMETRIC_RGB = 2
+# the alpha channel is not premultiplied
+TIFF_EXTRA_SAMPLE_UNASSOCIATED_ALPHA = 2
+TIFF_PREDICTOR_HORIZONTAL = 2
+TIFF_SUBFILE_REDUCED_RESOLUTION = 1
+
+# tiles must be multiples of 16 pixels, GDAL uses 256 for cloud optimized files
+DEFAULT_TIFF_TILE_SIZE = 256
+# rough memory used to compute an overview at a time, in bytes
+OVERVIEW_BAND_BYTES = 64 * 1024 * 1024
+
+# classic TIFF files cannot be bigger than 4 GB, keep some margin
+BIGTIFF_THRESHOLD = 2 ** 32 - 2 ** 28
+
+TiffEntry = Tuple[int, int, Sequence]
+
+
+def block_bounds(
+    bounds: Tuple[float, float, float, float],
+    width: int,
+    height: int,
+    block_width: int,
+    block_height: int,
+) -> Iterator[Tuple[int, int, int, int, Tuple[float, float, float, float]]]:
+    """Split bounds in blocks, row by row from north to south.
+
+    Yields the first row, the first column, the number of rows and columns
+    and the EPSG:3857 bounds of each block. The rows are counted from the
+    top of the image.
+    """
+    lonmin, latmin, lonmax, latmax = bounds
+    pixel_width = (lonmax - lonmin) / width
+    pixel_height = (latmax - latmin) / height
+    for row in range(0, height, block_height):
+        rows = min(block_height, height - row)
+        for col in range(0, width, block_width):
+            cols = min(block_width, width - col)
+            yield row, col, rows, cols, (
+                lonmin + col * pixel_width,
+                latmax - (row + rows) * pixel_height,
+                lonmin + (col + cols) * pixel_width,
+                latmax - row * pixel_height,
+            )
+
+
+def render_shapes_to_memmap(
+    extent: ExtentDegrees,
+    to_draw: List[Tuple[BaseGeometry, Geometry2DStyle]],
+    width: int,
+    height: Optional[int] = None,
+    filename: Optional[str] = None,
+    strip_height: int = DEFAULT_STRIP_HEIGHT,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+    block_width: int = DEFAULT_BLOCK_WIDTH,
+) -> np.ndarray:
+    """Render shapes block by block into a memory mapped RGBA array.
+
+    The array is stored in filename in the .npy format, so it can be loaded
+    again with numpy.load(filename, mmap_mode="r"), and the file belongs to
+    the caller. If no filename is given the array is in an anonymous
+    temporary file, removed once the array is not used anymore.
+
+    Unlike figure_to_numpy, the rows are stored from north to south, as in
+    the final image. If height is not given the image is square, like the
+    ones generated by render_shapes_to_figure.
+
+    Every block of strip_height rows and block_width columns is an
+    independent figure, only the shapes overlapping it are drawn. Agg
+    cannot draw figures of 2^16 pixels or more per side, and the memory
+    used by a block grows with its area, so wide images are split in
+    columns too.
+    """
+    if height is None:
+        height = width
+    if not 0 < block_width <= MAX_BLOCK_SIZE or not 0 < strip_height <= MAX_BLOCK_SIZE:
+        raise ValueError(f"Blocks must be between 1 and {MAX_BLOCK_SIZE} pixels per side")
+    if filename is None:
+        image = np.memmap(
+            tempfile.TemporaryFile(), dtype=np.uint8, mode="w+", shape=(height, width, 4)
+        )
+    else:
+        image = np.lib.format.open_memmap(
+            filename, mode="w+", dtype=np.uint8, shape=(height, width, 4)
+        )
+    bounds = extent.as_epsg3857()
+    # labels are shown depending on the area of the whole image, not of the block
+    total_area = (bounds[2] - bounds[0]) * (bounds[3] - bounds[1])
+    tree = STRtree([geom for geom, _ in to_draw])
+    margin = STRIP_MARGIN_PIXELS * (bounds[3] - bounds[1]) / height
+
+    for row, col, rows, cols, block in block_bounds(bounds, width, height, block_width, strip_height):
+        query_box = box(*block).buffer(margin, join_style="mitre")
+        # sort to keep the original drawing order
+        indexes = np.sort(tree.query(query_box))
+        logger.debug(f"Block at row {row} column {col} has {len(indexes)} shapes")
+        canvas = render_shapes_to_canvas(
+            block,
+            cols,
+            rows,
+            (to_draw[i] for i in indexes),
+            memory_budget=memory_budget,
+            total_area=total_area,
+            dpi=image_dpi(width),
+        )
+        image[row: row + rows, col: col + cols] = np.asarray(canvas.buffer_rgba())
+        del canvas
+        # make the pages available to the OS as soon as possible
+        image.flush()
+    return image
+
+
+def representation_to_memmap(
+    representations: Iterable[Tuple[int, BaseGeometry, dict]],
+    extent: ExtentDegrees,
+    representer: Callable[[int, BaseGeometry, dict], Optional[Geometry2DStyle]],
+    width: int,
+    height: Optional[int] = None,
+    filename: Optional[str] = None,
+    strip_height: int = DEFAULT_STRIP_HEIGHT,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+    block_width: int = DEFAULT_BLOCK_WIDTH,
+) -> np.ndarray:
+    """Like representation_to_figure, but rendering to a memory mapped array.
+
+    See render_shapes_to_memmap for the details.
+    """
+    return render_shapes_to_memmap(
+        extent,
+        list(shapes_iterator(representations, representer)),
+        width,
+        height=height,
+        filename=filename,
+        strip_height=strip_height,
+        memory_budget=memory_budget,
+        block_width=block_width,
+    )
+
+
+def _row_strips(image: np.ndarray, strip_height: int) -> Iterator[np.ndarray]:
+    for row in range(0, image.shape[0], strip_height):
+        yield np.ascontiguousarray(image[row: row + strip_height])
+
+
+def _png_chunk(fh: BinaryIO, chunk_type: bytes, data: bytes):
+    fh.write(struct.pack(">I", len(data)))
+    fh.write(chunk_type)
+    fh.write(data)
+    fh.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+
+def write_png(
+    image: np.ndarray,
+    filename: str,
+    strip_height: int = DEFAULT_STRIP_HEIGHT,
+    compress_level: int = 6,
+):
+    """Write an RGBA array to a PNG file, one strip at a time.
+
+    The rows of the array are from top to bottom, as returned by
+    render_shapes_to_memmap. The array can be memory mapped, only a strip
+    is read and compressed at a time.
+    """
+    height, width, _ = image.shape
+    compressor = zlib.compressobj(compress_level)
+    previous_row = np.zeros((1, width * 4), dtype=np.uint8)
+    with open(filename, "wb") as fh:
+        fh.write(PNG_SIGNATURE)
+        _png_chunk(
+            fh, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, PNG_RGBA, 0, 0, 0)
+        )
+        for strip in _row_strips(image, strip_height):
+            rows = strip.reshape(strip.shape[0], width * 4)
+            # the Up filter helps a lot with maps, which have large flat areas
+            filtered = np.diff(rows, axis=0, prepend=previous_row)
+            previous_row = rows[-1:]
+            raw = np.empty((rows.shape[0], width * 4 + 1), dtype=np.uint8)
+            raw[:, 0] = PNG_FILTER_UP
+            raw[:, 1:] = filtered
+            data = compressor.compress(raw.tobytes())
+            if data:
+                _png_chunk(fh, b"IDAT", data)
+        _png_chunk(fh, b"IDAT", compressor.flush())
+        _png_chunk(fh, b"IEND", b"")
+
+
+class TiffWriter:
+    """Minimal writer for little-endian (Big)TIFF files.
+
+    The image data is written first, in the order it is produced, and the
+    IFDs describing it are appended at the end.
+    """
+
+    def __init__(self, fh: BinaryIO, bigtiff: bool = False):
+        self.fh = fh
+        self.bigtiff = bigtiff
+        self.offset_type = TIFF_LONG8 if bigtiff else TIFF_LONG
+        self._offset_format = "<Q" if bigtiff else "<I"
+        if bigtiff:
+            fh.write(b"II" + struct.pack("<HHHQ", 43, 8, 0, 0))
+            self._next_ifd_pointer = 8
+        else:
+            fh.write(b"II" + struct.pack("<HI", 42, 0))
+            self._next_ifd_pointer = 4
+
+    def write_data(self, data: bytes) -> int:
+        """Write a block of data, return its offset in the file.
+
+        Offsets are always word-aligned, as required by the specification.
+        """
+        offset = self.fh.seek(0, 2)
+        if offset % 2:
+            self.fh.write(b"\x00")
+            offset += 1
+        self.fh.write(data)
+        return offset
+
+    def write_ifd(self, entries: List[TiffEntry]):
+        """Write an IFD and link it to the previous one.
+
+        The entries are tuples of tag, type and values.
+        """
+        entries = sorted(entries)
+        entry_format = "<HHQ" if self.bigtiff else "<HHI"
+        inline_size = 8 if self.bigtiff else 4
+
+        packed_entries = []
+        for tag, tiff_type, values in entries:
+            data = struct.pack(
+                f"<{len(values)}{TIFF_TYPE_FORMATS[tiff_type]}", *values
+            )
+            if len(data) <= inline_size:
+                value = data.ljust(inline_size, b"\x00")
+            else:
+                value = struct.pack(self._offset_format, self.write_data(data))
+            packed_entries.append(struct.pack(entry_format, tag, tiff_type, len(values)) + value)
+
+        ifd = struct.pack("<Q" if self.bigtiff else "<H", len(entries))
+        ifd += b"".join(packed_entries)
+        ifd_offset = self.write_data(ifd)
+        next_pointer = ifd_offset + len(ifd)
+        self.fh.write(b"\x00" * inline_size)
+
+        self.fh.seek(self._next_ifd_pointer)
+        self.fh.write(struct.pack(self._offset_format, ifd_offset))
+        self.fh.seek(0, 2)
+        self._next_ifd_pointer = next_pointer
+
+
+def geotiff_tags(
+    extent: ExtentDegrees,
+    width: int,
+    height: int,
+) -> List[TiffEntry]:
+    """TIFF entries to georeference an image of the extent in EPSG:3857."""
+    lonmin, latmin, lonmax, latmax = extent.as_epsg3857()
+    return [
+        (
+            TAG_MODEL_PIXEL_SCALE,
+            TIFF_DOUBLE,
+            ((lonmax - lonmin) / width, (latmax - latmin) / height, 0.0),
+        ),
+        (TAG_MODEL_TIEPOINT, TIFF_DOUBLE, (0.0, 0.0, 0.0, lonmin, latmax, 0.0)),
+        (
+            TAG_GEO_KEY_DIRECTORY,
+            TIFF_SHORT,
+            (
+                # version 1.1.0, 3 keys
+                1, 1, 0, 3,
+                # GTModelTypeGeoKey: projected
+                1024, 0, 1, 1,
+                # GTRasterTypeGeoKey: pixel is area
+                1025, 0, 1, 1,
+                # ProjectedCSTypeGeoKey: EPSG:3857
+                3072, 0, 1, 3857,
+            ),
+        ),
+    ]
+
+
+def rgba_tags(width: int, height: int, compression: int) -> List[TiffEntry]:
+    """TIFF entries describing an 8 bit RGBA image."""
+    return [
+        (TAG_IMAGE_WIDTH, TIFF_LONG, (width,)),
+        (TAG_IMAGE_LENGTH, TIFF_LONG, (height,)),
+        (TAG_BITS_PER_SAMPLE, TIFF_SHORT, (8, 8, 8, 8)),
+        (TAG_COMPRESSION, TIFF_SHORT, (compression,)),
+        (TAG_PHOTOMETRIC, TIFF_SHORT, (TIFF_PHOTOMETRIC_RGB,)),
+        (TAG_SAMPLES_PER_PIXEL, TIFF_SHORT, (4,)),
+        (TAG_PLANAR_CONFIGURATION, TIFF_SHORT, (1,)),
+        (TAG_EXTRA_SAMPLES, TIFF_SHORT, (TIFF_EXTRA_SAMPLE_UNASSOCIATED_ALPHA,)),
+        (TAG_SAMPLE_FORMAT, TIFF_SHORT, (1, 1, 1, 1)),
+    ]
+
+
+def _tiles(image: np.ndarray, tile_size: int) -> Iterator[np.ndarray]:
+    """Split an image in tiles, row by row, padding the ones at the edges."""
+    height, width, _ = image.shape
+    for row in range(0, height, tile_size):
+        for col in range(0, width, tile_size):
+            part = image[row: row + tile_size, col: col + tile_size]
+            tile = np.zeros((tile_size, tile_size, 4), dtype=np.uint8)
+            tile[: part.shape[0], : part.shape[1]] = part
+            yield tile
+
+
+def _encode_block(block: np.ndarray, compress: bool) -> bytes:
+    if not compress:
+        return block.tobytes()
+    # horizontal differencing, the TIFF equivalent of the PNG Sub filter
+    previous = np.zeros((block.shape[0], 1, 4), dtype=np.uint8)
+    return zlib.compress(np.diff(block, axis=1, prepend=previous).tobytes())
+
+
+def _write_blocks(
+    writer: TiffWriter,
+    blocks: Iterable[np.ndarray],
+    executor: Executor,
+    in_flight: int,
+    compress: bool,
+) -> Tuple[List[int], List[int]]:
+    """Encode blocks in the executor and write them in order.
+
+    At most in_flight blocks are kept in memory. Returns the offsets and
+    the sizes of the blocks in the file.
+    """
+    offsets: List[int] = []
+    byte_counts: List[int] = []
+    pending: Deque[Future] = deque()
+
+    def write_oldest():
+        data = pending.popleft().result()
+        offsets.append(writer.write_data(data))
+        byte_counts.append(len(data))
+
+    for block in blocks:
+        pending.append(executor.submit(_encode_block, block, compress))
+        if len(pending) >= in_flight:
+            write_oldest()
+    while pending:
+        write_oldest()
+    return offsets, byte_counts
+
+
+def half_size(image: np.ndarray) -> np.ndarray:
+    """Downsample an RGBA image by 2, into a temporary memory mapped array.
+
+    Every pixel is the average of 4, the colors are weighted by their
+    alpha so that transparent pixels do not darken the borders. The image
+    is processed in bands, so it can be memory mapped too.
+    """
+    height, width, _ = image.shape
+    result = np.memmap(
+        tempfile.TemporaryFile(),
+        dtype=np.uint8,
+        mode="w+",
+        shape=((height + 1) // 2, (width + 1) // 2, 4),
+    )
+    band_rows = max(2, OVERVIEW_BAND_BYTES // (width * 16) // 2 * 2)
+    for row in range(0, height, band_rows):
+        band = image[row: row + band_rows].astype(np.uint32)
+        # repeat the last row and column of odd sized images
+        if band.shape[0] % 2:
+            band = np.concatenate([band, band[-1:]])
+        if band.shape[1] % 2:
+            band = np.concatenate([band, band[:, -1:]], axis=1)
+        blocks = band.reshape(band.shape[0] // 2, 2, band.shape[1] // 2, 2, 4)
+        alpha = blocks[..., 3:]
+        alpha_sum = alpha.sum(axis=(1, 3))
+        color_sum = (blocks[..., :3] * alpha).sum(axis=(1, 3))
+        color = (color_sum + alpha_sum // 2) // np.maximum(alpha_sum, 1)
+        result[row // 2: (row + band.shape[0]) // 2] = np.concatenate(
+            [color, (alpha_sum + 2) // 4], axis=2
+        )
+    return result
+
+
+def write_geotiff(
+    image: np.ndarray,
+    filename: str,
+    extent: ExtentDegrees,
+    strip_height: int = 64,
+    compress: bool = True,
+    tile_size: Optional[int] = DEFAULT_TIFF_TILE_SIZE,
+    overviews: int = 0,
+    threads: Optional[int] = None,
+):
+    """Write an RGBA array to a GeoTIFF file.
+
+    The rows of the array are from top to bottom, as returned by
+    render_shapes_to_memmap, and the image covers the given extent in
+    EPSG:3857, so GIS tools can load it without reprojecting. The array can
+    be memory mapped, only a few blocks are in memory at a time.
+
+    The image is split in tiles of tile_size pixels, or in strips of
+    strip_height rows if tile_size is None. Blocks are compressed with
+    deflate in a pool of threads, the default number of threads is the
+    number of CPUs. overviews is the number of internal overviews to add,
+    each one half the size of the previous.
+
+    BigTIFF is used when the image could not fit in a classic TIFF.
+    """
+    if tile_size is not None and tile_size % 16:
+        raise ValueError(f"The TIFF tile size must be a multiple of 16, got {tile_size}")
+    # the overviews together take up to a third of the image
+    bigtiff = image.nbytes * (4 / 3 if overviews else 1) > BIGTIFF_THRESHOLD
+    workers = threads or os.cpu_count() or 1
+    compression = TIFF_COMPRESSION_DEFLATE if compress else TIFF_COMPRESSION_NONE
+
+    with open(filename, "w+b") as fh, ThreadPoolExecutor(max_workers=workers) as executor:
+        writer = TiffWriter(fh, bigtiff=bigtiff)
+        level = image
+        for level_number in range(overviews + 1):
+            if level_number > 0:
+                level = half_size(level)
+            height, width, _ = level.shape
+            if tile_size is None:
+                blocks: Iterable[np.ndarray] = _row_strips(level, strip_height)
+            else:
+                blocks = _tiles(level, tile_size)
+            offsets, byte_counts = _write_blocks(
+                writer, blocks, executor, 2 * workers, compress
+            )
+
+            entries = rgba_tags(width, height, compression)
+            if compress:
+                entries.append((TAG_PREDICTOR, TIFF_SHORT, (TIFF_PREDICTOR_HORIZONTAL,)))
+            if level_number == 0:
+                entries += geotiff_tags(extent, width, height)
+            else:
+                entries.append(
+                    (TAG_NEW_SUBFILE_TYPE, TIFF_LONG, (TIFF_SUBFILE_REDUCED_RESOLUTION,))
+                )
+            if tile_size is None:
+                entries += [
+                    (TAG_ROWS_PER_STRIP, TIFF_LONG, (strip_height,)),
+                    (TAG_STRIP_OFFSETS, writer.offset_type, offsets),
+                    (TAG_STRIP_BYTE_COUNTS, writer.offset_type, byte_counts),
+                ]
+            else:
+                entries += [
+                    (TAG_TILE_WIDTH, TIFF_LONG, (tile_size,)),
+                    (TAG_TILE_LENGTH, TIFF_LONG, (tile_size,)),
+                    (TAG_TILE_OFFSETS, writer.offset_type, offsets),
+                    (TAG_TILE_BYTE_COUNTS, writer.offset_type, byte_counts),
+                ]
+            writer.write_ifd(entries)
+
+
+def figure_to_geotiff(
+    fig: Figure,
+    filename: str,
+    extent: ExtentDegrees,
+    **options,
+):
+    """Render a Figure of the extent to a GeoTIFF file.
+
+    The figure is rendered with figure_to_numpy, see write_geotiff for the
+    options.
+    """
+    # figure_to_numpy has the rows from the bottom
+    write_geotiff(np.flipud(figure_to_numpy(fig)), filename, extent, **options)
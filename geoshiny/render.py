@@ -0,0 +1,44 @@
+"""Rendering of representations, without database access.
+
+Importing this module does not import asyncpg, use it in processes that
+only draw representations, e.g. read from files. See geoshiny.extract for
+the other side.
+"""
+from geoshiny.aggregation import aggregated_count, cell_shape, marker_shape
+from geoshiny.draw_helpers import (
+    figure_to_numpy,
+    numpy_to_file,
+    render_shapes_to_figure,
+    render_shapes_to_numpy,
+    representation_to_figure,
+    representation_to_numpy,
+    shapes_iterator,
+)
+from geoshiny.feature_store import FeatureStore
+from geoshiny.raster_output import figure_to_geotiff, write_geotiff, write_png
+from geoshiny.representation_files import file_to_representation, file_to_representation_batches
+from geoshiny.svg_output import representation_to_svg, write_svg
+from geoshiny.types import ExtentDegrees, Geometry2DStyle
+
+__all__ = [
+    "ExtentDegrees",
+    "FeatureStore",
+    "Geometry2DStyle",
+    "aggregated_count",
+    "cell_shape",
+    "figure_to_geotiff",
+    "figure_to_numpy",
+    "file_to_representation",
+    "file_to_representation_batches",
+    "marker_shape",
+    "numpy_to_file",
+    "render_shapes_to_figure",
+    "render_shapes_to_numpy",
+    "representation_to_figure",
+    "representation_to_numpy",
+    "representation_to_svg",
+    "shapes_iterator",
+    "write_geotiff",
+    "write_png",
+    "write_svg",
+]
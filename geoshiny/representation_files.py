@@ -0,0 +1,321 @@
+"""Reading and writing of JSONL representation files.
+
+data_to_representation_file writes one JSON object per line with osm_id,
+geojson and representation, file_to_representation reads them back.
+This module does not need matplotlib, so processes that only convert
+data do not have to import it.
+
+For parallel reading, files are split in byte
+ranges aligned to the lines and decoded in a pool of processes, which
+convert the GeoJSON to geometries in bulk and send them back as WKB.
+
+A representation can also be written as a directory of shards, each one
+a file in the same format, written by the worker processes.
+"""
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from io import TextIOWrapper
+from itertools import chain
+import json
+import logging
+import os
+from typing import Callable, Deque, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import shapely
+from shapely.geometry import mapping, shape
+from shapely.geometry.base import BaseGeometry
+
+logger = logging.getLogger(__name__)
+
+# size of the byte ranges decoded by every task
+DEFAULT_CHUNK_BYTES = 8 * 1024 * 1024
+DEFAULT_SHARD_ROWS = 100_000
+SHARD_SUFFIX = ".jsonl"
+
+# nesting of the coordinates of the GeoJSON types, see from_ragged_array
+RAGGED_DEPTHS = {
+    "Point": 0,
+    "LineString": 1,
+    "MultiPoint": 1,
+    "Polygon": 2,
+    "MultiLineString": 2,
+    "MultiPolygon": 3,
+}
+
+
+def representation_to_line(osm_id: int, geom: BaseGeometry, representation: dict) -> str:
+    """A line of a representation file, without the newline."""
+    return json.dumps(
+        dict(
+            osm_id=osm_id,
+            geojson=mapping(geom),
+            representation=representation,
+        )
+    )
+
+
+def _ragged(geom_type: str, coordinates: List[list]) -> np.ndarray:
+    """Geometries of a single type from their GeoJSON coordinates."""
+    offsets = []
+    level: list = coordinates
+    for _ in range(RAGGED_DEPTHS[geom_type]):
+        lengths = np.fromiter(map(len, level), dtype=np.int64, count=len(level))
+        offsets.append(np.concatenate([[0], np.cumsum(lengths)]))
+        level = list(chain.from_iterable(level))
+    coords = np.array(level, dtype=float)
+    if coords.ndim != 2:
+        # empty, or with a different number of dimensions
+        raise ValueError(f"Cannot convert the coordinates of {geom_type} in bulk")
+    return shapely.from_ragged_array(
+        shapely.GeometryType[geom_type.upper()], coords, tuple(reversed(offsets)) or None
+    )
+
+
+def geojson_to_geometries(geojsons: Sequence[dict]) -> np.ndarray:
+    """Convert GeoJSON geometries to an array of Shapely geometries.
+
+    Geometries of the same type are converted at once, others, like
+    collections, one at a time.
+    """
+    result = np.empty(len(geojsons), dtype=object)
+    positions_by_type: dict = {}
+    for position, geojson in enumerate(geojsons):
+        positions_by_type.setdefault(geojson["type"], []).append(position)
+    for geom_type, positions in positions_by_type.items():
+        if geom_type in RAGGED_DEPTHS:
+            try:
+                result[positions] = _ragged(
+                    geom_type, [geojsons[p]["coordinates"] for p in positions]
+                )
+                continue
+            except ValueError:
+                logger.debug(f"Converting {len(positions)} {geom_type} one by one")
+        for p in positions:
+            result[p] = shape(geojsons[p])
+    return result
+
+
+def newline_ranges(filename: str, chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> List[Tuple[int, int]]:
+    """Split a file in byte ranges of about chunk_bytes, ending with a newline."""
+    size = os.path.getsize(filename)
+    ranges = []
+    start = 0
+    with open(filename, "rb") as fh:
+        while start < size:
+            fh.seek(min(start + chunk_bytes, size))
+            # move to the end of the line
+            fh.readline()
+            end = min(fh.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _read_range(filename: str, start: int, end: int) -> Tuple[List[int], np.ndarray, List[dict]]:
+    with open(filename, "rb") as fh:
+        fh.seek(start)
+        text = fh.read(end - start).decode()
+    # a single call is faster than one per line
+    # not splitlines, it splits also on characters JSON allows in strings
+    objs = json.loads("[" + ",".join(line for line in text.split("\n") if line.strip()) + "]")
+    geometries = geojson_to_geometries([obj["geojson"] for obj in objs])
+    # WKB is much faster to send back than pickled geometries
+    return (
+        [obj["osm_id"] for obj in objs],
+        shapely.to_wkb(geometries),
+        [obj["representation"] for obj in objs],
+    )
+
+
+def _representation_iterator(
+    data,
+    entity_callback: Callable[[int, BaseGeometry, dict], Optional[dict]],
+):
+    for (osm_id, geom, tags) in data:
+        representation = entity_callback(osm_id, geom, tags)
+        if representation is not None:
+            yield (osm_id, geom, representation)
+
+
+@contextmanager
+def _read_file(target_file: Union[str, TextIOWrapper]):
+    if isinstance(target_file, str):
+        with open(target_file, "r") as fh:
+            yield fh
+    elif isinstance(target_file, TextIOWrapper):
+        yield target_file
+    else:
+        raise TypeError(f"Invalid type {type(target_file)}")
+
+
+@contextmanager
+def _write_file(target_file: Union[str, TextIOWrapper]):
+    if isinstance(target_file, str):
+        with open(target_file, "w") as fh:
+            yield fh
+    elif isinstance(target_file, TextIOWrapper):
+        yield target_file
+    else:
+        raise TypeError(f"Invalid type {type(target_file)}")
+
+
+def data_to_representation(
+    data,
+    entity_callback: Callable,
+) -> Iterable[Tuple[int, BaseGeometry, dict]]:
+    yield from _representation_iterator(data, entity_callback)
+
+
+def data_to_representation_file(
+    data,
+    target_file: Union[str, TextIOWrapper],
+    entity_callback: Callable,
+    rows_per_shard: Optional[int] = None,
+):
+    """Write the representations of the data to a JSONL file.
+
+    With rows_per_shard, target_file is a directory where shards of that
+    many rows are written in parallel, see data_to_representation_shards.
+    """
+    if rows_per_shard is not None:
+        if not isinstance(target_file, str):
+            raise TypeError(f"Shards are written to a directory, not to {type(target_file)}")
+        data_to_representation_shards(data, target_file, entity_callback, rows_per_shard)
+        return
+    with _write_file(target_file) as fh:
+        for osm_id, geom, repr in _representation_iterator(data, entity_callback):
+            fh.write(representation_to_line(osm_id, geom, repr))
+            fh.write("\n")
+
+
+def file_to_representation(target_file: Union[str, TextIOWrapper]):
+    """Read the representations of a JSONL file, or of a directory of shards.
+
+    See file_to_representation_batches to read them in parallel.
+    """
+    if isinstance(target_file, str) and os.path.isdir(target_file):
+        for shard in representation_files(target_file):
+            yield from file_to_representation(shard)
+        return
+    with _read_file(target_file) as fh:
+        for line in fh:
+            obj = json.loads(line)
+            yield (obj["osm_id"], shape(obj["geojson"]), obj["representation"])
+
+
+def representation_files(source: Union[str, Sequence[str]]) -> List[str]:
+    """The files of a representation: a file, a directory of shards or a list."""
+    if not isinstance(source, str):
+        return list(source)
+    if os.path.isdir(source):
+        names = [name for name in os.listdir(source) if name.endswith(SHARD_SUFFIX)]
+        return [os.path.join(source, name) for name in sorted(names, key=_shard_order)]
+    return [source]
+
+
+def _shard_order(name: str) -> Tuple[int, str]:
+    """Sort the shards by number, the names are not padded enough for 100000 or more."""
+    stem = name[: -len(SHARD_SUFFIX)]
+    return (int(stem) if stem.isdigit() else -1, name)
+
+
+def file_to_representation_batches(
+    source: Union[str, Sequence[str]],
+    processes: Optional[int] = None,
+    chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+) -> Iterator[List[Tuple[int, BaseGeometry, dict]]]:
+    """Read representation files in parallel, yielding batches in order.
+
+    source is a file, a directory of shards written by
+    data_to_representation_shards or a list of files. Every batch is a
+    list of (osm_id, geometry, representation) from a range of about
+    chunk_bytes of a file, decoded in a pool of processes; at most two
+    batches per process are waiting to be consumed.
+    """
+    tasks = [
+        (filename, start, end)
+        for filename in representation_files(source)
+        for start, end in newline_ranges(filename, chunk_bytes)
+    ]
+    workers = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending: Deque[Future] = deque()
+        for task in tasks:
+            pending.append(executor.submit(_read_range, *task))
+            if len(pending) >= 2 * workers:
+                yield _decoded_batch(pending.popleft())
+        while pending:
+            yield _decoded_batch(pending.popleft())
+
+
+def _decoded_batch(future: Future) -> List[Tuple[int, BaseGeometry, dict]]:
+    osm_ids, wkbs, representations = future.result()
+    return list(zip(osm_ids, shapely.from_wkb(wkbs), representations))
+
+
+def _write_shard(filename: str, osm_ids: List[int], wkbs: np.ndarray, representations: List[dict]):
+    with open(filename, "w") as fh:
+        for osm_id, geom, representation in zip(osm_ids, shapely.from_wkb(wkbs), representations):
+            fh.write(representation_to_line(osm_id, geom, representation))
+            fh.write("\n")
+
+
+def data_to_representation_shards(
+    data: Iterable[Tuple[int, BaseGeometry, dict]],
+    target_dir: str,
+    entity_callback: Callable[[int, BaseGeometry, dict], Optional[dict]],
+    rows_per_shard: int = DEFAULT_SHARD_ROWS,
+    processes: Optional[int] = None,
+) -> List[str]:
+    """Like data_to_representation_file, but writing a directory of shards.
+
+    The entity_callback runs in this process, every rows_per_shard
+    representations are written to a new shard by a pool of processes.
+    The shards, in order, contain the representations in the order of the
+    data. Returns the list of the shards.
+
+    The directory is created if needed, and must not contain other shards.
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    if representation_files(target_dir):
+        raise FileExistsError(f"{target_dir} already contains {SHARD_SUFFIX} files")
+    workers = processes or os.cpu_count() or 1
+    filenames: List[str] = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending: Deque[Future] = deque()
+
+        def submit(rows: List[Tuple[int, BaseGeometry, dict]]):
+            filename = os.path.join(target_dir, f"{len(filenames):05d}{SHARD_SUFFIX}")
+            filenames.append(filename)
+            osm_ids, geometries, representations = zip(*rows)
+            geometry_array = np.empty(len(geometries), dtype=object)
+            geometry_array[:] = geometries
+            pending.append(
+                executor.submit(
+                    _write_shard,
+                    filename,
+                    list(osm_ids),
+                    shapely.to_wkb(geometry_array),
+                    list(representations),
+                )
+            )
+            if len(pending) >= 2 * workers:
+                pending.popleft().result()
+
+        rows: List[Tuple[int, BaseGeometry, dict]] = []
+        for osm_id, geom, tags in data:
+            representation = entity_callback(osm_id, geom, tags)
+            if representation is None:
+                continue
+            rows.append((osm_id, geom, representation))
+            if len(rows) >= rows_per_shard:
+                submit(rows)
+                rows = []
+        if rows:
+            submit(rows)
+        while pending:
+            pending.popleft().result()
+    logger.debug(f"Written {len(filenames)} shards to {target_dir}")
+    return filenames
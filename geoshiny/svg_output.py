@@ -0,0 +1,348 @@
+"""Write charts to SVG without building a matplotlib figure.
+
+Shapes are written as soon as they are received, so the memory used does
+not depend on the number of shapes. Every distinct style becomes a CSS
+class, consecutive shapes with the same style share a group, and the
+coordinates are rounded to the pixel.
+
+The result looks like render_shapes_to_figure, including the matplotlib
+defaults for the unspecified options and the order of the layers:
+polygons and points first, then lines, then labels. The layers above the
+first are kept in temporary files until the end.
+"""
+import logging
+import shutil
+import tempfile
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, TextIO, Tuple
+from xml.sax.saxutils import escape
+
+from matplotlib import rcParams
+from matplotlib.colors import to_hex, to_rgba
+import numpy as np
+from shapely.geometry.base import BaseGeometry
+
+from geoshiny.draw_helpers import shapes_iterator
+from geoshiny.feature_store import FeatureStore
+from geoshiny.types import ExtentDegrees, Geometry2DStyle
+
+logger = logging.getLogger(__name__)
+
+# the layers, in drawing order, as the zorder of the matplotlib artists
+AREA_LAYER = 0
+LINE_LAYER = 1
+LABEL_LAYER = 2
+
+LINESTYLE_NAMES = {"-": "solid", "--": "dashed", "-.": "dashdot", ":": "dotted"}
+TEXT_ANCHORS = {"left": "start", "center": "middle", "right": "end"}
+# dominant-baseline for the vertical alignments of matplotlib, but baseline
+TEXT_BASELINES = {
+    "top": "text-before-edge",
+    "center": "central",
+    "center_baseline": "central",
+    "bottom": "text-after-edge",
+}
+# label options written to the SVG, the others are ignored
+LABEL_OPTIONS = {
+    "text",
+    "color",
+    "alpha",
+    "fontsize",
+    "size",
+    "ha",
+    "horizontalalignment",
+    "va",
+    "verticalalignment",
+}
+
+
+def _fill_and_opacity(prefix: str, color, alpha: Optional[float]) -> List[str]:
+    """CSS declarations for a color, matplotlib style alpha overrides the color one."""
+    if color is None or (isinstance(color, str) and color.lower() == "none"):
+        return [f"{prefix}:none"]
+    rgba = to_rgba(color)
+    opacity = rgba[3] if alpha is None else alpha
+    declarations = [f"{prefix}:{to_hex(rgba)}"]
+    if opacity < 1:
+        declarations.append(f"{prefix}-opacity:{opacity:g}")
+    return declarations
+
+
+def _dasharray(linestyle, linewidth: float, dpi: float) -> Optional[str]:
+    """The stroke-dasharray of a matplotlib linestyle, in pixels."""
+    if linestyle is None:
+        return None
+    if isinstance(linestyle, tuple):
+        _, pattern = linestyle
+    else:
+        name = LINESTYLE_NAMES.get(linestyle, linestyle)
+        if name in ("solid", "None", "none", " ", ""):
+            return None
+        pattern = rcParams[f"lines.{name}_pattern"]
+    if not pattern:
+        return None
+    # the patterns are in points, and by default relative to the line width
+    scale = (linewidth if rcParams["lines.scale_dashes"] else 1.0) * dpi / 72
+    return ",".join(f"{v * scale:.4g}" for v in pattern)
+
+
+class _Layer:
+    """Elements of a layer, grouped by consecutive CSS class."""
+
+    def __init__(self, fh: TextIO):
+        self.fh = fh
+        self.css_class: Optional[str] = None
+
+    def write(self, css_class: str, element: str):
+        if css_class != self.css_class:
+            if self.css_class is not None:
+                self.fh.write("</g>\n")
+            self.fh.write(f'<g class="{css_class}">\n')
+            self.css_class = css_class
+        self.fh.write(element)
+
+    def close_group(self):
+        if self.css_class is not None:
+            self.fh.write("</g>\n")
+            self.css_class = None
+
+
+class SvgWriter:
+    """Write shapes to an SVG, see write_svg.
+
+    The bounds are in EPSG:3857, like in ExtentDegrees.as_epsg3857, and
+    precision is the number of decimals of the pixel coordinates.
+    """
+
+    def __init__(
+        self,
+        fh: TextIO,
+        bounds: Tuple[float, float, float, float],
+        width: int,
+        height: int,
+        precision: int = 0,
+    ):
+        self.fh = fh
+        self.width = width
+        self.height = height
+        self.precision = precision
+        # same as _prepare_figure, the line widths are in points
+        self.dpi = width / 5
+        lonmin, latmin, lonmax, latmax = bounds
+        self._origin = np.array([lonmin, latmax])
+        self._scale = np.array(
+            [width / (lonmax - lonmin), -height / (latmax - latmin)]
+        )
+        self._total_area = (latmax - latmin) * (lonmax - lonmin)
+        self._classes: Dict[Hashable, str] = {}
+        self._css: List[str] = []
+        fh.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        fh.write(
+            '<svg xmlns="http://www.w3.org/2000/svg" '
+            f'width="{width}" height="{height}" viewBox="0 0 {width} {height}">\n'
+        )
+        self._layers = [
+            _Layer(fh),
+            _Layer(tempfile.TemporaryFile("w+")),
+            _Layer(tempfile.TemporaryFile("w+")),
+        ]
+
+    def _pixels(self, coords) -> np.ndarray:
+        """Pixel coordinates without consecutive duplicates."""
+        pixels = np.round((np.asarray(coords)[:, :2] - self._origin) * self._scale, self.precision)
+        if self.precision == 0:
+            pixels = pixels.astype(np.int64)
+        keep = np.ones(len(pixels), dtype=bool)
+        keep[1:] = np.any(pixels[1:] != pixels[:-1], axis=1)
+        return pixels[keep]
+
+    @staticmethod
+    def _points(pixels: np.ndarray) -> str:
+        return " ".join(f"{x},{y}" for x, y in pixels.tolist())
+
+    def _ring(self, coords) -> str:
+        pixels = self._pixels(coords)
+        if len(pixels) > 1 and np.all(pixels[0] == pixels[-1]):
+            pixels = pixels[:-1]
+        if len(pixels) < 3:
+            # smaller than a pixel
+            return ""
+        return f"M{self._points(pixels)}Z"
+
+    def _css_class(self, kind: str, options: dict, declarations: Callable[[], List[str]]) -> str:
+        """The class of a kind of element with the given options.
+
+        The declarations are computed only for new classes.
+        """
+        try:
+            key: Hashable = (kind, tuple(sorted(options.items())))
+            hash(key)
+        except TypeError:
+            key = (kind, repr(sorted(options.items())))
+        css_class = self._classes.get(key)
+        if css_class is None:
+            css_class = f"s{len(self._classes)}"
+            self._classes[key] = css_class
+            self._css.append(f".{css_class}{{{';'.join(declarations())}}}\n")
+        return css_class
+
+    def _area_css(self, style: Geometry2DStyle) -> List[str]:
+        facecolor = style.facecolor if style.facecolor is not None else style.color
+        if facecolor is None:
+            facecolor = rcParams["patch.facecolor"]
+        edgecolor = style.edgecolor if style.edgecolor is not None else style.color
+        linewidth = style.linewidth if style.linewidth is not None else rcParams["patch.linewidth"]
+        declarations = _fill_and_opacity("fill", facecolor, style.alpha) + ["fill-rule:evenodd"]
+        declarations += self._stroke_css(edgecolor, style.alpha, linewidth, style.linestyle)
+        return declarations
+
+    def _line_css(self, style: Geometry2DStyle) -> List[str]:
+        color = style.color if style.color is not None else style.edgecolor
+        if color is None:
+            color = rcParams["axes.prop_cycle"].by_key()["color"][0]
+        linewidth = style.linewidth if style.linewidth is not None else rcParams["lines.linewidth"]
+        return ["fill:none", "stroke-linejoin:round", "stroke-linecap:square"] + self._stroke_css(
+            color, style.alpha, linewidth, style.linestyle
+        )
+
+    def _point_css(self, style: Geometry2DStyle) -> List[str]:
+        facecolor = style.facecolor if style.facecolor is not None else style.color
+        if facecolor is None:
+            facecolor = rcParams["axes.prop_cycle"].by_key()["color"][0]
+        # scatter draws the edge with the face color by default
+        edgecolor = style.edgecolor if style.edgecolor is not None else facecolor
+        linewidth = style.linewidth if style.linewidth is not None else rcParams["lines.markeredgewidth"]
+        return _fill_and_opacity("fill", facecolor, style.alpha) + self._stroke_css(
+            edgecolor, style.alpha, linewidth, style.linestyle
+        )
+
+    def _label_css(self, label: dict) -> List[str]:
+        fontsize = label.get("fontsize", label.get("size", rcParams["font.size"]))
+        if not isinstance(fontsize, (int, float)):
+            fontsize = rcParams["font.size"]
+        declarations = _fill_and_opacity(
+            "fill", label.get("color", rcParams["text.color"]), label.get("alpha")
+        )
+        declarations.append(f"font-size:{fontsize * self.dpi / 72:.4g}px")
+        declarations.append("font-family:sans-serif")
+        anchor = TEXT_ANCHORS.get(label.get("ha", label.get("horizontalalignment", "left")))
+        if anchor is not None and anchor != "start":
+            declarations.append(f"text-anchor:{anchor}")
+        baseline = TEXT_BASELINES.get(label.get("va", label.get("verticalalignment", "baseline")))
+        if baseline is not None:
+            declarations.append(f"dominant-baseline:{baseline}")
+        ignored = sorted(set(label) - LABEL_OPTIONS)
+        if ignored:
+            logger.warning(f"Label options not supported in SVG, ignored: {', '.join(ignored)}")
+        return declarations
+
+    def _stroke_css(self, color, alpha: Optional[float], linewidth: float, linestyle) -> List[str]:
+        declarations = _fill_and_opacity("stroke", color, alpha)
+        if declarations == ["stroke:none"]:
+            return declarations
+        declarations.append(f"stroke-width:{linewidth * self.dpi / 72:.4g}")
+        dasharray = _dasharray(linestyle, linewidth, self.dpi)
+        if dasharray is not None:
+            declarations.append(f"stroke-dasharray:{dasharray}")
+        return declarations
+
+    def _draw_label(self, geom: BaseGeometry, style: Geometry2DStyle):
+        label = style.get_label_options()
+        if label is None:
+            return
+        ratio = style.min_label_area_ratio
+        if ratio is not None and geom.area / self._total_area <= ratio:
+            return
+        # the text is in the element, labels differing only by it share the class
+        options = {k: v for k, v in label.items() if k != "text"}
+        css_class = self._css_class("label", options, lambda: self._label_css(label))
+        ((x, y),) = self._pixels(geom.centroid.coords).tolist()
+        self._layers[LABEL_LAYER].write(
+            css_class, f'<text x="{x}" y="{y}">{escape(str(label["text"]))}</text>\n'
+        )
+
+    def draw(self, geom: BaseGeometry, style: Geometry2DStyle):
+        """Write a shape, and its label if any."""
+        self._draw_label(geom, style)
+        self._draw_geometry(geom, style)
+
+    def _draw_geometry(self, geom: BaseGeometry, style: Geometry2DStyle):
+        if geom.is_empty:
+            return
+        geom_type = geom.geom_type
+        if geom_type in ("MultiPolygon", "MultiLineString", "MultiPoint", "GeometryCollection"):
+            for part in geom.geoms:
+                self._draw_geometry(part, style)
+            return
+        if geom_type == "Polygon":
+            path = "".join(self._ring(ring.coords) for ring in (geom.exterior, *geom.interiors))
+            if path:
+                css_class = self._css_class("area", style.get_drawing_options(), lambda: self._area_css(style))
+                self._layers[AREA_LAYER].write(css_class, f'<path d="{path}"/>\n')
+            return
+        if geom_type in ("LineString", "LinearRing"):
+            pixels = self._pixels(geom.coords)
+            if len(pixels) > 1:
+                css_class = self._css_class("line", style.get_drawing_options(), lambda: self._line_css(style))
+                self._layers[LINE_LAYER].write(css_class, f'<path d="M{self._points(pixels)}"/>\n')
+            return
+        if geom_type == "Point":
+            css_class = self._css_class("point", style.get_drawing_options(), lambda: self._point_css(style))
+            ((x, y),) = self._pixels(geom.coords).tolist()
+            # the default scatter marker is a circle of lines.markersize points
+            radius = rcParams["lines.markersize"] / 2 * self.dpi / 72
+            self._layers[AREA_LAYER].write(
+                css_class, f'<circle cx="{x}" cy="{y}" r="{radius:.4g}"/>\n'
+            )
+            return
+        raise ValueError(f"Cannot draw type {geom_type}")
+
+    def close(self):
+        """Write the other layers and the styles, does not close the file."""
+        for layer in self._layers:
+            layer.close_group()
+            if layer.fh is not self.fh:
+                layer.fh.seek(0)
+                shutil.copyfileobj(layer.fh, self.fh)
+                layer.fh.close()
+        # CSS applies to the whole document wherever it is, so the classes
+        # can be written once all the styles are known
+        self.fh.write(f"<style>\n{''.join(self._css)}</style>\n")
+        self.fh.write("</svg>\n")
+
+
+def write_svg(
+    extent: ExtentDegrees,
+    to_draw: Iterable[Tuple[BaseGeometry, Geometry2DStyle]],
+    filename: str,
+    figsize: int = 1500,
+    precision: int = 0,
+):
+    """Write shapes to an SVG file, like render_shapes_to_figure would draw them.
+
+    The image is figsize x figsize pixels, the coordinates are rounded to
+    precision decimals. to_draw is consumed only once.
+    """
+    with open(filename, "w", encoding="utf-8") as fh:
+        writer = SvgWriter(fh, extent.as_epsg3857(), figsize, figsize, precision=precision)
+        count = 0
+        for geom, style in to_draw:
+            writer.draw(geom, style)
+            count += 1
+        writer.close()
+    logger.debug(f"Written {count} shapes to {filename}")
+
+
+def representation_to_svg(
+    representations: Iterable[Tuple[int, BaseGeometry, dict]],
+    extent: ExtentDegrees,
+    renderer: Callable[[int, BaseGeometry, dict], Optional[Geometry2DStyle]],
+    filename: str,
+    figsize: int = 1500,
+):
+    """Render the representations to an SVG file, see write_svg.
+
+    Like representation_to_figure, a FeatureStore is restricted to the extent.
+    """
+    if isinstance(representations, FeatureStore):
+        representations = representations.query(extent)
+    write_svg(extent, shapes_iterator(representations, renderer), filename, figsize=figsize)
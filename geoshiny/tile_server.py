@@ -0,0 +1,159 @@
+"""Local HTTP server for tiles rendered on demand.
+
+Serves /{z}/{x}/{y}.png tiles, to browse a style interactively with any
+web map library without generating a whole tile pyramid first.
+"""
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import re
+from typing import Optional
+
+from geoshiny.tiles import (
+    DEFAULT_CACHE_BYTES,
+    TILE_SIZE,
+    TileCache,
+    TileRenderer,
+    init_tile_worker,
+    is_valid_tile,
+    render_tile,
+)
+
+logger = logging.getLogger(__name__)
+
+TILE_PATH = re.compile(r"^/(\d+)/(\d+)/(\d+)\.png$")
+
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    # set by make_server
+    tile_renderer: TileRenderer
+
+    def do_GET(self):
+        if self.path == "/stats":
+            cache = self.tile_renderer.cache
+            stats = dict(vars(cache.stats), tiles=len(cache), bytes=cache.size)
+            self._send(200, "application/json", json.dumps(stats).encode())
+            return
+        match = TILE_PATH.match(self.path)
+        if match is None:
+            self.send_error(404, "Tiles are at /{z}/{x}/{y}.png")
+            return
+        z, x, y = (int(v) for v in match.groups())
+        if not is_valid_tile(z, x, y):
+            self.send_error(404, f"No tile {z}/{x}/{y}")
+            return
+        try:
+            tile = self.tile_renderer.get_tile(z, x, y)
+        except Exception:
+            self.send_error(500, f"Cannot render tile {z}/{x}/{y}")
+            return
+        self._send(200, "image/png", tile)
+
+    def _send(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def make_executor(
+    module_name: str,
+    representer_name: str,
+    renderer_name: str,
+    representation_file: Optional[str] = None,
+    dsn: Optional[str] = None,
+    tile_size: int = TILE_SIZE,
+    workers: Optional[int] = None,
+    processes: bool = True,
+    tile_store: Optional[str] = None,
+    tile_store_bytes: Optional[int] = None,
+    tile_store_max_age: Optional[float] = None,
+) -> Executor:
+    """Create a pool of workers ready to run render_tile.
+
+    See init_tile_worker for the parameters.
+    """
+    init_args = (
+        module_name,
+        representer_name,
+        renderer_name,
+        representation_file,
+        dsn,
+        tile_size,
+        tile_store,
+        tile_store_bytes,
+        tile_store_max_age,
+    )
+    if processes:
+        return ProcessPoolExecutor(
+            max_workers=workers, initializer=init_tile_worker, initargs=init_args
+        )
+    # the worker state is global, so threads can share a single initialization
+    init_tile_worker(*init_args)
+    return ThreadPoolExecutor(max_workers=workers)
+
+
+def make_server(
+    tile_renderer: TileRenderer,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+) -> ThreadingHTTPServer:
+    handler = type(
+        "BoundTileRequestHandler",
+        (TileRequestHandler,),
+        dict(tile_renderer=tile_renderer),
+    )
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def serve(
+    module_name: str,
+    representer_name: str = "representation",
+    renderer_name: str = "renderer",
+    representation_file: Optional[str] = None,
+    dsn: Optional[str] = None,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    tile_size: int = TILE_SIZE,
+    cache_bytes: int = DEFAULT_CACHE_BYTES,
+    workers: Optional[int] = None,
+    processes: bool = True,
+    tile_store: Optional[str] = None,
+    tile_store_bytes: Optional[int] = None,
+    tile_store_max_age: Optional[float] = None,
+):
+    """Serve tiles rendered with the representer and renderer of a module.
+
+    The data comes from the representation file if given, otherwise from
+    PostGIS. Tiles are also persisted in the tile_store file if given.
+    Blocks until interrupted.
+    """
+    executor = make_executor(
+        module_name,
+        representer_name,
+        renderer_name,
+        representation_file=representation_file,
+        dsn=dsn,
+        tile_size=tile_size,
+        workers=workers,
+        processes=processes,
+        tile_store=tile_store,
+        tile_store_bytes=tile_store_bytes,
+        tile_store_max_age=tile_store_max_age,
+    )
+    tile_renderer = TileRenderer(render_tile, executor, TileCache(cache_bytes))
+    server = make_server(tile_renderer, host=host, port=port)
+    logger.info(f"Serving tiles on http://{host}:{port}/{{z}}/{{x}}/{{y}}.png")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        executor.shutdown()
@@ -0,0 +1,214 @@
+"""Persistent tile cache in a single SQLite file.
+
+The file follows the MBTiles layout (a metadata table and a tiles table
+with TMS rows), with an additional style_version column in the tiles key,
+so that changing a style invalidates only its own tiles. Old tiles are
+evicted by age and by total size.
+
+Every thread and process opens its own connection, the database is in WAL
+mode so readers do not block the writer.
+"""
+import hashlib
+import inspect
+import logging
+import marshal
+import sqlite3
+import threading
+import time
+from types import ModuleType
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# check the size limit once every this many writes
+EVICTION_INTERVAL = 100
+# do not update the last access time of a tile more often than this, in seconds
+ACCESS_TIME_RESOLUTION = 60.0
+# how long to wait for other processes holding a lock, in seconds
+LOCK_TIMEOUT = 30.0
+# creating the file from many processes at once can fail without waiting
+SETUP_ATTEMPTS = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tiles (
+    style_version TEXT NOT NULL,
+    zoom_level INTEGER NOT NULL,
+    tile_column INTEGER NOT NULL,
+    tile_row INTEGER NOT NULL,
+    tile_data BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (style_version, zoom_level, tile_column, tile_row)
+);
+CREATE INDEX IF NOT EXISTS tiles_accessed_at ON tiles (accessed_at);
+INSERT OR IGNORE INTO metadata VALUES ('name', 'geoshiny'), ('format', 'png');
+"""
+
+
+def style_version(module: ModuleType) -> str:
+    """The version of the style defined in a module.
+
+    This is the STYLE_VERSION attribute of the module if present, otherwise
+    a hash of its source code. Only the source of this module is hashed:
+    changing helpers imported from other modules, or the data they read,
+    does not give a new version, set STYLE_VERSION when the style has them.
+
+    Modules without source, like the ones defined in a REPL or in a frozen
+    application, are hashed from the bytecode of their functions.
+    """
+    declared = getattr(module, "STYLE_VERSION", None)
+    if declared is not None:
+        return str(declared)
+    return hashlib.sha256(_module_fingerprint(module)).hexdigest()[:16]
+
+
+def _module_fingerprint(module: ModuleType) -> bytes:
+    try:
+        return inspect.getsource(module).encode()
+    except (OSError, TypeError):
+        logger.info(f"No source for module {module.__name__}, using its bytecode as the style version")
+    parts = [module.__name__.encode()]
+    for name, value in sorted(vars(module).items()):
+        code = getattr(value, "__code__", None)
+        if code is not None and getattr(value, "__module__", None) == module.__name__:
+            parts.append(name.encode())
+            parts.append(marshal.dumps(code))
+    return b"\0".join(parts)
+
+
+def _retry_locked(conn: sqlite3.Connection, script: str):
+    """Run a setup script, retrying if the database is locked.
+
+    SQLite does not wait for the lock when two connections would deadlock,
+    which happens when changing the journal mode or creating the tables
+    of a new file from many processes.
+    """
+    for attempt in range(SETUP_ATTEMPTS):
+        try:
+            conn.executescript(script)
+            return
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) or attempt == SETUP_ATTEMPTS - 1:
+                raise
+            time.sleep(0.05 * (attempt + 1))
+
+
+def _tms_row(z: int, y: int) -> int:
+    """MBTiles rows start from the south, unlike XYZ ones."""
+    return 2 ** z - 1 - y
+
+
+class DiskTileStore:
+    """Tiles of a given style version stored in an MBTiles-like file.
+
+    max_bytes limits the total size of the tiles of all the styles, the
+    least recently accessed are evicted first. Tiles older than max_age
+    seconds are not returned and get evicted.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        version: str,
+        max_bytes: Optional[int] = None,
+        max_age: Optional[float] = None,
+    ):
+        self.path = path
+        self.version = version
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._local = threading.local()
+        self._writes = 0
+        _retry_locked(self._connection(), SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+            _retry_locked(conn, "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;")
+            self._local.conn = conn
+        return conn
+
+    def get(self, z: int, x: int, y: int) -> Optional[bytes]:
+        conn = self._connection()
+        row = conn.execute(
+            """
+            SELECT tile_data, created_at, accessed_at FROM tiles
+            WHERE style_version = ? AND zoom_level = ? AND tile_column = ? AND tile_row = ?
+            """,
+            (self.version, z, x, _tms_row(z, y)),
+        ).fetchone()
+        if row is None:
+            return None
+        tile, created_at, accessed_at = row
+        now = time.time()
+        if self.max_age is not None and created_at < now - self.max_age:
+            return None
+        if accessed_at < now - ACCESS_TIME_RESOLUTION:
+            with conn:
+                conn.execute(
+                    """
+                    UPDATE tiles SET accessed_at = ?
+                    WHERE style_version = ? AND zoom_level = ? AND tile_column = ? AND tile_row = ?
+                    """,
+                    (now, self.version, z, x, _tms_row(z, y)),
+                )
+        return tile
+
+    def put(self, z: int, x: int, y: int, tile: bytes):
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.version, z, x, _tms_row(z, y), tile, now, now),
+            )
+        self._writes += 1
+        if self._writes % EVICTION_INTERVAL == 0:
+            self.evict()
+
+    def size(self) -> int:
+        """Total size of the stored tiles, of all the styles."""
+        (total,) = self._connection().execute(
+            "SELECT coalesce(sum(length(tile_data)), 0) FROM tiles"
+        ).fetchone()
+        return total
+
+    def evict(self) -> int:
+        """Delete the expired tiles and the oldest ones above the size limit.
+
+        Returns the number of deleted tiles.
+        """
+        conn = self._connection()
+        deleted = 0
+        with conn:
+            if self.max_age is not None:
+                deleted += conn.execute(
+                    "DELETE FROM tiles WHERE created_at < ?",
+                    (time.time() - self.max_age,),
+                ).rowcount
+            if self.max_bytes is not None:
+                excess = self.size() - self.max_bytes
+                if excess > 0:
+                    to_delete = []
+                    for rowid, tile_size in conn.execute(
+                        "SELECT rowid, length(tile_data) FROM tiles ORDER BY accessed_at"
+                    ):
+                        if excess <= 0:
+                            break
+                        to_delete.append((rowid,))
+                        excess -= tile_size
+                    conn.executemany("DELETE FROM tiles WHERE rowid = ?", to_delete)
+                    deleted += len(to_delete)
+        if deleted:
+            logger.debug(f"Evicted {deleted} tiles from {self.path}")
+        return deleted
+
+    def delete_style(self, version: str) -> int:
+        """Delete all the tiles of a style version, returns how many."""
+        conn = self._connection()
+        with conn:
+            return conn.execute(
+                "DELETE FROM tiles WHERE style_version = ?", (version,)
+            ).rowcount
@@ -0,0 +1,276 @@
+"""On demand rendering of map tiles.
+
+Tiles use the usual XYZ scheme of web maps, in EPSG:3857. They are
+rendered through the same path as the other charts, from PostGIS or from
+a representation file, in a pool of workers. Rendered tiles are kept in an
+in-memory LRU cache, optionally backed by a DiskTileStore, and concurrent
+requests for the same tile share the same rendering.
+"""
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass
+import importlib
+from io import BytesIO
+import logging
+import math
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from shapely.geometry.base import BaseGeometry
+
+from geoshiny.draw_helpers import render_shapes_to_figure, shapes_iterator
+from geoshiny.feature_store import FeatureStore
+from geoshiny.representation_files import data_to_representation, file_to_representation
+from geoshiny.tile_store import DiskTileStore, style_version
+from geoshiny.types import ExtentDegrees
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+# how much, relatively, to enlarge a tile when looking for the shapes to
+# draw, so that markers and labels of shapes just outside are not cut
+TILE_MARGIN = 0.125
+# latitude of the edges of the EPSG:3857 square, the one of tile 0/0/0
+MAX_LATITUDE = math.degrees(math.atan(math.sinh(math.pi)))
+# default size of the in-memory tile cache
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+TileKey = Tuple[int, int, int]
+
+
+def tile_extent(z: int, x: int, y: int) -> ExtentDegrees:
+    """The extent of an XYZ tile, as used by OpenStreetMap."""
+    n = 2 ** z
+
+    def lat(row: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return ExtentDegrees(
+        latmin=lat(y + 1),
+        latmax=lat(y),
+        lonmin=x / n * 360.0 - 180.0,
+        lonmax=(x + 1) / n * 360.0 - 180.0,
+    )
+
+
+def tile_search_extent(z: int, x: int, y: int) -> ExtentDegrees:
+    """The extent of a tile enlarged by TILE_MARGIN, where to look for shapes.
+
+    At the lowest zoom levels the margin would go past the poles and the
+    antimeridian, where EPSG:3857 is not defined, so it is clamped.
+    """
+    extent = tile_extent(z, x, y).enlarged(TILE_MARGIN)
+    return ExtentDegrees(
+        latmin=max(extent.latmin, -MAX_LATITUDE),
+        latmax=min(extent.latmax, MAX_LATITUDE),
+        lonmin=max(extent.lonmin, -180.0),
+        lonmax=min(extent.lonmax, 180.0),
+    )
+
+
+def is_valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= 30 and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    # requests served by a rendering started by another request
+    coalesced: int = 0
+
+
+class TileCache:
+    """Thread-safe LRU cache of rendered tiles, limited by total bytes."""
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.stats = CacheStats()
+        self._tiles: "OrderedDict[TileKey, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tiles)
+
+    def get(self, key: TileKey) -> Optional[bytes]:
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is None:
+                self.stats.misses += 1
+                return None
+            self._tiles.move_to_end(key)
+            self.stats.hits += 1
+            return tile
+
+    def put(self, key: TileKey, tile: bytes):
+        if len(tile) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._tiles.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._tiles[key] = tile
+            self.size += len(tile)
+            while self.size > self.max_bytes:
+                _, evicted = self._tiles.popitem(last=False)
+                self.size -= len(evicted)
+                self.stats.evictions += 1
+
+
+class TileRenderer:
+    """Get tiles from the cache or render them in the executor.
+
+    render_function receives z, x and y and returns the encoded tile, it
+    is called in the executor so it has to be picklable for process pools.
+    """
+
+    def __init__(
+        self,
+        render_function: Callable[[int, int, int], bytes],
+        executor: Executor,
+        cache: Optional[TileCache] = None,
+    ):
+        self.render_function = render_function
+        self.executor = executor
+        self.cache = cache if cache is not None else TileCache()
+        self._in_flight: Dict[TileKey, Future] = {}
+        self._lock = threading.Lock()
+
+    def get_tile_future(self, z: int, x: int, y: int) -> Future:
+        key = (z, x, y)
+        # under the lock, a tile finishing now is either cached or in flight
+        with self._lock:
+            tile = self.cache.get(key)
+            if tile is not None:
+                cached: Future = Future()
+                cached.set_result(tile)
+                return cached
+            in_flight = self._in_flight.get(key)
+            if in_flight is not None:
+                self.cache.stats.coalesced += 1
+                return in_flight
+            future = self.executor.submit(self.render_function, z, x, y)
+            self._in_flight[key] = future
+        future.add_done_callback(lambda f: self._rendered(key, f))
+        return future
+
+    def _rendered(self, key: TileKey, future: Future):
+        # exception() raises CancelledError for a cancelled future
+        if future.cancelled():
+            logger.debug(f"Rendering of tile {key} cancelled")
+        elif future.exception() is None:
+            self.cache.put(key, future.result())
+        else:
+            logger.error(f"Cannot render tile {key}", exc_info=future.exception())
+        with self._lock:
+            # a new rendering may have been started meanwhile
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def get_tile(self, z: int, x: int, y: int) -> bytes:
+        """Get a tile, blocking until it is rendered."""
+        return self.get_tile_future(z, x, y).result()
+
+
+def shapes_to_png(
+    extent: ExtentDegrees,
+    to_draw,
+    size: int = TILE_SIZE,
+) -> bytes:
+    fig = render_shapes_to_figure(extent, to_draw, figsize=size)
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+# state of the tile workers, set by init_tile_worker in every process
+_worker: dict = {}
+
+
+def init_tile_worker(
+    module_name: str,
+    representer_name: str = "representation",
+    renderer_name: str = "renderer",
+    representation_file: Optional[str] = None,
+    dsn: Optional[str] = None,
+    tile_size: int = TILE_SIZE,
+    tile_store: Optional[str] = None,
+    tile_store_bytes: Optional[int] = None,
+    tile_store_max_age: Optional[float] = None,
+):
+    """Prepare the current process to render tiles with render_tile.
+
+    Without a representation file the data is extracted from PostGIS for
+    each tile, otherwise the file is loaded in memory once.
+
+    If tile_store is given, tiles are read from and written to that file,
+    see DiskTileStore for the meaning of the other tile_store parameters.
+    """
+    module = importlib.import_module(module_name)
+    store = None
+    if tile_store is not None:
+        # the same module can define many styles, and the size changes the tiles
+        version = f"{style_version(module)}:{representer_name}:{renderer_name}:{tile_size}"
+        store = DiskTileStore(
+            tile_store,
+            version,
+            max_bytes=tile_store_bytes,
+            max_age=tile_store_max_age,
+        )
+    _worker.update(
+        representer=getattr(module, representer_name),
+        renderer=getattr(module, renderer_name),
+        dsn=dsn,
+        tile_size=tile_size,
+        representations=None,
+        store=store,
+    )
+    if representation_file is not None:
+        representations = FeatureStore.from_representations(
+            file_to_representation(representation_file)
+        )
+        _worker["representations"] = representations
+        logger.info(f"Loaded {len(representations)} representations")
+
+
+async def _representations_from_db(
+    extent: ExtentDegrees,
+    representer: Callable,
+    dsn: Optional[str],
+) -> List[Tuple[int, BaseGeometry, dict]]:
+    # workers serving a representation file do not need asyncpg
+    from geoshiny.database_extract import stream_from_extent
+
+    return list(
+        data_to_representation(
+            [r async for r in stream_from_extent(extent, dsn=dsn)], representer
+        )
+    )
+
+
+def render_tile(z: int, x: int, y: int) -> bytes:
+    """Render a tile to PNG, in a worker prepared with init_tile_worker."""
+    store = _worker["store"]
+    if store is not None:
+        tile = store.get(z, x, y)
+        if tile is not None:
+            return tile
+    extent = tile_extent(z, x, y)
+    search_extent = tile_search_extent(z, x, y)
+    if _worker["representations"] is not None:
+        representations = _worker["representations"].query(search_extent)
+    else:
+        representations = asyncio.run(
+            _representations_from_db(search_extent, _worker["representer"], _worker["dsn"])
+        )
+    tile = shapes_to_png(
+        extent,
+        shapes_iterator(representations, _worker["renderer"]),
+        size=_worker["tile_size"],
+    )
+    if store is not None:
+        store.put(z, x, y, tile)
+    return tile
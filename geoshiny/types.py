@@ -1,11 +1,29 @@
 from dataclasses import dataclass, fields
-from typing import Optional
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
 
-from pyproj import Transformer
-from shapely.geometry.base import BaseGeometry
+if TYPE_CHECKING:
+    from pyproj import Transformer
+    from shapely.geometry.base import BaseGeometry
 
 
-TRAN_4326_TO_3857 = Transformer.from_crs("EPSG:4326", "EPSG:3857")
+@lru_cache()
+def transformer_4326_to_3857() -> "Transformer":
+    """The EPSG:4326 to EPSG:3857 transformer, created on first use.
+
+    Importing pyproj and creating it is slow, and many processes, like
+    workers rendering representations, never convert an extent.
+    """
+    from pyproj import Transformer
+
+    return Transformer.from_crs("EPSG:4326", "EPSG:3857")
+
+
+def __getattr__(name: str):
+    # TRAN_4326_TO_3857 used to be created at import
+    if name == "TRAN_4326_TO_3857":
+        return transformer_4326_to_3857()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 @dataclass
@@ -18,7 +36,7 @@ class Geometry2DStyle:
     linestyle: Optional[str] = None
     color: Optional[str] = None
     alpha: Optional[float] = None
-    shape: Optional[BaseGeometry] = None
+    shape: Optional["BaseGeometry"] = None
     label: Optional[dict] = None
     # if not None, how much area on the toal must a shape have to be drawn
     min_label_area_ratio: Optional[float] = None
@@ -71,6 +89,15 @@ class ExtentDegrees:
             lonmax=max(lon_mid - lon_radius, lon_mid + lon_radius),
         )
 
+    def union(self, other: "ExtentDegrees") -> "ExtentDegrees":
+        """Calculate the smallest extent containing both extents."""
+        return ExtentDegrees(
+            latmin=min(self.latmin, other.latmin),
+            latmax=max(self.latmax, other.latmax),
+            lonmin=min(self.lonmin, other.lonmin),
+            lonmax=max(self.lonmax, other.lonmax),
+        )
+
     def as_e7_dict(self):
         return dict(
             latmin=int(self.latmin * 10 ** 7),
@@ -85,12 +112,13 @@ class ExtentDegrees:
         The order is the same required by PostGIS st_makeenvelope
         that is: lonmin, latmin, lonmax, latmax
         """
-        lonmin, latmin = TRAN_4326_TO_3857.transform(self.latmin, self.lonmin)
-        lonmax, latmax = TRAN_4326_TO_3857.transform(self.latmax, self.lonmax)
+        transformer = transformer_4326_to_3857()
+        lonmin, latmin = transformer.transform(self.latmin, self.lonmin)
+        lonmax, latmax = transformer.transform(self.latmax, self.lonmax)
         return (lonmin, latmin, lonmax, latmax)
 
 
 @dataclass
 class GeomRepresentation:
     properties: dict
-    geometry: Optional[BaseGeometry] = None
+    geometry: Optional["BaseGeometry"] = None
@@ -0,0 +1,35 @@
+import pytest
+from shapely.geometry import LineString, Point, box
+
+from geoshiny.types import ExtentDegrees, Geometry2DStyle
+
+
+@pytest.fixture
+def extent():
+    """A small area of Berlin, the one used by the unit tests."""
+    return ExtentDegrees(
+        latmin=52.5275,
+        latmax=52.5356,
+        lonmin=13.3613,
+        lonmax=13.3768,
+    )
+
+
+@pytest.fixture
+def sample_shapes(extent):
+    """Overlapping boxes with two colors, a line and a point."""
+    lonmin, latmin, lonmax, latmax = extent.as_epsg3857()
+    step = (lonmax - lonmin) / 10
+    shapes = []
+    for i in range(10):
+        x = lonmin + i * step
+        y = latmin + i * step
+        shapes.append(
+            (
+                box(x, y, x + step * 2, y + step * 2),
+                Geometry2DStyle(facecolor="red" if i % 2 else "blue", edgecolor="black"),
+            )
+        )
+    shapes.append((LineString([(lonmin, latmin), (lonmax, latmax)]), Geometry2DStyle(color="green")))
+    shapes.append((Point(lonmin + step, latmax - step), Geometry2DStyle(color="black")))
+    return shapes
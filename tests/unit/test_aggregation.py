@@ -0,0 +1,32 @@
+import math
+
+import pytest
+from shapely.geometry import Point
+
+from geoshiny.aggregation import (
+    AGGREGATE_COUNT_TAG,
+    aggregated_count,
+    cell_shape,
+    cell_size_for_pixels,
+    marker_shape,
+)
+from geoshiny.types import ExtentDegrees
+
+
+def test_cell_size_for_pixels():
+    extent = ExtentDegrees(latmin=52.5, latmax=52.6, lonmin=13.3, lonmax=13.4)
+    lonmin, _, lonmax, _ = extent.as_epsg3857()
+    assert cell_size_for_pixels(extent, 1000, 1) == pytest.approx((lonmax - lonmin) / 1000)
+    assert cell_size_for_pixels(extent, 1000) == pytest.approx((lonmax - lonmin) / 250)
+
+
+def test_cell_and_marker_shapes():
+    assert aggregated_count({}) == 1
+    assert aggregated_count({AGGREGATE_COUNT_TAG: 7}) == 7
+    # centroid of points snapped to (20, -10)
+    assert cell_shape(Point(23, -12), 10.0).bounds == (15.0, -15.0, 25.0, -5.0)
+    full = marker_shape(Point(0, 0), 500, 10.0)
+    assert full.bounds == pytest.approx((-5.0, -5.0, 5.0, 5.0))
+    quarter = marker_shape(Point(0, 0), 25, 10.0)
+    assert quarter.area == pytest.approx(full.area / 4, rel=0.01)
+    assert quarter.area == pytest.approx(math.pi * 2.5 ** 2, rel=0.01)
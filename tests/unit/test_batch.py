@@ -0,0 +1,47 @@
+import pytest
+from shapely.geometry import box
+
+from geoshiny.batch import ChartJob, generate_charts, render_jobs, union_extent
+from geoshiny.types import ExtentDegrees, Geometry2DStyle
+
+
+def red_renderer(osm_id, shape, d):
+    return Geometry2DStyle(facecolor="red")
+
+
+def blue_renderer(osm_id, shape, d):
+    if d["kind"] == "building":
+        return Geometry2DStyle(facecolor="blue")
+
+
+def test_render_jobs(tmpdir, extent):
+    lonmin, latmin, lonmax, latmax = extent.as_epsg3857()
+    step = (lonmax - lonmin) / 10
+    reprs = [
+        (i, box(lonmin + i * step, latmin, lonmin + (i + 1) * step, latmax), dict(kind="building"))
+        for i in range(10)
+    ]
+    jobs = [
+        ChartJob(extent, red_renderer, str(tmpdir.join("red.png")), figsize=200),
+        ChartJob(extent.enlarged(-0.5), blue_renderer, str(tmpdir.join("blue.png")), figsize=300),
+    ]
+    assert union_extent(jobs) == extent
+    timings = render_jobs(reprs, jobs, processes=2)
+    assert set(timings.jobs) == {job.filename for job in jobs}
+    assert timings.total >= timings.rendering > 0
+    for job in jobs:
+        assert tmpdir.join(job.filename.split("/")[-1]).size() > 500
+
+
+def test_union_extent(extent):
+    west = extent.enlarged(-0.5)
+    east = ExtentDegrees(latmin=west.latmin, latmax=west.latmax, lonmin=extent.lonmax, lonmax=extent.lonmax + 0.01)
+    jobs = [ChartJob(west, red_renderer, "west.png"), ChartJob(east, red_renderer, "east.png")]
+    assert union_extent(jobs) == ExtentDegrees(
+        latmin=west.latmin, latmax=west.latmax, lonmin=west.lonmin, lonmax=extent.lonmax + 0.01
+    )
+    assert union_extent(jobs[:1]) == west
+    with pytest.raises(ValueError):
+        union_extent([])
+    # nothing to extract, no connection is needed
+    assert generate_charts([], red_renderer).total == 0
@@ -0,0 +1,37 @@
+import numpy as np
+
+from geoshiny.draw_helpers import (
+    figure_to_numpy,
+    numpy_to_file,
+    render_shapes_to_figure,
+    render_shapes_to_numpy,
+)
+
+
+def test_batched_render_matches_figure(extent, sample_shapes):
+    expected = figure_to_numpy(render_shapes_to_figure(extent, sample_shapes, figsize=300))
+    # a budget big enough to have a single batch
+    single_batch = render_shapes_to_numpy(extent, iter(sample_shapes), figsize=300)
+    assert single_batch.shape == (300, 300, 4)
+    assert np.array_equal(expected, single_batch)
+
+
+def test_batched_render_small_budget(tmpdir, extent, sample_shapes):
+    polygons = [s for s in sample_shapes if s[0].geom_type == "Polygon"]
+    expected = figure_to_numpy(render_shapes_to_figure(extent, polygons, figsize=300))
+    # every shape is in its own batch, the order is kept
+    one_by_one = render_shapes_to_numpy(extent, iter(polygons), figsize=300, memory_budget=1)
+    assert np.array_equal(expected, one_by_one)
+
+    target_file = tmpdir.join("img.png")
+    numpy_to_file(one_by_one, str(target_file))
+    assert target_file.size() > 1_000
+
+
+def test_zorder_across_batches(extent, sample_shapes):
+    # the line and the point come first, but are drawn above the polygons
+    reordered = sample_shapes[-2:] + sample_shapes[:-2]
+    expected = figure_to_numpy(render_shapes_to_figure(extent, reordered, figsize=300))
+    one_by_one = render_shapes_to_numpy(extent, iter(reordered), figsize=300, memory_budget=1)
+    # only the rounding of the composition of the layers differs
+    assert np.abs(expected.astype(int) - one_by_one).max() <= 1
@@ -1,6 +1,28 @@
 import re
 
-from geoshiny.database_extract import build_tags_join_query
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import Point
+
+from geoshiny import database_extract
+from geoshiny.aggregation import AGGREGATE_COUNT_TAG
+from geoshiny.database_extract import (
+    QUERY_CHUNK_SIZE,
+    ExtractionBudget,
+    ExtractionTooLarge,
+    TableStats,
+    budgeted_cell_size,
+    estimate_extraction,
+    build_aggregated_points_query,
+    build_tags_join_query,
+    clear_catalog_cache,
+    geom_batches_in_extent,
+    geometry_tables,
+    next_batch_size,
+    prune_tables,
+)
+from geoshiny.types import ExtentDegrees
 
 
 def test_ebuild_tags_join_query():
@@ -25,3 +47,223 @@ def test_ebuild_tags_join_query():
         "abs(eee.blip.osm_id) = eee.tags.osm_id WHERE geom && "
         "st_makeenvelope($1, $2, $3, $4, 3857)"
     )
+
+
+def test_build_aggregated_points_query():
+    sql = build_aggregated_points_query("osm", ("a_point", "b_point"))
+    sql = re.sub(" +", " ", sql.replace("\n", " "))
+    assert sql.count("UNION ALL") == 1
+    assert "GROUP BY st_snaptogrid(geom, $5), tag_values" in sql
+    assert "unnest($6::text[])" in sql
+    assert "ON abs(cells.osm_id) = osm.tags.osm_id" in sql
+
+
+def test_prune_tables():
+    stats = {
+        # far away
+        "far_polygon": TableStats("far_polygon", 1000.0, True, (100.0, 100.0, 200.0, 200.0)),
+        # empty when analyzed, but data may have been loaded since
+        "empty_point": TableStats("empty_point", 0.0, True, None),
+        # never analyzed, nothing can be said
+        "new_point": TableStats("new_point", 0.0, False, None),
+        "big_line": TableStats("big_line", 1000.0, True, (-10.0, -10.0, 10.0, 10.0)),
+        # just outside, but the estimated extent can miss outliers
+        "near_polygon": TableStats("near_polygon", 10.0, True, (22.0, 0.0, 30.0, 5.0)),
+        "small_polygon": TableStats("small_polygon", 10.0, True, (0.0, 0.0, 5.0, 5.0)),
+    }
+    bounds = (0.0, 0.0, 20.0, 20.0)
+    tables = ["far_polygon", "empty_point", "new_point", "big_line", "near_polygon", "small_polygon", "unknown_line"]
+    # the order is kept
+    assert prune_tables(tables, stats, bounds) == tables[1:]
+    assert prune_tables(tables, stats, (0.0, 0.0, 19.0, 20.0)) == [
+        "empty_point", "new_point", "big_line", "small_polygon", "unknown_line"
+    ]
+
+
+class FakeConnection:
+    def __init__(self, records):
+        self.records = records
+        self.queries = 0
+
+    async def fetch(self, query, *args):
+        self.queries += 1
+        return self.records
+
+
+@pytest.mark.asyncio
+async def test_geometry_tables_cache():
+    clear_catalog_cache()
+    conn = FakeConnection([
+        dict(table_name="a_point", reltuples=10.0, analyzed=True, xmin=0.0, ymin=0.0, xmax=1.0, ymax=1.0),
+        dict(table_name="b_polygon", reltuples=10.0, analyzed=True, xmin=5.0, ymin=5.0, xmax=6.0, ymax=6.0),
+        dict(table_name="tags", reltuples=10.0, analyzed=True, xmin=None, ymin=None, xmax=None, ymax=None),
+    ])
+    assert await geometry_tables(conn, cache_key="dsn") == ["a_point", "b_polygon"]
+    extent = ExtentDegrees(latmin=0.0, latmax=0.00001, lonmin=0.0, lonmax=0.00001)
+    assert await geometry_tables(conn, extent=extent, cache_key="dsn") == ["a_point"]
+    assert conn.queries == 1
+    # explicitly given tables are not pruned without an extent
+    assert await geometry_tables(conn, ["b_polygon"], cache_key="dsn") == ["b_polygon"]
+    clear_catalog_cache()
+    assert await geometry_tables(conn, ["b_polygon"], extent=extent, cache_key="dsn") == []
+    assert conn.queries == 2
+
+
+class FakeCursor:
+    def __init__(self, records):
+        self.records = records
+        self.fetches = []
+
+    async def fetch(self, n):
+        self.fetches.append(n)
+        ret = self.records[:n]
+        self.records = self.records[n:]
+        return ret
+
+
+class FakeTransaction:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class FakeCursorConnection:
+    def __init__(self, records):
+        self.cursor_obj = FakeCursor(records)
+
+    def transaction(self):
+        return FakeTransaction()
+
+    async def cursor(self, query, *args):
+        return self.cursor_obj
+
+
+@pytest.mark.asyncio
+async def test_geom_batches_in_extent(monkeypatch):
+    monkeypatch.setattr(database_extract, "INITIAL_BATCH_ROWS", 10)
+    records = [
+        dict(osm_id=i, geom=shapely.to_wkb(Point(i, i)), tags=dict(name=f"n{i}"))
+        for i in range(100)
+    ]
+    conn = FakeCursorConnection(records)
+    extent = ExtentDegrees(latmin=0.0, latmax=1.0, lonmin=0.0, lonmax=1.0)
+    # every row takes more or less 230 bytes
+    batches = [
+        b async for b in geom_batches_in_extent(conn, "osm", extent, ["a_point"], target_bytes=5_000)
+    ]
+    assert conn.cursor_obj.fetches[0] == 10
+    assert 15 < conn.cursor_obj.fetches[1] < 25
+    assert sum(len(b) for b in batches) == 100
+    osm_id, geom, tags = batches[1][0]
+    assert osm_id == 10
+    assert geom.equals(Point(10, 10))
+    assert tags == dict(name="n10")
+
+    conn = FakeCursorConnection(records)
+    batches = [
+        b async for b in geom_batches_in_extent(conn, "osm", extent, ["a_point"], columnar=True)
+    ]
+    # after the first batch, the rest fits in the default target size
+    assert [len(b) for b in batches] == [10, 90]
+    assert batches[1].osm_ids.dtype == np.int64
+    assert shapely.get_x(batches[1].geometries).tolist() == list(range(10, 100))
+    assert list(batches[0])[5][2] == dict(name="n5")
+
+
+class FakeQueryConnection:
+    """Returns the aggregated records for aggregation queries."""
+
+    def __init__(self, records, aggregated_records):
+        self.records = records
+        self.aggregated_records = aggregated_records
+        self.cursors = []
+
+    def transaction(self):
+        return FakeTransaction()
+
+    async def cursor(self, query, *args):
+        self.cursors.append((query, args))
+        if "st_snaptogrid" in query:
+            return FakeCursor(self.aggregated_records)
+        return FakeCursor(self.records)
+
+
+@pytest.mark.asyncio
+async def test_aggregated_points():
+    records = [dict(osm_id=1, geom=shapely.to_wkb(Point(0, 0)), tags=dict(highway="primary"))]
+    aggregated_records = [
+        dict(osm_id=2, geom=shapely.to_wkb(Point(5, 5)), tags=dict(shop="bakery"), count=12),
+        dict(osm_id=-7, geom=shapely.to_wkb(Point(15, 5)), tags=None, count=1),
+    ]
+    conn = FakeQueryConnection(records, aggregated_records)
+    extent = ExtentDegrees(latmin=0.0, latmax=1.0, lonmin=0.0, lonmax=1.0)
+    batches = [
+        b async for b in geom_batches_in_extent(
+            conn, "osm", extent, ["a_point", "b_line"], point_cell_size=10.0, aggregate_keys=["shop"]
+        )
+    ]
+    rows = [row for batch in batches for row in batch]
+    assert [r[0] for r in rows] == [1, 2, -7]
+    assert rows[0][2] == dict(highway="primary")
+    assert rows[1][2] == {"shop": "bakery", AGGREGATE_COUNT_TAG: 12}
+    assert rows[2][2] == {AGGREGATE_COUNT_TAG: 1}
+    (line_query, line_args), (point_query, point_args) = conn.cursors
+    assert "a_point" not in line_query and "b_line" not in point_query
+    assert point_args[4:] == (10.0, ["shop"])
+
+    # without a cell size, points are fetched as they are
+    conn = FakeQueryConnection(records, aggregated_records)
+    batches = [b async for b in geom_batches_in_extent(conn, "osm", extent, ["a_point"])]
+    assert len(conn.cursors) == 1 and len(conn.cursors[0][1]) == 4
+
+
+class FakeExplainConnection:
+    """Plans row_width bytes per row, rows depend on the aggregation."""
+
+    def __init__(self, rows, aggregated_rows, row_width=100):
+        self.rows = rows
+        self.aggregated_rows = aggregated_rows
+        self.row_width = row_width
+        self.explained = []
+
+    async def fetchval(self, query, *args):
+        assert query.startswith("EXPLAIN (FORMAT JSON) ")
+        self.explained.append(args)
+        rows = self.aggregated_rows if "st_snaptogrid" in query else self.rows
+        return f'[{{"Plan": {{"Plan Rows": {rows}, "Plan Width": {self.row_width}}}}}]'
+
+
+@pytest.mark.asyncio
+async def test_estimate_extraction():
+    extent = ExtentDegrees(latmin=0.0, latmax=1.0, lonmin=0.0, lonmax=1.0)
+    conn = FakeExplainConnection(1000, 10)
+    estimate = await estimate_extraction(conn, "osm", extent, ["a_point", "b_line"])
+    assert (estimate.rows, estimate.bytes) == (1000, 100_000)
+    estimate = await estimate_extraction(conn, "osm", extent, ["a_point", "b_line"], point_cell_size=5.0)
+    assert (estimate.rows, estimate.bytes) == (1010, 101_000)
+    assert (await estimate_extraction(conn, "osm", extent, [])).rows == 0
+
+
+@pytest.mark.asyncio
+async def test_budgeted_cell_size():
+    extent = ExtentDegrees(latmin=0.0, latmax=1.0, lonmin=0.0, lonmax=1.0)
+    conn = FakeExplainConnection(1_000_000, 500)
+    tables = ["a_point"]
+    assert await budgeted_cell_size(conn, "osm", extent, tables, ExtractionBudget(max_rows=10 ** 6)) is None
+    budget = ExtractionBudget(max_bytes=1_000_000, fallback_cell_size=20.0)
+    assert await budgeted_cell_size(conn, "osm", extent, tables, budget) == 20.0
+    assert conn.explained[-1][4] == 20.0
+    # lines cannot be aggregated
+    with pytest.raises(ExtractionTooLarge) as info:
+        await budgeted_cell_size(conn, "osm", extent, ["a_point", "b_line"], budget)
+    assert info.value.estimate.rows == 1_000_500
+    with pytest.raises(ExtractionTooLarge):
+        await budgeted_cell_size(conn, "osm", extent, tables, ExtractionBudget(max_rows=10))
+
+
+def test_next_batch_size():
+    assert next_batch_size(1000, 1_000_000, 10_000_000) == 10_000
+    assert next_batch_size(1000, 0, 10_000_000) == QUERY_CHUNK_SIZE
+    assert next_batch_size(10, 10 ** 12, 10) == 1
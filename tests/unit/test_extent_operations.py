@@ -22,3 +22,10 @@ def test_extent_operations():
         "lonmin": -739605910,
         "lonmax": -739513290,
     }
+
+
+def test_extent_union():
+    a = ExtentDegrees(latmin=52.0, latmax=52.5, lonmin=13.0, lonmax=13.5)
+    b = ExtentDegrees(latmin=52.2, latmax=52.7, lonmin=12.5, lonmax=13.2)
+    assert a.union(b) == ExtentDegrees(latmin=52.0, latmax=52.7, lonmin=12.5, lonmax=13.5)
+    assert a.union(a) == a
@@ -0,0 +1,82 @@
+from copy import deepcopy
+import pickle
+
+from shapely.geometry import Point, box
+
+from geoshiny.draw_helpers import (
+    data_to_representation_file,
+    file_to_representation,
+    representation_to_figure,
+)
+from geoshiny.feature_store import FeatureStore
+from geoshiny.types import ExtentDegrees, Geometry2DStyle
+
+
+def sample_store(extent) -> FeatureStore:
+    lonmin, latmin, lonmax, latmax = extent.as_epsg3857()
+    step = (lonmax - lonmin) / 10
+    return FeatureStore.from_representations(
+        (i, box(lonmin + i * step, latmin, lonmin + (i + 1) * step, latmax), dict(even=i % 2 == 0))
+        for i in range(10)
+    )
+
+
+def test_interning(extent):
+    store = sample_store(extent)
+    assert len(store) == 10
+    reprs = [r for _, _, r in store]
+    assert reprs[0] is reprs[2]
+    assert reprs[0] is not reprs[1]
+    assert list(store.osm_ids) == list(range(10))
+    # not serializable representations are kept as they are
+    obj = object()
+    store = FeatureStore.from_representations([(1, Point(0, 0), dict(a=obj)), (2, Point(0, 0), dict(a=obj))])
+    assert [r["a"] for _, _, r in store] == [obj, obj]
+    # equal only across types, or mutable
+    different = [{1: "a"}, {"1": "a"}, dict(a=1), dict(a=1.0), dict(a=True), dict(a=[1]), dict(a=(1,)), dict(a={1})]
+    store = FeatureStore.from_representations(
+        (i, Point(0, 0), r) for i, r in enumerate(different + deepcopy(different))
+    )
+    reprs = [r for _, _, r in store]
+    assert [type(r) for r in reprs[:8]] == [dict] * 8
+    assert all(a is not b for i, a in enumerate(reprs[:8]) for b in reprs[i + 1: 8])
+    assert all(a is b for a, b in zip(reprs[:7], reprs[8:15]))
+    assert reprs[7] is not reprs[15]
+
+
+def test_query_views(extent):
+    store = sample_store(extent)
+    west = store.query(extent.enlarged(-0.5))
+    # the middle half covers part of the boxes from 2 to 7
+    assert list(west.osm_ids) == list(range(2, 8))
+    # a view of a view is restricted to both
+    left = ExtentDegrees(
+        latmin=extent.latmin,
+        latmax=extent.latmax,
+        lonmin=extent.lonmin,
+        lonmax=(extent.lonmin + extent.lonmax) / 2,
+    )
+    assert list(west.query(left).osm_ids) == [2, 3, 4, 5]
+    # views share the same data and index
+    assert west._columns is store._columns
+    assert list(store.query(ExtentDegrees(latmin=0, latmax=1, lonmin=0, lonmax=1))) == []
+
+
+def test_pickle_view(extent):
+    store = sample_store(extent)
+    view = store.query(extent.enlarged(-0.5))
+    copy = pickle.loads(pickle.dumps(view))
+    assert len(copy._columns.osm_ids) == len(view) == 6
+    assert [(i, g.wkt, r) for i, g, r in copy] == [(i, g.wkt, r) for i, g, r in view]
+
+
+def test_store_as_representations(tmpdir, extent):
+    store = sample_store(extent)
+    fig = representation_to_figure(
+        store, extent, lambda osm_id, geom, d: Geometry2DStyle(facecolor="red"), figsize=100
+    )
+    assert len(fig.axes[0].patches) == 10
+
+    target = str(tmpdir / "reprs.jsonl")
+    data_to_representation_file(store, target, lambda osm_id, geom, tags: tags)
+    assert [(i, r) for i, _, r in file_to_representation(target)] == [(i, r) for i, _, r in store]
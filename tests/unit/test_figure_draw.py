@@ -1,9 +1,22 @@
 import json
 
-from shapely.geometry import shape
+from matplotlib.path import Path
+import numpy as np
+from shapely.geometry import (
+    GeometryCollection,
+    LinearRing,
+    LineString,
+    MultiLineString,
+    MultiPoint,
+    MultiPolygon,
+    Point,
+    Polygon,
+    box,
+    shape,
+)
 
 from geoshiny.types import ExtentDegrees, Geometry2DStyle
-from geoshiny.draw_helpers import render_shapes_to_figure, figure_to_numpy
+from geoshiny.draw_helpers import polygons_to_paths, render_shapes_to_figure, figure_to_numpy
 
 # Geometry types
 #  'Point',
@@ -50,3 +63,65 @@ def test_render_polygon(tmpdir):
 
     image_from_plot = figure_to_numpy(fig)
     assert image_from_plot.shape == (1500, 1500, 4)
+
+
+def test_polygons_to_paths():
+    outer = [(0, 0), (10, 0), (10, 10), (0, 10)]
+    hole = [(2, 2), (4, 2), (4, 4), (2, 4)]
+    paths = polygons_to_paths(
+        [
+            # the hole has the same orientation as the exterior
+            Polygon(outer, [hole]),
+            MultiPolygon([box(0, 0, 1, 1), box(2, 2, 3, 3, ccw=False)]),
+            Point(0, 0),
+            Polygon(),
+        ]
+    )
+    assert paths[2] is None and paths[3] is None
+    holed, multi = paths[0], paths[1]
+    assert list(holed.codes).count(Path.MOVETO) == 2
+    # matplotlib fills with the nonzero rule, the hole must wind the other way
+    assert LinearRing(holed.vertices[:5]).is_ccw
+    assert not LinearRing(holed.vertices[5:]).is_ccw
+    assert len(multi.vertices) == 10
+    assert multi.contains_point((0.5, 0.5)) and multi.contains_point((2.5, 2.5))
+    assert np.array_equal(polygons_to_paths([box(0, 0, 1, 1)])[0].vertices, np.asarray(box(0, 0, 1, 1).exterior.coords))
+
+
+def test_render_all_geometry_types():
+    extent = ExtentDegrees(
+        latmin=52.5275,
+        latmax=52.5356,
+        lonmin=13.3613,
+        lonmax=13.3768,
+    )
+    lonmin, latmin, lonmax, latmax = extent.as_epsg3857()
+
+    def at(x, y):
+        return lonmin + x * (lonmax - lonmin) / 10, latmin + y * (latmax - latmin) / 10
+
+    shapes = [
+        Point(at(1, 1)),
+        MultiPoint([at(2, 1), at(3, 1)]),
+        LineString([at(1, 2), at(9, 2)]),
+        LinearRing([at(1, 3), at(2, 3), at(2, 4)]),
+        MultiLineString([[at(1, 5), at(4, 5)], [at(6, 5), at(9, 5)]]),
+        Polygon([at(1, 6), at(2, 6), at(2, 7)]),
+        MultiPolygon([box(*at(3, 6), *at(4, 7)), box(*at(5, 6), *at(6, 7))]),
+        GeometryCollection([Point(at(1, 8)), box(*at(3, 8), *at(4, 9))]),
+        Polygon(),
+    ]
+    fig = render_shapes_to_figure(
+        extent,
+        [(s, Geometry2DStyle(color="red")) for s in shapes],
+        figsize=100,
+    )
+    ax = fig.axes[0]
+    # a single patch per (multi)polygon
+    assert len(ax.patches) == 3
+    assert len(ax.lines) == 3
+    assert len(ax.collections) == 3
+    # the gap between the two parts of the MultiLineString is not drawn
+    image = np.flipud(figure_to_numpy(fig))
+    assert image[50, 45][3] == 0
+    assert image[50, 20][3] > 0
@@ -0,0 +1,40 @@
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ("matplotlib", "asyncpg", "shapely", "pyproj", "numpy")
+
+
+def imported_modules(statement: str) -> set:
+    """Run an import in a new interpreter, return the heavy modules it loaded."""
+    code = f"import sys\n{statement}\nprint(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return set(result.stdout.split())
+
+
+def test_import_geoshiny():
+    # matplotlib alone takes a few hundred milliseconds to import
+    assert imported_modules("import geoshiny") == set()
+
+
+@pytest.mark.parametrize(
+    "statement,expected,excluded",
+    [
+        ("import geoshiny.extract", {"asyncpg", "shapely"}, {"matplotlib", "pyproj"}),
+        ("import geoshiny.render", {"matplotlib", "shapely"}, {"asyncpg", "pyproj"}),
+        ("from geoshiny import tag_representer", set(), set(HEAVY_MODULES)),
+        # the CLI imports the tile server only when serving
+        ("import geoshiny.__main__", set(), set(HEAVY_MODULES)),
+    ],
+)
+def test_import_paths(statement, expected, excluded):
+    modules = imported_modules(statement)
+    assert expected <= modules
+    assert not excluded & modules
+
+
+def test_lazy_transformer():
+    from geoshiny.types import TRAN_4326_TO_3857, transformer_4326_to_3857
+
+    assert TRAN_4326_TO_3857 is transformer_4326_to_3857()
@@ -0,0 +1,56 @@
+from shapely.geometry import Point
+
+from geoshiny.draw_helpers import data_to_representation
+from geoshiny.memoize import tag_representer, tags_fingerprint
+
+calls = []
+
+
+@tag_representer(maxsize=2)
+def representation(tags):
+    calls.append(tags)
+    if "building" in tags:
+        return dict(levels=int(tags.get("building:levels", 1)))
+
+
+def test_fingerprint():
+    assert tags_fingerprint(dict(a="1", b="2")) == tags_fingerprint(dict(b="2", a="1"))
+    assert tags_fingerprint(dict(a="1")) != tags_fingerprint(dict(a="2"))
+    # not hashable values
+    assert tags_fingerprint(dict(a=[1])) == tags_fingerprint(dict(a=[1]))
+    hash(tags_fingerprint(dict(a=[1])))
+
+
+def test_not_hashable_tags():
+    representation.clear()
+    calls.clear()
+    assert representation(1, Point(0, 0), {"building": "yes", "levels": [1, 2]}) == dict(levels=1)
+    assert representation(2, Point(0, 0), {"levels": [1, 2], "building": "yes"}) == dict(levels=1)
+    assert len(calls) == 1
+
+
+def test_memoized_representer():
+    representation.clear()
+    calls.clear()
+    data = [
+        (1, Point(0, 0), {"building": "yes"}),
+        (2, Point(0, 0), {"building": "yes"}),
+        (3, Point(0, 0), {"highway": "primary"}),
+        (4, Point(0, 0), {"building": "yes", "building:levels": "3"}),
+        (5, Point(0, 0), {"highway": "primary"}),
+        (6, Point(0, 0), {"building": "yes"}),
+    ]
+    reprs = list(data_to_representation(data, representation))
+    assert [(osm_id, r) for osm_id, _, r in reprs] == [
+        (1, dict(levels=1)),
+        (2, dict(levels=1)),
+        (4, dict(levels=3)),
+        (6, dict(levels=1)),
+    ]
+    # building=yes was evicted by the two other tag sets
+    assert len(calls) == 4
+    assert representation.stats.hits == 2
+    assert representation.stats.misses == 4
+    assert representation.stats.evictions == 2
+    assert representation.stats.hit_rate == 2 / 6
+    assert representation.__name__ == "representation"
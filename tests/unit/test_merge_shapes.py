@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+from shapely.geometry import LineString, Polygon, box
+
+from geoshiny.draw_helpers import (
+    figure_to_numpy,
+    merge_shapes,
+    render_shapes_to_figure,
+    representation_to_figure,
+)
+from geoshiny.types import Geometry2DStyle
+
+
+@pytest.fixture
+def grid(extent):
+    """Origin and side of the cells of a 100x100 grid on the extent."""
+    lonmin, latmin, lonmax, _ = extent.as_epsg3857()
+    return lonmin, latmin, (lonmax - lonmin) / 100
+
+
+def cell_box(grid, i, j):
+    lonmin, latmin, step = grid
+    return box(lonmin + i * step, latmin + j * step, lonmin + (i + 1) * step, latmin + (j + 1) * step)
+
+
+def test_merge_shapes(extent, grid):
+    lonmin, latmin, step = grid
+    grey = Geometry2DStyle(facecolor="grey")
+    to_draw = [
+        (cell_box(grid, 0, 0), grey),
+        (cell_box(grid, 1, 0), Geometry2DStyle(facecolor="grey")),
+        # far from the other polygons, they can still be merged
+        (
+            LineString([(lonmin + 50 * step, latmin + 50 * step), (lonmin + 60 * step, latmin + 60 * step)]),
+            Geometry2DStyle(color="red"),
+        ),
+        (cell_box(grid, 2, 0), grey),
+        # with edges, stays alone
+        (cell_box(grid, 3, 0), Geometry2DStyle(facecolor="grey", edgecolor="black")),
+        # another style
+        (cell_box(grid, 0, 1), Geometry2DStyle(facecolor="grey", alpha=0.5)),
+        # with a label
+        (cell_box(grid, 5, 5), Geometry2DStyle(facecolor="grey", label=dict(text="hi"))),
+        # in another cell of the grid
+        (cell_box(grid, 90, 90), grey),
+    ]
+    merged = merge_shapes(to_draw, extent)
+    assert len(merged) == 6
+    first, first_style = merged[0]
+    assert first_style == grey
+    assert first.equals(box(lonmin, latmin, lonmin + 3 * step, latmin + step))
+    assert merged[1][0].equals(cell_box(grid, 90, 90))
+    assert merged[2][0].geom_type == "LineString"
+    assert [s.edgecolor for _, s in merged[3:]] == ["black", None, None]
+
+
+def test_merge_keeps_what_is_on_top(extent, grid):
+    lonmin, latmin, step = grid
+    green = Geometry2DStyle(facecolor="green")
+    blue = Geometry2DStyle(facecolor="blue")
+    # an island in a lake
+    to_draw = [
+        (box(lonmin, latmin, lonmin + 50 * step, latmin + 50 * step), green),
+        (box(lonmin + 10 * step, latmin + 10 * step, lonmin + 40 * step, latmin + 40 * step), blue),
+        (box(lonmin + 20 * step, latmin + 20 * step, lonmin + 30 * step, latmin + 30 * step), green),
+    ]
+    merged = merge_shapes(to_draw, extent)
+    assert [s.facecolor for _, s in merged] == ["green", "blue", "green"]
+    merged_image = figure_to_numpy(render_shapes_to_figure(extent, merged, 200))
+    expected = figure_to_numpy(render_shapes_to_figure(extent, to_draw, 200))
+    assert (merged_image == expected).all()
+
+    # the island does not overlap the first green polygon, but the lake
+    to_draw[0] = (cell_box(grid, 90, 90), green)
+    assert [s.facecolor for _, s in merge_shapes(to_draw, extent)] == ["green", "blue", "green"]
+    # the lake overlaps neither of the greens, they are merged
+    to_draw[2] = (cell_box(grid, 91, 91), green)
+    assert [s.facecolor for _, s in merge_shapes(to_draw, extent)] == ["green", "blue"]
+
+
+def test_merge_invalid_polygons(extent, grid):
+    lonmin, latmin, step = grid
+    # a bow-tie, invalid
+    bow_tie = Polygon(
+        [(lonmin, latmin), (lonmin + step, latmin + step), (lonmin + step, latmin), (lonmin, latmin + step)]
+    )
+    merged = merge_shapes(
+        [(bow_tie, Geometry2DStyle(facecolor="red")), (cell_box(grid, 1, 1), Geometry2DStyle(facecolor="red"))],
+        extent,
+    )
+    assert len(merged) == 1
+    assert merged[0][0].area > 0
+
+
+def test_merged_figure_looks_the_same(extent, grid):
+    reprs = [(i, cell_box(grid, i % 10, i // 10), dict()) for i in range(100)]
+
+    def renderer(osm_id, geom, d):
+        return Geometry2DStyle(facecolor="red" if osm_id % 3 else "blue")
+
+    merged = figure_to_numpy(representation_to_figure(reprs, extent, renderer, figsize=300, merge_styles=True))
+    expected = figure_to_numpy(render_shapes_to_figure(extent, [(g, renderer(i, g, d)) for i, g, d in reprs], 300))
+    # only the antialiasing between the polygons changes
+    assert np.abs(merged.astype(int) - expected).mean() < 1.0
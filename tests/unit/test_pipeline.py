@@ -0,0 +1,117 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import numpy as np
+import pytest
+from matplotlib.image import imread
+from shapely.geometry import box
+
+from geoshiny import pipeline
+from geoshiny.draw_helpers import figure_to_numpy, representation_to_figure
+from geoshiny.pipeline import records_to_file
+from geoshiny.types import Geometry2DStyle
+
+
+def sample_records(extent):
+    lonmin, latmin, lonmax, latmax = extent.as_epsg3857()
+    step = (lonmax - lonmin) / 50
+    return [
+        (i, box(lonmin + i * step, latmin + i * step, lonmin + (i + 5) * step, latmin + (i + 3) * step),
+         dict(building="yes" if i % 3 else "no"))
+        for i in range(50)
+    ]
+
+
+async def records_generator(records):
+    for r in records:
+        yield r
+
+
+def representer(osm_id, geom, tags):
+    if tags["building"] == "yes":
+        return dict(color="red" if osm_id % 2 else "blue")
+
+
+def renderer(osm_id, geom, d):
+    return Geometry2DStyle(facecolor=d["color"], edgecolor="black")
+
+
+@pytest.mark.asyncio
+async def test_records_to_file(tmpdir, monkeypatch, extent):
+    # several batches go through the queues
+    monkeypatch.setattr(pipeline, "PIPELINE_BATCH_SIZE", 7)
+    monkeypatch.setattr(pipeline, "PIPELINE_QUEUE_SIZE", 2)
+    target = str(tmpdir.join("img.png"))
+    await records_to_file(
+        records_generator(sample_records(extent)), target, extent, representer, renderer, figsize=200
+    )
+    reprs = [(i, g, representer(i, g, t)) for i, g, t in sample_records(extent) if representer(i, g, t)]
+    expected = np.flipud(figure_to_numpy(representation_to_figure(reprs, extent, renderer, figsize=200)))
+    assert np.array_equal((imread(target) * 255).round().astype(np.uint8), expected)
+
+
+@pytest.mark.asyncio
+async def test_records_to_file_error(tmpdir, extent):
+    async def failing_generator():
+        for r in sample_records(extent)[:10]:
+            yield r
+        raise RuntimeError("connection lost")
+
+    target = tmpdir.join("img.png")
+    with pytest.raises(RuntimeError):
+        await records_to_file(failing_generator(), str(target), extent, representer, renderer, figsize=200)
+    assert not target.exists()
+
+    def failing_renderer(osm_id, geom, d):
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        await records_to_file(
+            records_generator(sample_records(extent)), str(target), extent, representer, failing_renderer
+        )
+    assert not target.exists()
+
+
+@pytest.mark.asyncio
+async def test_representation_does_not_block_the_loop(tmpdir, monkeypatch, extent):
+    monkeypatch.setattr(pipeline, "PIPELINE_BATCH_SIZE", 10)
+
+    def slow_representer(osm_id, geom, tags):
+        time.sleep(0.005)
+        return representer(osm_id, geom, tags)
+
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.005)
+
+    ticking = asyncio.ensure_future(ticker())
+    await records_to_file(
+        records_generator(sample_records(extent)),
+        str(tmpdir.join("img.png")),
+        extent,
+        slow_representer,
+        renderer,
+        figsize=200,
+    )
+    ticking.cancel()
+    # a batch takes 50ms to represent
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.04
+
+
+@pytest.mark.asyncio
+async def test_single_thread_default_executor(tmpdir, monkeypatch, extent):
+    monkeypatch.setattr(pipeline, "PIPELINE_BATCH_SIZE", 7)
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(1) as default_executor:
+        loop.set_default_executor(default_executor)
+        target = tmpdir.join("img.png")
+        # the stages would wait on each other if they shared the pool
+        await asyncio.wait_for(
+            records_to_file(records_generator(sample_records(extent)), str(target), extent, representer, renderer),
+            timeout=30,
+        )
+    assert target.size() > 1_000
@@ -0,0 +1,135 @@
+import tempfile
+
+import numpy as np
+from matplotlib.image import imread
+from PIL import Image
+import pytest
+from shapely.geometry import box
+
+from geoshiny.types import Geometry2DStyle
+from geoshiny.draw_helpers import figure_to_numpy, render_shapes_to_figure, render_shapes_to_numpy
+from geoshiny.raster_output import (
+    TAG_MODEL_PIXEL_SCALE,
+    TAG_MODEL_TIEPOINT,
+    figure_to_geotiff,
+    half_size,
+    render_shapes_to_memmap,
+    write_geotiff,
+    write_png,
+)
+
+
+def test_strips_match_whole_image(tmpdir, extent, sample_shapes):
+    whole = np.flipud(render_shapes_to_numpy(extent, sample_shapes, figsize=200))
+    strips = render_shapes_to_memmap(
+        extent,
+        sample_shapes,
+        200,
+        filename=str(tmpdir.join("image.npy")),
+        strip_height=32,
+    )
+    assert strips.shape == (200, 200, 4)
+    # only antialiasing at the strip borders can differ
+    assert np.abs(whole.astype(int) - strips).mean() < 0.5
+
+    reloaded = np.load(str(tmpdir.join("image.npy")), mmap_mode="r")
+    assert np.array_equal(reloaded, strips)
+
+
+def test_strips_show_the_same_labels(extent):
+    lonmin, latmin, lonmax, latmax = extent.as_epsg3857()
+    step = (lonmax - lonmin) / 10
+    # less than 5% of the image, but more than 5% of a strip
+    labelled = [
+        (
+            box(lonmin + 4 * step, latmin + 4 * step, lonmin + 6 * step, latmin + 6 * step),
+            Geometry2DStyle(
+                facecolor="white",
+                label=dict(text="X", color="black", fontsize=20),
+                min_label_area_ratio=0.05,
+            ),
+        )
+    ]
+    whole = np.flipud(render_shapes_to_numpy(extent, labelled, figsize=200))
+    strips = render_shapes_to_memmap(extent, labelled, 200, strip_height=32)
+    assert np.array_equal(whole, strips)
+    # no dark pixels from the label
+    assert not ((strips[..., 3] == 255) & (strips[..., :3].max(axis=-1) < 128)).any()
+
+
+def test_blocks_match_whole_image(extent, sample_shapes):
+    whole = np.flipud(render_shapes_to_numpy(extent, sample_shapes, figsize=200))
+    # wider than a block, the last block of each row is narrower
+    blocks = render_shapes_to_memmap(extent, sample_shapes, 200, strip_height=64, block_width=48)
+    assert blocks.shape == (200, 200, 4)
+    assert np.abs(whole.astype(int) - blocks).mean() < 0.5
+    # the blocks are placed in the right columns
+    columns = (blocks[..., 3] > 0).any(axis=0)
+    assert np.array_equal(columns, (whole[..., 3] > 0).any(axis=0))
+
+    with pytest.raises(ValueError):
+        render_shapes_to_memmap(extent, sample_shapes, 200, block_width=2 ** 16)
+
+
+def test_memmap_leaves_no_files(tmpdir, monkeypatch, extent, sample_shapes):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmpdir))
+    image = render_shapes_to_memmap(extent, sample_shapes, 50, strip_height=20)
+    assert image.shape == (50, 50, 4)
+    assert tmpdir.listdir() == []
+
+
+def test_write_png(tmpdir, extent, sample_shapes):
+    image = render_shapes_to_memmap(extent, sample_shapes, 150, height=100, strip_height=30)
+    target = str(tmpdir.join("image.png"))
+    write_png(image, target, strip_height=7)
+    decoded = imread(target)
+    assert decoded.shape == (100, 150, 4)
+    assert np.array_equal((decoded * 255).round().astype(np.uint8), image)
+
+
+def test_write_geotiff(tmpdir, extent, sample_shapes):
+    image = render_shapes_to_memmap(extent, sample_shapes, 120, strip_height=50)
+    for compress in (True, False):
+        for tile_size in (None, 32):
+            target = str(tmpdir.join(f"image_{compress}_{tile_size}.tiff"))
+            write_geotiff(
+                image, target, extent, strip_height=16, compress=compress, tile_size=tile_size, threads=2
+            )
+            with Image.open(target) as decoded:
+                assert np.array_equal(np.asarray(decoded), image)
+                lonmin, latmin, lonmax, latmax = extent.as_epsg3857()
+                assert decoded.tag_v2[TAG_MODEL_TIEPOINT][3:5] == (lonmin, latmax)
+                assert decoded.tag_v2[TAG_MODEL_PIXEL_SCALE][0] == (lonmax - lonmin) / 120
+
+
+def test_geotiff_overviews(tmpdir, extent, sample_shapes):
+    image = render_shapes_to_memmap(extent, sample_shapes, 120, height=101)
+    target = str(tmpdir.join("image.tiff"))
+    write_geotiff(image, target, extent, tile_size=32, overviews=2)
+    with Image.open(target) as decoded:
+        assert decoded.n_frames == 3
+        decoded.seek(1)
+        assert decoded.size == (60, 51)
+        assert np.array_equal(np.asarray(decoded), half_size(image))
+        decoded.seek(2)
+        assert decoded.size == (30, 26)
+
+
+def test_half_size():
+    image = np.zeros((3, 2, 4), dtype=np.uint8)
+    # a red opaque pixel and a transparent black one give a half transparent red
+    image[0, 0] = (255, 0, 0, 255)
+    image[2, 1] = (10, 20, 30, 40)
+    half = half_size(image)
+    assert half.shape == (2, 1, 4)
+    assert tuple(half[0, 0]) == (255, 0, 0, 64)
+    # the last row is repeated
+    assert tuple(half[1, 0]) == (10, 20, 30, 20)
+
+
+def test_figure_to_geotiff(tmpdir, extent, sample_shapes):
+    fig = render_shapes_to_figure(extent, sample_shapes, figsize=64)
+    target = str(tmpdir.join("figure.tiff"))
+    figure_to_geotiff(fig, target, extent, tile_size=16)
+    with Image.open(target) as decoded:
+        assert np.array_equal(np.asarray(decoded), np.flipud(figure_to_numpy(fig)))
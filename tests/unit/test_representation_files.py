@@ -0,0 +1,117 @@
+import json
+
+import pytest
+from shapely.geometry import (
+    GeometryCollection,
+    LineString,
+    MultiLineString,
+    MultiPoint,
+    MultiPolygon,
+    Point,
+    Polygon,
+    box,
+    mapping,
+)
+
+from geoshiny.draw_helpers import data_to_representation_file, file_to_representation
+from geoshiny.representation_files import (
+    file_to_representation_batches,
+    geojson_to_geometries,
+    newline_ranges,
+    representation_files,
+)
+
+SHAPES = [
+    Point(1, 2),
+    LineString([(0, 0), (1, 1), (2, 0)]),
+    Polygon([(0, 0), (4, 0), (4, 4), (0, 4)], [[(1, 1), (2, 1), (2, 2), (1, 2)]]),
+    MultiPoint([(0, 0), (1, 1)]),
+    MultiLineString([[(0, 0), (1, 1)], [(2, 2), (3, 3), (4, 2)]]),
+    MultiPolygon([box(0, 0, 1, 1), box(2, 2, 3, 3)]),
+    GeometryCollection([Point(0, 0), box(0, 0, 1, 1)]),
+    Point(1, 2, 3),
+    Polygon(),
+]
+
+
+def sample_data():
+    return [(i, SHAPES[i % len(SHAPES)], dict(index=i)) for i in range(200)]
+
+
+def keep_even(osm_id, geom, tags):
+    if osm_id % 2 == 0:
+        return tags
+
+
+def test_geojson_to_geometries():
+    converted = geojson_to_geometries([mapping(s) for s in SHAPES + SHAPES])
+    assert len(converted) == 2 * len(SHAPES)
+    for original, geom in zip(SHAPES + SHAPES, converted):
+        assert geom.geom_type == original.geom_type
+        assert geom.equals(original) or (geom.is_empty and original.is_empty)
+        assert geom.has_z == original.has_z
+
+
+def test_newline_ranges(tmpdir):
+    target = str(tmpdir / "reprs.jsonl")
+    data_to_representation_file(sample_data(), target, keep_even)
+    with open(target, "rb") as fh:
+        content = fh.read()
+    ranges = newline_ranges(target, chunk_bytes=500)
+    assert len(ranges) > 5
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(content)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+        assert content[end - 1: end] == b"\n"
+
+
+def test_parallel_read(tmpdir):
+    target = str(tmpdir / "reprs.jsonl")
+    data_to_representation_file(sample_data(), target, keep_even)
+    expected = list(file_to_representation(target))
+    batches = list(file_to_representation_batches(target, processes=2, chunk_bytes=1000))
+    assert len(batches) > 1
+    read = [row for batch in batches for row in batch]
+    assert [(i, r) for i, _, r in read] == [(i, r) for i, _, r in expected]
+    assert all(a.equals(b) or a.is_empty for (_, a, _), (_, b, _) in zip(read, expected))
+
+
+def test_line_separators_in_strings(tmpdir):
+    target = tmpdir / "reprs.jsonl"
+    data = [(i, Point(i, i), dict(name=f"a\u2028b\x85c{i}")) for i in range(3)]
+    with open(target, "w", encoding="utf-8") as fh:
+        for osm_id, geom, representation in data:
+            line = dict(osm_id=osm_id, geojson=mapping(geom), representation=representation)
+            fh.write(json.dumps(line, ensure_ascii=False))
+            fh.write("\n")
+    batches = list(file_to_representation_batches(str(target), processes=1))
+    assert [r for batch in batches for _, _, r in batch] == [r for _, _, r in data]
+
+
+def test_sharded_write(tmpdir):
+    target = str(tmpdir / "shards")
+    data_to_representation_file(sample_data(), target, keep_even, rows_per_shard=30)
+    assert len(tmpdir.join("shards").listdir()) == 4
+    single = str(tmpdir / "reprs.jsonl")
+    data_to_representation_file(sample_data(), single, keep_even)
+
+    expected = [(i, r) for i, _, r in file_to_representation(single)]
+    assert [(i, r) for i, _, r in file_to_representation(target)] == expected
+    batches = file_to_representation_batches(target, processes=2)
+    assert [(i, r) for batch in batches for i, _, r in batch] == expected
+
+    with pytest.raises(FileExistsError):
+        data_to_representation_file(sample_data(), target, keep_even, rows_per_shard=30)
+    with open(single) as fh, pytest.raises(TypeError):
+        data_to_representation_file(sample_data(), fh, keep_even, rows_per_shard=30)
+
+
+def test_many_shards_order(tmpdir):
+    # past 99999 shards the names get longer
+    for name in ("99999.jsonl", "100000.jsonl", "00002.jsonl", "notes.txt"):
+        tmpdir.join(name).write("")
+    assert [f.split("/")[-1] for f in representation_files(str(tmpdir))] == [
+        "00002.jsonl",
+        "99999.jsonl",
+        "100000.jsonl",
+    ]
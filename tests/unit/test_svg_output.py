@@ -0,0 +1,94 @@
+import xml.etree.ElementTree as ET
+
+from shapely.geometry import LineString, MultiPolygon, Point, box
+
+from geoshiny.svg_output import representation_to_svg, write_svg
+from geoshiny.types import Geometry2DStyle
+
+SVG = "{http://www.w3.org/2000/svg}"
+
+
+def test_write_svg(tmpdir, extent):
+    lonmin, latmin, lonmax, latmax = extent.as_epsg3857()
+    step = (lonmax - lonmin) / 10
+    red = Geometry2DStyle(facecolor="red")
+    to_draw = [
+        (box(lonmin, latmin, lonmin + step, latmax), red),
+        (box(lonmin + step, latmin, lonmin + 2 * step, latmax), Geometry2DStyle(facecolor="red")),
+        (
+            LineString([(lonmin, latmin), (lonmax, latmax)]),
+            Geometry2DStyle(color="blue", linewidth=2, linestyle="--"),
+        ),
+        (
+            MultiPolygon([box(lonmin + 3 * step, latmin, lonmin + 4 * step, latmax)]),
+            Geometry2DStyle(facecolor="green", alpha=0.5, label=dict(text="a < b", fontsize=12)),
+        ),
+        (Point(lonmin + 5 * step, latmin + 5 * step), red),
+        (box(lonmin + 6 * step, latmin, lonmin + 7 * step, latmax), red),
+        # smaller than a pixel
+        (box(lonmin, latmin, lonmin + step / 1000, latmin + step / 1000), red),
+    ]
+    target = str(tmpdir / "chart.svg")
+    write_svg(extent, to_draw, target, figsize=100)
+
+    root = ET.parse(target).getroot()
+    assert root.get("width") == "100"
+    groups = root.findall(f"{SVG}g")
+    # polygons and points first, then lines, then labels
+    assert [len(g) for g in groups] == [2, 1, 1, 1, 1, 1]
+    assert groups[0].get("class") == groups[3].get("class")
+    # a point has its own class even with the same style as a polygon
+    assert groups[2][0].tag == f"{SVG}circle"
+    assert groups[2].get("class") != groups[0].get("class")
+    first = groups[0][0].get("d")
+    assert first == "M10,100 10,0 0,0 0,100Z"
+    assert groups[-1][0].text == "a < b"
+
+    css = root.find(f"{SVG}style").text
+    assert f".{groups[0].get('class')}{{fill:#ff0000;fill-rule:evenodd;stroke:none}}" in css
+    # line width and dashes are in points, here 20 DPI
+    line_class = groups[4].get("class")
+    assert f".{line_class}{{" in css
+    line_css = css.split(f".{line_class}{{")[1].split("}")[0]
+    assert "stroke:#0000ff" in line_css
+    assert "stroke-width:0.5556" in line_css
+    assert "stroke-dasharray:" in line_css
+    assert "fill-opacity:0.5" in css
+
+
+def test_label_classes(tmpdir, caplog, extent):
+    lonmin, latmin, lonmax, latmax = extent.as_epsg3857()
+    step = (lonmax - lonmin) / 10
+    to_draw = [
+        (
+            box(lonmin + i * step, latmin, lonmin + (i + 1) * step, latmax),
+            Geometry2DStyle(facecolor="red", label=dict(text=f"label {i}", va="center", bbox=dict(fc="0.8"))),
+        )
+        for i in range(5)
+    ]
+    target = str(tmpdir / "labels.svg")
+    write_svg(extent, to_draw, target, figsize=100)
+    root = ET.parse(target).getroot()
+    groups = root.findall(f"{SVG}g")
+    # all the labels in the same group, with a single CSS rule
+    assert [len(g) for g in groups] == [5, 5]
+    assert [t.text for t in groups[1]] == [f"label {i}" for i in range(5)]
+    css = root.find(f"{SVG}style").text
+    assert css.count("font-size") == 1
+    assert "dominant-baseline:central" in css
+    assert "ignored: bbox" in caplog.text
+
+
+def test_representation_to_svg(tmpdir, extent):
+    lonmin, latmin, lonmax, latmax = extent.as_epsg3857()
+    reprs = [(1, box(lonmin, latmin, lonmax, latmax), dict(kind="a")), (2, Point(0, 0), dict(kind="b"))]
+    target = str(tmpdir / "reprs.svg")
+    representation_to_svg(
+        reprs,
+        extent,
+        lambda osm_id, geom, d: Geometry2DStyle(facecolor="red") if d["kind"] == "a" else None,
+        target,
+        figsize=50,
+    )
+    root = ET.parse(target).getroot()
+    assert [len(g) for g in root.findall(f"{SVG}g")] == [1]
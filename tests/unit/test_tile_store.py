@@ -0,0 +1,85 @@
+import sqlite3
+import sys
+import time
+from multiprocessing import Pool
+from types import ModuleType
+
+from geoshiny import tile_store
+from geoshiny.tile_store import DiskTileStore, style_version
+
+STYLE_VERSION = "v1"
+
+
+def test_style_version():
+    assert style_version(sys.modules[__name__]) == "v1"
+    # no declared version, use the source
+    version = style_version(tile_store)
+    assert len(version) == 16
+    assert version == style_version(tile_store)
+
+
+def test_style_version_without_source():
+    def style_module(color):
+        module = ModuleType("repl_style")
+        exec(f"def renderer(osm_id, geom, d):\n    return {color!r}\n", vars(module))
+        return module
+
+    version = style_version(style_module("red"))
+    assert len(version) == 16
+    assert version == style_version(style_module("red"))
+    assert version != style_version(style_module("blue"))
+
+
+def test_store_and_styles(tmpdir):
+    path = str(tmpdir.join("tiles.mbtiles"))
+    store_v1 = DiskTileStore(path, "v1")
+    store_v2 = DiskTileStore(path, "v2")
+    store_v1.put(3, 1, 2, b"tile1")
+    assert store_v1.get(3, 1, 2) == b"tile1"
+    assert store_v1.get(3, 2, 1) is None
+    # another style does not see it
+    assert store_v2.get(3, 1, 2) is None
+    store_v2.put(3, 1, 2, b"tile2")
+    assert store_v1.get(3, 1, 2) == b"tile1"
+    assert store_v2.get(3, 1, 2) == b"tile2"
+    assert store_v1.size() == 10
+    assert store_v1.delete_style("v2") == 1
+    assert store_v2.get(3, 1, 2) is None
+
+    # MBTiles layout, rows are flipped
+    with sqlite3.connect(path) as conn:
+        rows = conn.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles").fetchall()
+        assert rows == [(3, 1, 5, b"tile1")]
+
+
+def test_eviction(tmpdir, monkeypatch):
+    path = str(tmpdir.join("tiles.mbtiles"))
+    store = DiskTileStore(path, "v1", max_bytes=25, max_age=1000)
+    for x in range(5):
+        store.put(5, x, 0, b"0123456789")
+    # the first ones are the least recently accessed
+    assert store.evict() == 3
+    assert store.get(5, 0, 0) is None
+    assert store.get(5, 4, 0) == b"0123456789"
+
+    # move forward in time, the tiles expire
+    now = time.time()
+    monkeypatch.setattr(tile_store.time, "time", lambda: now + 2000)
+    assert store.get(5, 4, 0) is None
+    assert store.evict() == 2
+    assert store.size() == 0
+
+
+def _write_tiles(args):
+    path, worker = args
+    store = DiskTileStore(path, "v1")
+    for x in range(50):
+        store.put(10, x, worker, b"tile")
+        assert store.get(10, x, worker) == b"tile"
+
+
+def test_multiprocess(tmpdir):
+    path = str(tmpdir.join("tiles.mbtiles"))
+    with Pool(4) as pool:
+        pool.map(_write_tiles, [(path, worker) for worker in range(4)])
+    assert DiskTileStore(path, "v1").size() == 4 * 50 * 4
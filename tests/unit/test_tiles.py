@@ -0,0 +1,155 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+from PIL import Image
+import pytest
+from pytest import approx
+from shapely.geometry import box
+
+from geoshiny.draw_helpers import data_to_representation_file
+from geoshiny.tile_server import make_executor, make_server
+from geoshiny.tiles import (
+    TileCache,
+    TileRenderer,
+    init_tile_worker,
+    is_valid_tile,
+    render_tile,
+    tile_extent,
+    tile_search_extent,
+)
+from geoshiny.types import ExtentDegrees, Geometry2DStyle
+
+
+def representation(osm_id, geom, tags):
+    return dict(kind=tags["kind"])
+
+
+def renderer(osm_id, geom, d):
+    return Geometry2DStyle(facecolor="red" if d["kind"] == "a" else "blue")
+
+
+def test_tile_extent():
+    world = tile_extent(0, 0, 0)
+    assert (world.lonmin, world.lonmax) == (-180.0, 180.0)
+    assert world.latmax == approx(85.0511, abs=1e-4)
+    assert world.latmin == approx(-85.0511, abs=1e-4)
+    # Berlin, the tile must be a square in EPSG:3857
+    lonmin, latmin, lonmax, latmax = tile_extent(16, 35205, 21489).as_epsg3857()
+    assert lonmax - lonmin == approx(latmax - latmin)
+    assert is_valid_tile(2, 3, 3)
+    assert not is_valid_tile(2, 4, 0)
+
+
+def test_low_zoom_tiles(tmpdir):
+    for z, x, y in ((0, 0, 0), (1, 0, 0), (1, 1, 1)):
+        assert all(np.isfinite(tile_search_extent(z, x, y).as_epsg3857()))
+    # 10 degrees around the origin, in the 4 tiles of zoom 1
+    target = str(tmpdir.join("reprs.jsonl"))
+    data_to_representation_file(
+        [(1, box(*ExtentDegrees(latmin=-5, latmax=5, lonmin=-5, lonmax=5).as_epsg3857()), dict(kind="a"))],
+        target,
+        entity_callback=representation,
+    )
+    init_tile_worker(__name__, representation_file=target, tile_size=64)
+    for z, x, y in ((0, 0, 0), (1, 0, 0), (1, 1, 1)):
+        with Image.open(BytesIO(render_tile(z, x, y))) as tile:
+            pixels = np.asarray(tile.convert("RGBA"))
+        # some red pixels
+        assert ((pixels[..., 0] > 200) & (pixels[..., 2] < 50) & (pixels[..., 3] > 0)).any()
+
+
+def test_tile_cache_eviction():
+    cache = TileCache(max_bytes=10)
+    cache.put((0, 0, 0), b"12345")
+    cache.put((1, 0, 0), b"12345")
+    assert cache.get((0, 0, 0)) == b"12345"
+    # the least recently used is (1, 0, 0)
+    cache.put((1, 1, 0), b"123")
+    assert cache.get((1, 0, 0)) is None
+    assert cache.get((1, 1, 0)) == b"123"
+    assert cache.size == 8
+    assert cache.stats.evictions == 1
+    # too big to be cached
+    cache.put((2, 0, 0), b"12345678901")
+    assert cache.get((2, 0, 0)) is None
+
+
+def test_tile_renderer_coalescing():
+    calls = []
+
+    def slow_render(z, x, y):
+        calls.append((z, x, y))
+        time.sleep(0.2)
+        return b"tile"
+
+    with ThreadPoolExecutor(4) as executor:
+        tile_renderer = TileRenderer(slow_render, executor)
+        futures = [tile_renderer.get_tile_future(3, 1, 2) for _ in range(5)]
+        assert [f.result() for f in futures] == [b"tile"] * 5
+        assert tile_renderer.get_tile(3, 1, 2) == b"tile"
+    assert calls == [(3, 1, 2)]
+    assert tile_renderer.cache.stats.coalesced == 4
+    assert tile_renderer.cache.stats.hits == 1
+
+
+def test_tile_renderer_cancelled():
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking_render(z, x, y):
+        if (z, x, y) == (0, 0, 0):
+            started.set()
+            release.wait()
+        return b"tile"
+
+    with ThreadPoolExecutor(1) as executor:
+        tile_renderer = TileRenderer(blocking_render, executor)
+        blocking = tile_renderer.get_tile_future(0, 0, 0)
+        started.wait()
+        # still queued behind the first one
+        assert tile_renderer.get_tile_future(1, 0, 0).cancel()
+        release.set()
+        assert blocking.result() == b"tile"
+        # rendered again, not waiting on the cancelled future
+        assert tile_renderer.get_tile(1, 0, 0) == b"tile"
+    assert tile_renderer.cache.stats.coalesced == 0
+
+
+@pytest.fixture
+def representation_file(tmpdir):
+    lonmin, latmin, lonmax, latmax = tile_extent(16, 35205, 21489).as_epsg3857()
+    target = str(tmpdir.join("reprs.jsonl"))
+    data_to_representation_file(
+        [
+            (1, box(lonmin, latmin, lonmax, (latmin + latmax) / 2), dict(kind="a")),
+            (2, box(lonmin, (latmin + latmax) / 2, lonmax, latmax), dict(kind="b")),
+        ],
+        target,
+        entity_callback=representation,
+    )
+    return target
+
+
+def test_serve_tiles(representation_file):
+    executor = make_executor(
+        __name__, "representation", "renderer", representation_file=representation_file, processes=False
+    )
+    server = make_server(TileRenderer(render_tile, executor), port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(f"{base}/16/35205/21489.png") as response:
+            assert response.headers["Content-Type"] == "image/png"
+            assert response.read().startswith(b"\x89PNG")
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{base}/2/5/0.png")
+    finally:
+        server.shutdown()
+        server.server_close()
+        executor.shutdown()